@@ -0,0 +1,26 @@
+"""Tests run against the TelloSimulator, the other scripts of this folder need a real drone"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulator import TelloSimulator
+from swarm import Swarm
+
+# Scripts talking to a real Tello on 192.168.10.1
+collect_ignore = ['openpipe_udp.py', 'test_connection.py', 'test_state_receiver.py', 'test_video_stream.py']
+
+
+@pytest.fixture
+def simulator():
+    with TelloSimulator(count=2) as sim:
+        yield sim
+
+
+@pytest.fixture
+def swarm(simulator):
+    with Swarm(simulator.ips, state_listener=True, check_connection=False) as connected:
+        yield connected
@@ -0,0 +1,29 @@
+import flight_modes
+
+
+def test_reactive_mode_options_reach_the_key_dispatcher_and_rc(swarm, monkeypatch):
+    created = {}
+
+    class RecordingDispatcher(flight_modes.KeyDispatcher):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created['dispatcher'] = self
+
+    class RecordingRc(flight_modes.RcController):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created['rc'] = self
+
+    monkeypatch.setattr(flight_modes, 'KeyDispatcher', RecordingDispatcher)
+    monkeypatch.setattr(flight_modes, 'RcController', RecordingRc)
+    # Ctrl + C at once
+    monkeypatch.setattr(flight_modes, 'getch', lambda: '\x03')
+
+    swarm.init_flight_mode('reactive', key_max_age=2.0, key_max_repeat=3, duplicate_threshold=2,
+                           rc_control=True, rc_dead_man=0.3, rc_speed=40)
+
+    assert created['dispatcher'].max_age == 2.0
+    assert created['dispatcher'].max_repeat == 3
+    assert created['rc'].dead_man == 0.3
+    assert created['rc'].speed == 40
+    assert swarm.flight_mode.picture_index.threshold == 2
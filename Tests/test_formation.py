@@ -0,0 +1,33 @@
+from time import monotonic
+
+import pytest
+
+from formation import execute_formation, line_formation, plan_formation
+
+
+def test_plan_formation_projects_moves_in_the_body_frame_and_splits_long_ones():
+    current = line_formation(2)
+    target = current + [[0, 100, 0], [-600, 0, 0]]
+    plan = plan_formation(current, target, headings=90, speed=50)
+    # Heading along y : +y is forward, -x is on the left
+    assert plan.rounds == [['go 100 0 0 17', 'go 0 300 0 50'], [None, 'go 0 300 0 50']]
+    assert plan.estimated_time == pytest.approx(2 * (300 / 50 + 1))
+
+
+def test_plan_formation_skips_moves_below_the_sdk_minimum():
+    current = line_formation(3)
+    plan = plan_formation(current, current + [[10, 0, 0], [0, 0, 50], [0, 0, 0]], speed=40, synchronize=False)
+    assert list(plan.skipped) == [0, 2]
+    assert plan.rounds == [[None, 'go 0 0 50 40', None]]
+    with pytest.raises(ValueError):
+        plan_formation(current, current[:2])
+
+
+def test_execute_formation_on_the_simulator(swarm):
+    sent_at = monotonic()
+    swarm.send_all('takeoff')
+    for index in range(len(swarm)):
+        assert swarm.wait_ack(index, sent_at, 10) == 'ok'
+    current = line_formation(2)
+    plan = plan_formation(current, current + [[0, 0, 30], [0, 0, 30]], speed=100)
+    assert execute_formation(swarm, plan) == [['ok', 'ok']]
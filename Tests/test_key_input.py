@@ -0,0 +1,13 @@
+from key_input import coalesce_commands
+
+
+def test_coalesce_commands_merges_repeats_within_the_limits():
+    assert coalesce_commands(['forward 30'] * 5) == ['forward 150']
+    assert coalesce_commands(['forward 30'] * 7, max_repeat=5) == ['forward 150']
+    assert coalesce_commands(['cw 90'] * 5) == ['cw 360']
+    assert coalesce_commands(['up 200'] * 4) == ['up 500']
+
+
+def test_coalesce_commands_keeps_the_other_commands_in_order():
+    commands = ['forward 30', 'forward 30', 'flip f', 'forward 30', 'back 30', 'land']
+    assert coalesce_commands(commands) == ['forward 60', 'flip f', 'forward 30', 'back 30', 'land']
@@ -0,0 +1,48 @@
+import pytest
+
+from mission_language import MissionSyntaxError, compile_mission
+
+
+def test_compile_mission_expands_variables_repeats_and_subroutines():
+    program = compile_mission('\n'.join([
+        'set side 100',
+        'set half $side / 2',
+        'def leg {',
+        '    0-forward ${half}',
+        '    0-cw 90',
+        '}',
+        '0-takeoff  # comment',
+        'repeat 2 as i {',
+        '    call leg',
+        '    1-up $i',
+        '}',
+        'parallel {',
+        '    0-land',
+        '    1-land',
+        '}',
+        'wait_ack 0 5',
+        'wait_state 1 h <= 10',
+    ]))
+    assert program.actions == ['0-takeoff', '0-forward 50', '0-cw 90', '1-up 0', '0-forward 50', '0-cw 90',
+                               '1-up 1', '0-land', '1-land']
+    assert not program.is_flat
+    assert program.steps[-2:] == [('wait_ack', 0, 5.0), ('wait_state', 1, 'h', '<=', 10, 30.0)]
+
+
+@pytest.mark.parametrize('content, message', [
+    ('set a 1/0', 'line 1 : cannot compute 1/0'),
+    ('0-takeoff\nrepeat 2 {\n0-land', 'line 2 : missing }'),
+    ('0-forward $far', 'line 1 : unknown variable far'),
+    ('call square', 'line 1 : unknown subroutine square'),
+    ('wait_state 0 speed > 1', 'line 1 : unknown state field speed'),
+    ('}', 'line 1 : unexpected }'),
+])
+def test_compile_mission_reports_the_line_of_errors(content, message):
+    with pytest.raises(MissionSyntaxError, match=message):
+        compile_mission(content)
+
+
+def test_mission_runs_on_the_simulator(swarm):
+    program = compile_mission('0-takeoff\n1-takeoff\nwait_ack 0 10\nwait_state 1 h >= 50 10')
+    program.run(swarm, delay=0.1)
+    assert swarm.state(0).h >= 50 and swarm.state(1).h >= 50
@@ -0,0 +1,21 @@
+import numpy as np
+
+from mission_scheduler import build_dependencies, parse_actions, segment_distances
+
+
+def test_segment_distances():
+    starts_a = np.array([[0, 0, 0], [0, 0, 0], [0, 0, 0], [5, 5, 5]], dtype=float)
+    ends_a = np.array([[10, 0, 0], [10, 0, 0], [10, 0, 0], [5, 5, 5]], dtype=float)
+    # Crossing, parallel, beyond the end of a, a still drone against a point
+    starts_b = np.array([[5, -5, 3], [0, 4, 0], [13, 4, 0], [5, 5, 9]], dtype=float)
+    ends_b = np.array([[5, 5, 3], [10, 4, 0], [20, 4, 0], [5, 5, 9]], dtype=float)
+    assert np.allclose(segment_distances(starts_a, ends_a, starts_b, ends_b), [3, 4, 5, 4])
+
+
+def test_build_dependencies_orders_the_moves_passing_too_close():
+    actions = ['0-takeoff', '1-takeoff', '0-right 100', '1-left 100', '1-up 50']
+    parsed = parse_actions(actions, 2)
+    # Without safety distance only the order of each drone is kept
+    assert build_dependencies(parsed, 2) == [set(), set(), {0}, {1}, {3}]
+    # Drones 100 cm apart, each one flies over the takeoff of the other
+    assert build_dependencies(parsed, 2, safety_distance=50) == [set(), set(), {0, 1}, {0, 1, 2}, {3}]
@@ -0,0 +1,21 @@
+import numpy as np
+
+from orbit_planner import TAKEOFF_HEIGHT, plan_legs
+
+
+def test_plan_legs_goes_then_turns_towards_the_next_heading():
+    waypoints = np.array([[0, 100, TAKEOFF_HEIGHT], [-100, 100, TAKEOFF_HEIGHT + 40]], dtype=float)
+    legs = plan_legs(waypoints, np.array([90, 180]), center=np.array([0, 1000]), use_curves=False)
+    assert [command for command, _ in legs[0]] == ['go 100 0 0 30']
+    assert [command for command, _ in legs[1]] == ['go 0 100 40 30', 'ccw 90']
+
+
+def test_plan_legs_links_a_ring_with_curves():
+    center = np.array([0.0, 200.0])
+    waypoints = np.array([[0, 100, 50], [100, 200, 50]], dtype=float)
+    legs = plan_legs(waypoints, np.array([90, 180]), center, start_position=(0, 100, 50))
+    command, duration = legs[1][0]
+    # Quarter of a circle of radius 100 cm to the right, the drone heading along y
+    assert command == 'curve 29 -71 0 100 -100 0 30'
+    assert duration > 0
+    assert legs[1][1][0] == 'ccw 90'
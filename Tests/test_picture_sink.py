@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from picture_sink import PictureSink
+
+
+def test_pictures_are_renamed_once_written(tmp_path):
+    with PictureSink(str(tmp_path), picture_format='png', prefix='test') as sink:
+        paths = [sink.add(np.full((8, 8, 3), value, dtype=np.uint8), drone_id=1) for value in range(5)]
+        assert sink.flush(timeout=10) == 5
+        assert len(sink) == 0
+        assert sorted(sink.written) == sorted(paths)
+    assert len(set(paths)) == 5
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for path in paths)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.part')]
+    with Image.open(paths[3]) as picture:
+        assert picture.getpixel((0, 0)) == (3, 3, 3)
+
+
+def test_closed_sink_drops_pictures(tmp_path):
+    sink = PictureSink(str(tmp_path))
+    sink.close()
+    assert sink.add(np.zeros((8, 8, 3), dtype=np.uint8)) is None
+    assert sink.add(None) is None
+    assert os.listdir(tmp_path) == []
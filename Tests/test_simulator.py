@@ -0,0 +1,51 @@
+from time import monotonic, sleep
+
+import pytest
+
+from simulator import SimulatedDrone
+from swarm import Swarm
+
+
+def _flying_drone():
+    drone = SimulatedDrone(0, ('127.0.0.1', 8889))
+    drone.handle('command', 0.0)
+    drone.handle('takeoff', 0.0)
+    drone.update(10.0)
+    return drone
+
+
+def test_yaw_increases_clockwise():
+    drone = _flying_drone()
+    drone.handle('cw 90', 10.0)
+    drone.update(20.0)
+    assert drone.yaw == pytest.approx(90)
+    # Forward after a quarter turn clockwise goes to the right of the start heading
+    drone.handle('forward 100', 20.0)
+    drone.update(30.0)
+    assert drone.position[:2] == pytest.approx([0, -100])
+    drone.handle('ccw 180', 30.0)
+    drone.update(40.0)
+    assert drone.yaw == pytest.approx(-90)
+
+
+def test_rc_moves_for_the_elapsed_time():
+    drone = _flying_drone()
+    drone.handle('rc 0 50 0 0', 10.0)
+    drone.update(10.5)
+    drone.update(12.0)
+    assert drone.position[0] == pytest.approx(100)
+    drone.handle('rc 0 0 0 20', 12.0)
+    drone.update(13.5)
+    assert drone.yaw == pytest.approx(30)
+
+
+def test_keep_alive_pings_a_drone_flown_with_rc(simulator):
+    with Swarm(simulator.ips[:1], check_connection=False, keep_alive=True, idle_timeout=1.5,
+               keep_alive_margin=0.5) as swarm:
+        deadline = monotonic() + 3
+        while monotonic() < deadline:
+            swarm.send_rc(0, 20, 0, 0)
+            sleep(0.1)
+        # rc commands are never acked, the drone must still be pinged and keep answering
+        assert swarm.keep_alive.sent >= 1
+        assert swarm.wait_ack(0, deadline - 3, 1) == 'ok'
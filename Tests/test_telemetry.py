@@ -0,0 +1,28 @@
+import pytest
+
+from telemetry import DroneState, TelemetryBuffer
+
+
+def _buffer(count, capacity=10):
+    buffer = TelemetryBuffer(capacity)
+    for second in range(count):
+        state = DroneState(timestamp=float(second))
+        state.h = second * 10
+        buffer.append(state)
+    return buffer
+
+
+def test_window_keeps_the_last_seconds_once_the_buffer_wrapped():
+    buffer = _buffer(15)
+    assert len(buffer) == 10
+    assert list(buffer.window()['timestamp']) == list(range(5, 15))
+    assert list(buffer.window(3)['h']) == [110, 120, 130, 140]
+    assert list(buffer.window(3, now=10)['timestamp']) == list(range(7, 15))
+
+
+def test_stats_over_a_window():
+    buffer = _buffer(15)
+    stats = buffer.stats(4)
+    assert (stats['min']['h'], stats['max']['h']) == (100, 140)
+    assert stats['mean']['h'] == pytest.approx(120)
+    assert TelemetryBuffer(4).stats() == {}
@@ -0,0 +1,12 @@
+from toolbox import reverse_actions
+
+
+def test_reverse_actions_keeps_negative_values():
+    actions = ['0-command', '0-takeoff', '0-go -20 30 -40 10', '1-forward 50', '0-cw 90']
+    assert reverse_actions(actions) == ['0-ccw 90', '1-back 50', '0-go 20 -30 40 10', '0-land']
+
+
+def test_reverse_curve_flies_the_same_arc_backward():
+    assert reverse_actions(['0-curve 50 50 0 100 0 0 20']) == ['0-curve -50 50 0 -100 0 0 20']
+    # Middle point of the way back too close to the end for the SDK : straight line instead
+    assert reverse_actions(['2-curve 90 10 0 100 0 0 20']) == ['2-go -100 0 0 20']
@@ -3,15 +3,26 @@
 import os
 import re
 import socket
+import logging
 import platform
 import ipaddress
-from time import sleep
-from threading import Thread
+from time import sleep, monotonic
+from threading import Thread, Condition, Event, current_thread
+from collections import deque, defaultdict
 from abc import ABC, abstractmethod
 from subprocess import Popen, PIPE
 import numpy as np
 
 from video_stream import VideoStream
+from picture_sink import PictureSink
+from image_quality import best_frame
+from telemetry import CompletionDetector
+from telemetry_export import TelemetryExporter
+from metrics import DroneMetrics, MetricsServer
+from event_log import log_event, configure_logging
+from tracing import TRACER, span
+from shared_listener import SharedListener
+from keep_alive import KeepAliveService
 from flight_modes import AbstractFlightMode, ActFromFileMode, ActFromActionListMode, ReactiveMode, OpenPipeMode, PictureMission
 
 # All av related thing is just test compatibility for Windows
@@ -60,31 +71,93 @@ class AbstractDrone(ABC):
         self.state_thread = self.ack_thread = self.video_thread = None
         #Store all moves done by the drone to reverse them and allow drones to return to base
         self.all_instructions = []
-        #Store the last state from the drone
+        #Store the last state (DroneState) from each drone
         self.last_parameters = []
+        #Bounded history of the states of each drone (TelemetryBuffer)
+        self.telemetry = []
+        self.telemetry_capacity = kwargs.get('telemetry_capacity', 36000)
+        #Optional export of every state to files ('parquet', 'npz', 'csv' or True for the best available)
+        self.telemetry_export = kwargs.get('telemetry_export', False)
+        self.telemetry_dir = kwargs.get('telemetry_dir')
+        self.telemetry_exporter = None
+        #Opt-in: advance to the next command as soon as the telemetry shows the drone has stopped
+        self.completion_detector = CompletionDetector() if kwargs.get('wait_completion', False) else None
 
         self._end_connection = False
-
-        self.local_address_command = ('', 9010)
-        self.local_address_state = ('', 8890)
-        self.local_address_video = ('', 11111)
+        #Set once the connection is closed, the receiving threads and the waits stop on it
+        self.shutdown_event = Event()
+        #Maximum time spent joining the receiving threads when the connection is closed
+        self.shutdown_timeout = kwargs.get('shutdown_timeout', 2.0)
+        #Last acks received (index, response, monotonic time, send time of the command answered or None)
+        self.acks = deque(maxlen=256)
+        self._ack_condition = Condition()
+        #Send times of the commands of each drone still waiting for their ack, a drone answers its commands in order
+        self._unacked = defaultdict(lambda: deque(maxlen=256))
+        #Delay after which a command without ack is considered lost
+        self.ack_timeout = kwargs.get('ack_timeout', 7.0)
+        #Functions called with (index, response) for every ack, used by the control server subscriptions
+        self.ack_listeners = []
+        #Counters and histograms (see metrics()), optionally served as Prometheus text on localhost
+        self._metrics = DroneMetrics()
+        self.metrics_port = kwargs.get('metrics_port')
+        self.metrics_server = None
+        #Monotonic time of the last command sent to each drone (by IP, indices shift when a Swarm drops a drone),
+        #the keep-alive service only pings idle drones
+        self.last_sent = {}
+        self.keep_alive = KeepAliveService(self, idle_timeout=kwargs.get('idle_timeout', 15.0),
+                                           margin=kwargs.get('keep_alive_margin', 5.0))
+        self.keep_alive_enabled = kwargs.get('keep_alive', False)
+
+        #Command port 0 lets the system pick a free port, drones answer to the port the command came from
+        self.local_address_command = ('', kwargs.get('command_port', 0))
+        #Drones send their state and video to fixed ports, these are shared by every controller of the process
+        self.state_port = kwargs.get('state_port', 8890)
+        self.video_port = kwargs.get('video_port', 11111)
+        #Drones which refused the 'port' command (SDK older than 3.0), see check_port
+        self.port_refused = []
 
         self.video_stream = kwargs.get('video_stream', False)
         self.state_listener = kwargs.get('state_listener', False)
         self.back_to_base = kwargs.get('back_to_base', False)
+        # ping/arp checks only work with real drones (disable it with the simulator)
+        self.check_connection = kwargs.get('check_connection', True)
+        #Messages go through the pyTelloSDK logger (rate limited), verbose also shows the debug events
+        configure_logging(kwargs.get('verbose', False))
+        #Opt-in timeline of the flight, dumped as Chrome/Perfetto trace JSON when the connection ends
+        self.trace_file = kwargs.get('trace')
+        if self.trace_file is not None:
+            TRACER.enable()
 
         self.flight_mode: AbstractFlightMode = None
 
         self.last_frame: bytes = None
+        # Incremented each time a new frame is decoded, lets consumers skip frames they already used
+        self.frame_seq = 0
+        self.last_frame_time = 0.0
         self.video_frames = VideoStream()
         self.av_target_opened = False
 
+        # Pictures are encoded and written in the background
+        self.picture_sink = PictureSink(directory=kwargs.get('picture_dir'),
+                                        picture_format=kwargs.get('picture_format', 'jpeg'),
+                                        quality=kwargs.get('picture_quality', 90))
+
     def __del__(self):
         """Try to close all the sockets"""
         # print('Drone deletion')
+        # __init__ may have failed before the sink was created
+        picture_sink = getattr(self, 'picture_sink', None)
+        if picture_sink is not None:
+            picture_sink.close()
         if self.all_instructions:
             print('Mission completed successfully!')
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
     @property
     def status(self):
         """Simple check of the state of the drone"""
@@ -104,42 +177,108 @@ class AbstractDrone(ABC):
     @end_connection.setter
     def end_connection(self, value):
         """If the flag is raised, all sockets are being closed"""
+        # Once the sockets are closed the connection can't be restored
+        if self.shutdown_event.is_set():
+            return
         self._end_connection = value
         if value:
-            if self.command_socket is not None:
-                self.command_socket.close()
-            if self.state_socket is not None:
-                self.state_socket.close()
-            if self.videostream_socket is not None:
-                self.videostream_socket.close()
+            self._shutdown()
+
+    def close(self):
+        """End the connection, the receiving threads are woken up and joined"""
+        self.end_connection = True
+
+    def _shutdown(self):
+        """Stop every receiving thread (at most shutdown_timeout seconds) then release the resources"""
+        self.shutdown_event.set()
+        with self._ack_condition:
+            self._ack_condition.notify_all()
+        sockets = [sock for sock in (self.command_socket, self.state_socket, self.videostream_socket) if sock is not None]
+        for sock in sockets:
+            if isinstance(sock, socket.socket):
+                self._wake_up(sock)
+            else:
+                # Subscription to a shared listener
+                sock.close()
+
+        deadline = monotonic() + self.shutdown_timeout
+        self.keep_alive.close(self.shutdown_timeout)
+        for thread in (self.ack_thread, self.state_thread, self.video_thread):
+            # The connection can be closed from one of the receiving threads
+            if thread is not None and thread is not current_thread():
+                thread.join(max(0, deadline - monotonic()))
+        for sock in sockets:
+            sock.close()
+
+        if self.trace_file is not None:
+            self.dump_trace(self.trace_file)
+            self.trace_file = None
+        if self.telemetry_exporter is not None:
+            self.telemetry_exporter.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
+
+    @staticmethod
+    def _wake_up(sock):
+        """Unblock a thread waiting in recvfrom on this socket"""
+        try:
+            # Enough on Linux
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            # Other systems : an empty datagram sent to the local port
+            port = sock.getsockname()[1]
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as waker:
+                waker.sendto(b'', ('127.0.0.1', port))
+        except OSError:
+            pass
 
     @property
     def threads_alive(self):
         """Determine if some parallel threads are running"""
         existing_threads = [thread for thread in (self.video_thread, self.ack_thread, self.state_thread) if thread is not None]
-        return len([thread for thread in existing_threads if thread.isAlive()])
+        return len([thread for thread in existing_threads if thread.is_alive()])
 
     def init_drone_sockets(self):
         """Forced the drone to use SDK mode and enable its modules"""
         self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.command_socket.bind(self.local_address_command)
+        self.local_address_command = self.command_socket.getsockname()
+
+        if self.metrics_port is not None:
+            self.metrics_server = MetricsServer(self._metrics, self.metrics_port)
 
-        self.ack_thread = Thread(target=self.receive_ack)
+        self.ack_thread = Thread(target=self.receive_ack, name='ack')
         self.ack_thread.start()
+        if self.keep_alive_enabled:
+            self.keep_alive.start()
 
         if self.state_listener:
-            self.state_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.state_socket.bind(self.local_address_state)
+            # Packets of our drones only, read like a socket
+            try:
+                self.state_socket = SharedListener.subscribe(self.state_port, self.ip_addresses)
+            except ValueError:
+                self.end_connection = True
+                raise
+
+            if self.telemetry_export:
+                file_format = self.telemetry_export if isinstance(self.telemetry_export, str) else None
+                self.telemetry_exporter = TelemetryExporter(self.telemetry_dir, file_format)
 
-            self.state_thread = Thread(target=self.receive_state, args=(self.last_parameters,))
+            self.state_thread = Thread(target=self.receive_state, args=(self.last_parameters,), name='state')
             self.state_thread.start()
 
         if self.video_stream and (LIB_AVAILABLE or AV_AVAILABLE):
-            self.videostream_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.videostream_socket.bind(self.local_address_video)
+            try:
+                self.videostream_socket = SharedListener.subscribe(self.video_port, self.ip_addresses)
+            except ValueError:
+                self.end_connection = True
+                raise
             self.videostream_socket.settimeout(6)
 
-            self.video_thread = Thread(target=self.receive_frame)
+            self.video_thread = Thread(target=self.receive_frame, name='video')
             self.video_thread.start()
 
     @classmethod
@@ -260,10 +399,10 @@ class AbstractDrone(ABC):
         if self.is_connected:
             flight_mode = flight_mode.lower().strip()
             if flight_mode == 'open pipe':
-                self.flight_mode = OpenPipeMode(self)
+                self.flight_mode = OpenPipeMode(self, **options)
 
             elif flight_mode == 'reactive':
-                self.flight_mode = ReactiveMode(self)
+                self.flight_mode = ReactiveMode(self, **options)
 
             elif flight_mode == 'act from file':
                 if options.get('filename') is None:
@@ -294,25 +433,161 @@ class AbstractDrone(ABC):
             else:
                 print('flight mode was not initialised')
 
+    def check_port(self, sent_times: dict):
+        """
+        Wait for the answers to the 'port' commands sent at sent_times (index -> monotonic time)
+        Only the SDK 3.0 knows 'port', the other drones keep sending to 8890 / 11111 : they are returned and logged
+        """
+        self.port_refused = [index for index, sent_at in sent_times.items()
+                             if self.wait_ack(index, sent_at, max(0, sent_at + self.ack_timeout - monotonic())) != 'ok']
+        if self.port_refused:
+            log_event('connection', logging.WARNING,
+                      "Drones %s refused 'port %s %s' (Tello SDK 3.0 needed), their state and video won't be received",
+                      self.port_refused, self.state_port, self.video_port)
+        return self.port_refused
+
+    def command_sent(self, index: int, message: str):
+        """Bookkeeping of every command sent to a drone, called just before the datagram leaves"""
+        self._metrics.command_sent(index, message)
+        # rc commands are never acked, the keep-alive must still ping the drone so its ack socket hears from it
+        if message.startswith('rc '):
+            return
+        with self._ack_condition:
+            self._unacked[index].append(monotonic())
+        try:
+            self.last_sent[self.ip_addresses[index]] = monotonic()
+        except IndexError:
+            pass
+
+    def awaiting_ack(self, index: int = 0):
+        """True while the last commands of the drone did not get their ack (at most 7 s)"""
+        return self._metrics.awaiting_ack(index)
+
+    def send_raw(self, message: str, index: int = 0):
+        """
+        Send a message without connection check, not recorded for the return to base (rc sticks, keep-alives)
+        Return False if it could not be sent
+        """
+        try:
+            address = (self.ip_addresses[index], 8889)
+            self.command_sent(index, message)
+            self.command_socket.sendto(message.encode(), address)
+        except (OSError, IndexError, AttributeError) as exc:
+            log_event('send', logging.WARNING, 'Drone %s - Could not send %s: %s', index, message, exc)
+            return False
+        log_event('send', logging.DEBUG, 'Drone %s - Sending message: %s', index, message)
+        return True
+
+    def send_each(self, commands: list):
+        """Send commands[index] to each drone (None skips a drone), see Swarm.send_each"""
+        for index, message in enumerate(commands):
+            if message is not None and self.is_connected:
+                self.send(message, index)
+
+    def send_rc(self, left_right: int, forward_backward: int, up_down: int, yaw: int, index: int = 0):
+        """Send an 'rc' command (sticks from -100 to 100), made to be streamed : drones don't ack it"""
+        return self.send_raw(f'rc {left_right} {forward_backward} {up_down} {yaw}', index)
+
+    def state(self, index: int = 0):
+        """Last DroneState received from the drone (None until the first state packet)"""
+        try:
+            return self.last_parameters[index]
+        except IndexError:
+            return None
+
+    def metrics(self):
+        """Snapshot of the command, state and video metrics"""
+        return self._metrics.snapshot()
+
+    def dump_trace(self, path: str):
+        """Write the spans recorded so far as Chrome/Perfetto trace JSON"""
+        return TRACER.dump(path)
+
+    def record_ack(self, index: int, response: str):
+        """Store an ack with the send time of the command it answers and wake up the threads waiting for it"""
+        self._metrics.ack_received(index)
+        now = monotonic()
+        with self._ack_condition:
+            pending = self._unacked[index]
+            # Commands unanswered for ack_timeout are lost, the ack belongs to the oldest command left
+            while pending and now - pending[0] > self.ack_timeout:
+                pending.popleft()
+            sent_at = pending.popleft() if pending else None
+            self.acks.append((index, response, now, sent_at))
+            self._ack_condition.notify_all()
+        for listener in list(self.ack_listeners):
+            listener(index, response)
+
+    def wait_ack(self, index: int = 0, since: float = None, timeout: float = 7.0):
+        """
+        Return the ack of the first command sent to the drone after 'since' (monotonic time), None on timeout
+        Late acks of older commands are skipped, an ack matched with no command counts from its reception time
+        """
+        since = monotonic() if since is None else since
+        deadline = monotonic() + timeout
+        with span('ack wait', drone=index), self._ack_condition:
+            while True:
+                for ack_index, response, received_at, sent_at in self.acks:
+                    if ack_index == index and (received_at if sent_at is None else sent_at) >= since:
+                        return response
+                remaining = deadline - monotonic()
+                if remaining <= 0 or not self.is_connected:
+                    return None
+                self._ack_condition.wait(remaining)
+
+    def wait_for_completion(self, index: int, since: float, delay: float):
+        """
+        Wait until the drone has stopped after a command sent at 'since' (monotonic time)
+        Without the completion detector (or without state) this is a timed wait of delay seconds
+        Return True if the telemetry showed the drone stopped
+        """
+        if self.completion_detector is None or not self.state_listener or index >= len(self.telemetry):
+            with span('sleep', drone=index, delay=delay):
+                self.shutdown_event.wait(max(0, since + delay - monotonic()))
+            return False
+        with span('wait completion', drone=index, delay=delay):
+            return self.completion_detector.wait(self.telemetry[index], since, delay, self.shutdown_event)
+
     def take_picture(self):
         """Add a picture to the attribute"""
         return self.last_frame
 
-    @classmethod
-    def save_pictures(cls, picture_list: list):
+    def take_best_picture(self, burst: int = 5, timeout: float = 1.0):
+        """
+        Collect a burst of distinct decoded frames and keep the sharpest well exposed one
+        Fall back on the last frame if no new frame arrived before the timeout
+        """
+        frames = []
+        seen_seq = None
+        deadline = monotonic() + timeout
+        with span('picture burst', burst=burst):
+            while len(frames) < burst and monotonic() < deadline:
+                frame_seq = self.frame_seq
+                if frame_seq != seen_seq and self.last_frame is not None:
+                    frames.append(self.last_frame)
+                    seen_seq = frame_seq
+                else:
+                    sleep(0.01)
+        if not frames:
+            return self.take_picture()
+        with span('best frame', frames=len(frames)):
+            return best_frame(frames)
+
+    def update_last_frame(self, picture):
+        """Store a freshly decoded picture and bump the frame sequence counter"""
+        self.last_frame = picture
+        self.last_frame_time = monotonic()
+        self.frame_seq += 1
+
+    def save_picture(self, picture, index: int = 0):
+        """Queue one picture to be written in the background, return its future path"""
+        return self.picture_sink.add(picture, drone_id=index)
+
+    def save_pictures(self, picture_list: list):
         """Saved all given pictures to the dedicated folder"""
-        dir_path = os.path.dirname(os.path.realpath(__file__))
-        dir_picture = os.path.sep.join((dir_path, 'pictures'))
-        if not os.path.exists(dir_picture):
-            os.makedirs(dir_picture)
-            print(picture_list)
-
-        for index, image in enumerate(picture_list):
-            if image is not None:
-                picture_path = os.path.sep.join((dir_picture, f'test-{index}.jpg'))
-                image.save(picture_path)
-            else:
-                print('One of the saved picture was empty')
+        for picture in picture_list:
+            self.save_picture(picture)
+        self.picture_sink.flush()
 
     def execute_actions(self, actions: list):
         """ Execute all actions """
@@ -331,17 +606,18 @@ class AbstractDrone(ABC):
                 # If no index is specified
                 index = 0
 
+            sent_at = monotonic()
             self.send(action_to_do, index)
             action_index += 1
             # Don't wait if there is no actions left
             if action_index < len(actions):
-                sleep(3)
+                self.wait_for_completion(index, sent_at, 3)
 
     def process_frame(self, data: bytes = None):
         """Tranform h264 Images to RGB """
         res_frame_list = []
         if not LIB_AVAILABLE and not AV_AVAILABLE:
-            print('Libh264decoder unavailable')
+            log_event('frame', logging.WARNING, 'Libh264decoder unavailable')
             # Throw explicit error
 
         else:
@@ -349,11 +625,11 @@ class AbstractDrone(ABC):
                 frames = DECODER.decode(data)
             elif AV_AVAILABLE:
                 if not self.av_target_opened:
-                    print('\nquarter\n')
+                    log_event('frame', logging.DEBUG, 'Opening the av h264 container')
                     container = av.open(self.video_frames, mode='r', format='h264')
                     self.av_target_opened = True
                 frames = container.decode(video=0)
-                print(len(frames))
+                log_event('frame', logging.DEBUG, '%s frames decoded', len(frames))
             for framedata in frames:
                 (frame, width, height, row_size) = framedata
                 if frame is not None:
@@ -363,6 +639,11 @@ class AbstractDrone(ABC):
                     res_frame_list.append(frame)
         return res_frame_list
 
+    @property
+    @abstractmethod
+    def ip_addresses(self):
+        """Abstract property which should return the IP addresses of the drones"""
+
     @abstractmethod
     def test_drone_connection(self):
         """Abstract method which should be used to test if the drone is still connected"""
@@ -0,0 +1,216 @@
+"""
+Benchmark suite run against the local simulator (see simulator.py)
+Results are written as JSON so two commits can be compared :
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --video record.h264
+
+Measured :
+    - command round trip (p50 / p99) of TelloEDU.send until the ack is received, with and without the connection check
+      (ping and arp) run by every send
+    - time of a Swarm-wide command as the number of drones grows
+    - wall time of AbstractDrone.get_all_drones (pings the local networks)
+    - video reassembly / decoding fps and CPU time per frame (needs an H.264 recording and a decoder), the simulator
+      runs in its own process so only the CPU time of the client is counted
+    - memory growth of a long session with the state listener enabled
+"""
+
+import os
+import json
+import logging
+import platform
+import argparse
+import tracemalloc
+import multiprocessing
+from contextlib import redirect_stdout
+from datetime import datetime
+from subprocess import Popen, PIPE
+from time import monotonic, process_time, sleep
+import numpy as np
+
+from simulator import TelloSimulator
+from tello_edu import TelloEDU
+from swarm import Swarm
+from abstract_drone import AbstractDrone, NO_VIDEO_DECODER
+
+__all__ = ['bench_command_rtt', 'bench_swarm_fanout', 'bench_discovery', 'bench_video', 'bench_memory', 'run_all']
+
+def _percentiles(values: list):
+    """Summary of a list of durations in milliseconds"""
+    if not values:
+        return {'count': 0}
+    array = np.array(values) * 1000
+    return {'count': len(values), 'mean_ms': float(array.mean()), 'p50_ms': float(np.percentile(array, 50)),
+            'p99_ms': float(np.percentile(array, 99)), 'max_ms': float(array.max())}
+
+
+class _LoopbackTello(TelloEDU):
+    """TelloEDU running the real ping and arp of the connection check, the simulator has no Tello MAC address"""
+    @classmethod
+    def still_connected(cls, device_ip: str):
+        super().still_connected(device_ip)
+        return True
+
+
+def bench_command_rtt(commands: int = 200, latency: float = 0.0, check_connection: bool = False):
+    """Round trip of TelloEDU.send until the ack is received, check_connection adds the ping and arp of every send"""
+    drone_class = _LoopbackTello if check_connection else TelloEDU
+    with TelloSimulator(1, latency=latency) as simulator:
+        try:
+            drone = drone_class(simulator.ips[0], check_connection=check_connection)
+        except OSError as exc:
+            return {'skipped': f'connection check unavailable : {exc}'}
+        with drone:
+            rtts = []
+            lost = 0
+            for _ in range(commands):
+                sent_at = monotonic()
+                drone.send('battery?')
+                if drone.wait_ack(0, sent_at, timeout=1) is None:
+                    lost += 1
+                else:
+                    rtts.append(monotonic() - sent_at)
+    result = _percentiles(rtts)
+    result['lost'] = lost
+    return result
+
+
+def bench_swarm_fanout(sizes: tuple = (1, 2, 4, 8, 16, 32), repeats: int = 10, latency: float = 0.0):
+    """Time to send one command to every drone of a Swarm and receive all the acks"""
+    results = []
+    for size in sizes:
+        with TelloSimulator(size, latency=latency) as simulator:
+            with Swarm(simulator.ips, check_connection=False) as swarm:
+                durations = []
+                for _ in range(repeats):
+                    sent_at = monotonic()
+                    for index in range(len(swarm)):
+                        swarm.send('battery?', index)
+                    if all(swarm.wait_ack(index, sent_at, timeout=2) is not None for index in range(len(swarm))):
+                        durations.append(monotonic() - sent_at)
+        result = _percentiles(durations)
+        result['drones'] = size
+        results.append(result)
+    return results
+
+
+def bench_discovery():
+    """Wall time of the automatic drone discovery on the networks of this computer"""
+    start = monotonic()
+    try:
+        drones = AbstractDrone.get_all_drones()
+    except (OSError, ValueError) as exc:
+        return {'error': str(exc), 'seconds': monotonic() - start}
+    return {'seconds': monotonic() - start, 'drones_found': len(drones)}
+
+
+def _serve_simulator(simulator_kwargs: dict, ready, stop, video_packets):
+    """Body of the simulator process of the video benchmark"""
+    with TelloSimulator(**simulator_kwargs) as simulator:
+        ready.set()
+        while not stop.wait(0.1):
+            video_packets.value = simulator.video_packets_sent
+
+
+def bench_video(video_file: str = None, duration: float = 10.0):
+    """Frames reassembled and decoded per second by receive_frame / process_frame, CPU time per frame"""
+    if video_file is None:
+        return {'skipped': 'no H.264 recording given (--video)'}
+    if NO_VIDEO_DECODER:
+        return {'skipped': 'no h264 decoder available'}
+    # The simulator streams from another process, process_time() only counts the client
+    context = multiprocessing.get_context('spawn')
+    ready, stop, video_packets = context.Event(), context.Event(), context.Value('q', 0)
+    simulator = context.Process(target=_serve_simulator, name='video-simulator', daemon=True,
+                                args=({'count': 1, 'video_file': video_file}, ready, stop, video_packets))
+    simulator.start()
+    try:
+        if not ready.wait(10):
+            return {'error': 'the simulator did not start'}
+        with TelloEDU('127.0.0.1', video_stream=True, check_connection=False) as drone:
+            # receive_frame waits before reading the stream
+            sleep(5)
+            first_frame, first_packets = drone.frame_seq, video_packets.value
+            start, cpu_start = monotonic(), process_time()
+            sleep(duration)
+            frames = drone.frame_seq - first_frame
+            elapsed, cpu = monotonic() - start, process_time() - cpu_start
+            packets = video_packets.value - first_packets
+    finally:
+        stop.set()
+        simulator.join(5)
+    return {'fps': frames / elapsed, 'packets_per_second': packets / elapsed,
+            'cpu_ms_per_frame': cpu * 1000 / frames if frames else None}
+
+
+def bench_memory(duration: float = 60.0, drones: int = 4):
+    """Python memory growth of a Swarm with the state listener during a long session"""
+    tracemalloc.start()
+    with TelloSimulator(drones) as simulator:
+        with Swarm(simulator.ips, state_listener=True, check_connection=False) as swarm:
+            sleep(1)
+            start_memory, _ = tracemalloc.get_traced_memory()
+            start = monotonic()
+            while monotonic() - start < duration:
+                for index in range(len(swarm)):
+                    swarm.send('battery?', index)
+                sleep(1)
+            end_memory, peak_memory = tracemalloc.get_traced_memory()
+            states = sum(len(buffer) for buffer in swarm.telemetry)
+    tracemalloc.stop()
+    return {'seconds': duration, 'drones': drones, 'states_received': states,
+            'start_bytes': start_memory, 'end_bytes': end_memory, 'peak_bytes': peak_memory,
+            'growth_bytes_per_minute': (end_memory - start_memory) * 60 / duration}
+
+
+def _git_commit():
+    """Commit of the working tree, None outside of a git repository"""
+    try:
+        request = Popen(['git', 'rev-parse', 'HEAD'], stdout=PIPE, stderr=PIPE,
+                        cwd=os.path.dirname(os.path.realpath(__file__)))
+    except OSError:
+        return None
+    output = request.communicate()[0].decode().strip()
+    return output or None
+
+
+def run_all(arguments):
+    """Run every benchmark and return the results as a dict"""
+    results = {
+        'commit': _git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+    # The drone classes print every message, keep the terminal clean
+    logging.getLogger('pyTelloSDK').addHandler(logging.NullHandler())
+    logging.getLogger('pyTelloSDK').setLevel(logging.ERROR)
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        results['command_rtt'] = bench_command_rtt(arguments.commands, arguments.latency)
+        results['command_rtt_checked'] = bench_command_rtt(arguments.commands, arguments.latency, check_connection=True)
+        results['swarm_fanout'] = bench_swarm_fanout(tuple(arguments.sizes), latency=arguments.latency)
+        results['discovery'] = bench_discovery() if arguments.discovery else {'skipped': 'use --discovery'}
+        results['video'] = bench_video(arguments.video, arguments.video_duration)
+        results['memory'] = bench_memory(arguments.memory_duration, arguments.memory_drones)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the API against simulated drones')
+    parser.add_argument('--output', default=None, help='JSON file (default prints on stdout)')
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated ack latency in seconds')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--discovery', action='store_true', help='also time get_all_drones (pings every local network)')
+    parser.add_argument('--video', default=None, help='raw H.264 recording used for the video benchmark')
+    parser.add_argument('--video-duration', type=float, default=10.0)
+    parser.add_argument('--memory-duration', type=float, default=60.0)
+    parser.add_argument('--memory-drones', type=int, default=4)
+    args = parser.parse_args()
+
+    report = json.dumps(run_all(args), indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, 'w') as output_file:
+            output_file.write(report + '\n')
@@ -0,0 +1,394 @@
+"""
+Local control server : several programs drive the same connected drone or Swarm without owning it
+
+Clients connect to a localhost TCP port or to a Unix socket and exchange newline delimited JSON messages.
+A request is {"id": 1, "method": "send", "params": {...}}, the answer {"id": 1, "result": ...} or {"id": 1, "error": "..."}.
+Requests can be pipelined : answers come as soon as they are ready and carry the id of their request. A JSON list of
+requests is a batch, answered by one list once every request of the batch is done.
+
+    send       {"command": "takeoff", "index": 0, "timeout": 10}   without timeout the answer doesn't wait for the ack
+    send_all   {"command": "land", "timeout": 10}
+    execute    {"actions": ["0-takeoff", "1-takeoff"]}             like execute_actions, answered at the end
+    wait_ack   {"index": 0, "timeout": 7}                           next ack of the drone
+    state      {"index": 0}                                         last state as a dict (null before the first one)
+    metrics    {}
+    drones     {}                                                   IP addresses of the drones
+    subscribe  {"topic": "ack"} or {"topic": "state", "period": 0.1}
+    unsubscribe {"topic": "state"}
+
+Subscribed events are pushed as {"event": "ack", "index": 0, "response": "ok"} or
+{"event": "state", "index": 0, "state": {...}}. Messages wait in a bounded queue of each client, a client which stops
+reading is disconnected when it is full (max_queued).
+
+The commands of a drone go through its own queue : the next one is sent once the drone answered the previous one or
+after ack_timeout, whichever client sent them, so every request gets the ack of its own command. The drones don't wait
+for each other and a slow request never blocks the requests of the other drones. An ack arriving after ack_timeout and
+the commands sent by the controller itself (not through the server) can still be mistaken for the answer of a request
+"""
+
+import os
+import json
+import queue
+import socket
+import logging
+import socketserver
+from time import monotonic
+from threading import Thread, Lock, Event
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from event_log import log_event
+from mission_scheduler import parse_actions
+
+__all__ = ['ControlServer']
+
+# Methods answered at once in the reading thread
+INLINE_METHODS = ('state', 'metrics', 'drones', 'subscribe', 'unsubscribe')
+
+
+class _Client:
+    """
+    One connection : its subscriptions and a bounded queue of outgoing messages written by its own thread
+    A client which doesn't read its messages is disconnected once the queue is full, it never blocks the drone threads
+    """
+    def __init__(self, server, connection, wfile, max_queued: int = 1000):
+        self.server = server
+        self.connection = connection
+        self.wfile = wfile
+        self.closed = Event()
+        self.state_thread = None
+        self.ack_listener = None
+        self._outgoing = queue.Queue(max_queued)
+        self._writer = Thread(target=self._write_loop, name='control-writer', daemon=True)
+        self._writer.start()
+
+    def write(self, message):
+        """Queue a message, never blocks (called from the ack thread of the drone too)"""
+        if self.closed.is_set():
+            return
+        try:
+            self._outgoing.put_nowait(message)
+        except queue.Full:
+            log_event('control', logging.WARNING, 'Client too slow, %s messages waiting : disconnected',
+                      self._outgoing.maxsize)
+            self.close()
+
+    def _write_loop(self):
+        while True:
+            message = self._outgoing.get()
+            if message is None or self.closed.is_set():
+                break
+            try:
+                self.wfile.write((json.dumps(message, default=str) + '\n').encode())
+                self.wfile.flush()
+            except (OSError, ValueError):
+                self.close()
+                break
+
+    def subscribe(self, topic: str, period: float = 0.1):
+        swarm = self.server.swarm
+        if topic == 'ack':
+            if not hasattr(swarm, 'ack_listeners'):
+                raise ValueError('Acks are not available for this controller')
+            if self.ack_listener is None:
+                self.ack_listener = lambda index, response: self.write({'event': 'ack', 'index': index,
+                                                                        'response': response})
+                swarm.ack_listeners.append(self.ack_listener)
+        elif topic == 'state':
+            if not swarm.state_listener:
+                raise ValueError('The controller was created without state_listener')
+            if self.state_thread is None:
+                self.state_thread = Thread(target=self._publish_states, args=(max(0.01, float(period)), ),
+                                           name='control-state', daemon=True)
+                self.state_thread.start()
+        else:
+            raise ValueError(f'Unknown topic {topic}')
+        return True
+
+    def unsubscribe(self, topic: str):
+        if topic == 'ack' and self.ack_listener is not None:
+            try:
+                self.server.swarm.ack_listeners.remove(self.ack_listener)
+            except ValueError:
+                pass
+            self.ack_listener = None
+        elif topic == 'state':
+            # The publishing thread stops by itself, close() may be called from it
+            self.state_thread = None
+        return True
+
+    def _publish_states(self, period: float):
+        """Push the states received since the last period"""
+        swarm = self.server.swarm
+        last_sent = {}
+        while self.state_thread is not None and not self.closed.wait(period):
+            for index, state in enumerate(list(swarm.last_parameters)):
+                if state is not None and last_sent.get(index) is not state:
+                    last_sent[index] = state
+                    self.write({'event': 'state', 'index': index, 'state': state.as_dict()})
+
+    def close(self):
+        """Stop the subscriptions and wake up the threads reading the requests and writing the messages"""
+        self.closed.set()
+        self.unsubscribe('ack')
+        self.unsubscribe('state')
+        try:
+            self._outgoing.put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class ControlServer:
+    """Serve one drone controller (TelloEDU, Swarm or ShardedSwarm) to local clients from daemon threads"""
+    def __init__(self, swarm, address=('127.0.0.1', 8900), max_workers: int = 16, max_queued: int = 1000,
+                 ack_timeout: float = 7.0):
+        """
+         :params: address is a (host, port) tuple for TCP (port 0 picks a free one) or the path of a Unix socket
+         :params: max_workers is the number of requests waiting for the drones at the same time
+         :params: max_queued messages waiting for a client before it is disconnected
+         :params: ack_timeout (s) to wait for the answer of a drone before sending its next command
+        """
+        self.swarm = swarm
+        self.max_queued = max_queued
+        self.ack_timeout = ack_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='control-call')
+        # One single thread executor per drone, created on its first command
+        self.lanes = {}
+        self._lanes_lock = Lock()
+        self.clients = []
+        self._clients_lock = Lock()
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                client = _Client(server, self.request, self.wfile, server.max_queued)
+                with server._clients_lock:
+                    server.clients.append(client)
+                try:
+                    for line in self.rfile:
+                        if client.closed.is_set():
+                            break
+                        if line.strip():
+                            server._handle_line(client, line)
+                finally:
+                    client.close()
+                    with server._clients_lock:
+                        server.clients.remove(client)
+
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            self.server = socketserver.ThreadingUnixStreamServer(address, Handler)
+        else:
+            self.server = socketserver.ThreadingTCPServer(address, Handler, bind_and_activate=False)
+            # A restarted server gets its port back at once
+            self.server.allow_reuse_address = True
+            try:
+                self.server.server_bind()
+                self.server.server_activate()
+            except OSError:
+                self.server.server_close()
+                raise
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, name='control-server', daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def close(self):
+        """Stop accepting clients and close the connections, the controller itself stays connected"""
+        self.server.shutdown()
+        with self._clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.close()
+        self.server.server_close()
+        self.executor.shutdown(wait=False)
+        with self._lanes_lock:
+            for lane in self.lanes.values():
+                lane.shutdown(wait=False)
+            self.lanes.clear()
+        if self.server.address_family == getattr(socket, 'AF_UNIX', None) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def _handle_line(self, client: _Client, line: bytes):
+        try:
+            message = json.loads(line)
+        except ValueError as exc:
+            client.write({'id': None, 'error': f'Invalid JSON : {exc}'})
+            return
+        if isinstance(message, list):
+            # Batch : every request is started now, one answer once they are all done
+            answers = [self._start(client, request) for request in message]
+            remaining = [len(answers)]
+            lock = Lock()
+
+            def answer_done(_):
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    client.write([answer.result() for answer in answers])
+
+            if not answers:
+                client.write([])
+            for answer in answers:
+                answer.add_done_callback(answer_done)
+        else:
+            self._start(client, message).add_done_callback(lambda answer: client.write(answer.result()))
+
+    def _start(self, client: _Client, request):
+        """
+        Start a request in the order of arrival, return the Future of its answer
+        Commands are queued on the lane of their drone, the other waits are left to the pool
+        """
+        if not isinstance(request, dict):
+            return _answer(None, error='A request is a JSON object')
+        request_id = request.get('id')
+        method = request.get('method')
+        params = request.get('params') or {}
+        try:
+            if method in INLINE_METHODS:
+                return _answer(request_id, self._inline(client, method, params))
+            if method == 'send':
+                _, answer = self._queue_command(int(params.get('index', 0)), params['command'], params.get('timeout'))
+                return _deferred(request_id, answer)
+            if method == 'send_all':
+                timeout = params.get('timeout')
+                answers = [self._queue_command(index, params['command'], timeout)[1]
+                           for index in range(len(self.swarm))]
+                return _deferred(request_id, _gather(answers, None if timeout is None else list))
+            if method == 'execute':
+                return _deferred(request_id, self.executor.submit(self._execute, list(params['actions'])))
+            if method == 'wait_ack':
+                return self._wait(request_id, [int(params.get('index', 0))], monotonic(), params.get('timeout', 7.0))
+            return _answer(request_id, error=f'Unknown method {method}')
+        except (KeyError, TypeError, ValueError, IndexError) as exc:
+            log_event('control', logging.WARNING, 'Bad request %s : %r', request_id, exc)
+            return _answer(request_id, error=f'{exc.__class__.__name__} : {exc}')
+
+    def _inline(self, client: _Client, method: str, params: dict):
+        if method == 'state':
+            state = self.swarm.state(int(params.get('index', 0)))
+            return None if state is None else state.as_dict()
+        if method == 'metrics':
+            return self.swarm.metrics()
+        if method == 'drones':
+            return list(self.swarm.ip_addresses)
+        if method == 'subscribe':
+            return client.subscribe(params['topic'], params.get('period', 0.1))
+        return client.unsubscribe(params['topic'])
+
+    def _wait(self, request_id, indices: list, sent_at: float, timeout):
+        """Acks of the drones (a single value for one drone), nothing to wait without timeout"""
+        if timeout is None:
+            return _answer(request_id, None)
+        deadline = sent_at + float(timeout)
+
+        def wait_acks():
+            acks = [self.swarm.wait_ack(index, sent_at, max(0, deadline - monotonic())) for index in indices]
+            return acks[0] if len(acks) == 1 else acks
+        return _deferred(request_id, self.executor.submit(wait_acks))
+
+    def _lane(self, index: int):
+        if not 0 <= index < len(self.swarm):
+            raise IndexError(f'No drone {index}')
+        with self._lanes_lock:
+            if index not in self.lanes:
+                self.lanes[index] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'control-drone-{index}')
+            return self.lanes[index]
+
+    def _queue_command(self, index: int, command: str, timeout=None):
+        """
+        Queue a command behind the previous commands of its drone, return the Futures of its send time and of its answer
+        The answer is the ack received within timeout (None without timeout, as soon as the command is sent). Either way
+        the lane is kept until the drone answered or ack_timeout, the next command never gets the ack of this one
+        """
+        lane = self._lane(index)
+        timeout = None if timeout is None else float(timeout)
+        sent, answer = Future(), Future()
+
+        def send_and_wait():
+            try:
+                sent_at = monotonic()
+                self.swarm.send(command, index)
+            except Exception as exc:
+                sent.set_exception(exc)
+                answer.set_exception(exc)
+                return
+            sent.set_result(sent_at)
+            ack = None
+            if timeout is not None:
+                ack = self.swarm.wait_ack(index, sent_at, timeout)
+            answer.set_result(ack)
+            if ack is None:
+                self.swarm.wait_ack(index, sent_at, max(0, sent_at + self.ack_timeout - monotonic()))
+        lane.submit(send_and_wait)
+        return sent, answer
+
+    def _execute(self, actions: list):
+        """Same sequence as execute_actions, the commands wait in the lanes of their drones like the other requests"""
+        parsed = parse_actions(actions, len(self.swarm))
+        for position, (index, command) in enumerate(parsed):
+            if not self.swarm.is_connected:
+                break
+            sent_at = self._queue_command(index, command)[0].result()
+            # Don't wait if there is no actions left
+            if position + 1 < len(parsed):
+                self.swarm.wait_for_completion(index, sent_at, 3)
+
+
+def _answer(request_id, result=None, error=None):
+    """Future of an answer already known"""
+    future = Future()
+    future.set_result({'id': request_id, 'error': error} if error is not None else {'id': request_id, 'result': result})
+    return future
+
+
+def _deferred(request_id, call: Future):
+    """Future of the answer of a call running in the pool"""
+    future = Future()
+
+    def call_done(done):
+        try:
+            future.set_result({'id': request_id, 'result': done.result()})
+        except Exception as exc:
+            future.set_result({'id': request_id, 'error': f'{exc.__class__.__name__} : {exc}'})
+    call.add_done_callback(call_done)
+    return future
+
+
+def _gather(calls: list, combine=None):
+    """Future of the results of every call, combine(results) or None once they are all done"""
+    future = Future()
+    remaining = [len(calls)]
+    lock = Lock()
+
+    def call_done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            try:
+                results = [call.result() for call in calls]
+            except Exception as exc:
+                future.set_exception(exc)
+                return
+            future.set_result(None if combine is None else combine(results))
+
+    if not calls:
+        future.set_result(None if combine is None else combine([]))
+    for call in calls:
+        call.add_done_callback(call_done)
+    return future
@@ -0,0 +1,107 @@
+"""
+Logging layer for the receiving and sending hot paths
+Messages are formatted lazily by logging, each event type can be sampled (1 message out of N) and rate limited
+(token bucket) so a 10 Hz x N drones state stream or the video stream can't flood the terminal
+
+When the level of an event is disabled, log_event returns after a single level check
+"""
+
+import sys
+import logging
+from time import monotonic
+from collections import defaultdict
+
+__all__ = ['EventLogger', 'EVENTS', 'log_event', 'configure_logging']
+
+LOGGER_NAME = 'pyTelloSDK'
+# Messages per second allowed by default for each event type
+DEFAULT_RATE_LIMITS = {'send': 20, 'ack': 20, 'state': 1, 'video': 1, 'frame': 5}
+
+
+class EventLogger:
+    """Logger wrapper applying per-event sampling and rate limiting"""
+    def __init__(self, name: str = LOGGER_NAME, rate_limits: dict = None):
+        self.logger = logging.getLogger(name)
+        # event -> (messages per second, burst)
+        self._limits = {}
+        self._tokens = {}
+        self._refilled_at = {}
+        # event -> log 1 message out of N
+        self._sampling = {}
+        self._seen = defaultdict(int)
+        self.suppressed = defaultdict(int)
+        for event, per_second in (DEFAULT_RATE_LIMITS if rate_limits is None else rate_limits).items():
+            self.set_rate_limit(event, per_second)
+
+    def set_rate_limit(self, event: str, per_second: float = None, burst: int = None):
+        """Allow per_second messages of this event (None removes the limit)"""
+        if per_second is None:
+            self._limits.pop(event, None)
+            return
+        burst = max(1, int(per_second)) if burst is None else burst
+        self._limits[event] = (per_second, burst)
+        self._tokens[event] = burst
+        self._refilled_at[event] = monotonic()
+
+    def set_sampling(self, event: str, every: int = 1):
+        """Only log one message out of 'every' for this event"""
+        self._sampling[event] = every
+
+    def _allowed(self, event: str):
+        """Token bucket of the event"""
+        per_second, burst = self._limits[event]
+        now = monotonic()
+        tokens = min(burst, self._tokens[event] + (now - self._refilled_at[event]) * per_second)
+        self._refilled_at[event] = now
+        if tokens < 1:
+            self._tokens[event] = tokens
+            return False
+        self._tokens[event] = tokens - 1
+        return True
+
+    def log(self, event: str, level: int, msg: str, *args):
+        """Log msg % args for this event type if the level is enabled, the sampling and the rate limit allow it"""
+        if not self.logger.isEnabledFor(level):
+            return
+        every = self._sampling.get(event)
+        if every is not None and every > 1:
+            self._seen[event] += 1
+            if self._seen[event] % every:
+                return
+        if event in self._limits and not self._allowed(event):
+            self.suppressed[event] += 1
+            return
+        suppressed = self.suppressed.pop(event, 0)
+        if suppressed:
+            msg += f' ({suppressed} similar messages suppressed)'
+        self.logger.log(level, msg, *args, extra={'event': event})
+
+
+EVENTS = EventLogger()
+log_event = EVENTS.log
+
+
+# Level set by the last configure_logging call, a level changed by the application afterwards is kept
+_applied_level = None
+
+
+def configure_logging(verbose: bool = False, stream=None):
+    """
+    Print the events on the console like the API always did (acks and errors), verbose adds every packet
+    Every call sets the level again (the last controller created decides) unless the application changed it itself,
+    nothing is changed if the application configured its own handler for the pyTelloSDK logger
+    """
+    global _applied_level
+    logger = logging.getLogger(LOGGER_NAME)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout if stream is None else stream)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        # Marks the handler installed here
+        handler.name = LOGGER_NAME
+        logger.addHandler(handler)
+        logger.propagate = False
+        _applied_level = logger.level
+    if all(handler.name == LOGGER_NAME for handler in logger.handlers) and logger.level == _applied_level:
+        _applied_level = logging.DEBUG if verbose else logging.INFO
+        logger.setLevel(_applied_level)
+    return logger
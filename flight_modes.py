@@ -5,19 +5,35 @@ This file contains all the possible flight modes you can use to take control of
 import os
 from abc import ABC, abstractmethod
 from getch import getch
-from time import sleep
-from math import sqrt, ceil, cos, sin, radians
+from time import monotonic
 
-from toolbox import back_to_base, command_from_key
+from toolbox import back_to_base
+from orbit_planner import OrbitPlan, plan_orbit, TAKEOFF_TIME, DRONE_SPACING
+from image_hash import PerceptualIndex
+from tracing import span
+from mission_scheduler import run_schedule
+from mission_language import compile_mission, MissionSyntaxError
+from rc_control import RcController
+from key_input import KeyDispatcher
 
 __all__ = ['OpenPipeMode', 'ReactiveMode', 'ActFromFileMode', 'ActFromActionListMode', 'PictureMission']
 
 class AbstractFlightMode(ABC):
     """ Abstract Base Class of the Strategy Pattern to create other flight modes """
-    def __init__(self, swarm):
+    def __init__(self, swarm, **options):
         super().__init__()
         self.swarm = swarm
         self.all_images = []
+        # Near duplicate pictures (e.g. taken while hovering) are dropped at capture time
+        self.picture_index = PerceptualIndex(threshold=options.get('duplicate_threshold', 6))
+
+    def keep_picture(self, picture):
+        """Add the picture to the mission images unless it is a near duplicate of one already kept"""
+        if self.picture_index.add(picture):
+            self.all_images.append(picture)
+            return True
+        print('Picture looks like one already taken, dropped')
+        return False
 
     @abstractmethod
     def start(self, **options):
@@ -26,7 +42,7 @@ class AbstractFlightMode(ABC):
 class ReactiveMode(AbstractFlightMode):
     """Fast reacting mode with pre-binded keys"""
     def __init__(self, swarm, **options):
-        super().__init__(swarm)
+        super().__init__(swarm, **options)
         self.start(**options)
 
     @back_to_base
@@ -35,9 +51,20 @@ class ReactiveMode(AbstractFlightMode):
         On Windows getch() capture two 'keys' and first one is useless
         On Unix special keys need 3 getch (Even arrows on Linux don't give the same keycode as Windows)
         See : https://en.wikipedia.org/wiki/ANSI_escape_code
+        Commands are sent by a KeyDispatcher (see key_input.py) : presses waiting while the drones move are merged
+        With the option rc_control=True moves are streamed as rc sticks (see rc_control.py) while the key is repeated,
+        the dead-man timeout (rc_dead_man, 0.8 s) is longer than the usual key repeat delay of a terminal
         """
         # Ctrl + Z and Ctrl + C
         exit_char = ['\x1a', '\x03']
+        rc_controller = None
+        if options.get('rc_control', False):
+            rc_controller = RcController(self.swarm, rate=options.get('rc_rate', 20), speed=options.get('rc_speed', 50),
+                                         dead_man=options.get('rc_dead_man', 0.8))
+            rc_controller.start()
+        dispatcher = KeyDispatcher(self.swarm, max_age=options.get('key_max_age', 0.5),
+                                   max_repeat=options.get('key_max_repeat', 5))
+        dispatcher.start()
         while self.swarm.is_connected:
             _input = getch()
             try:
@@ -47,6 +74,10 @@ class ReactiveMode(AbstractFlightMode):
                 pass
 
             if _input in exit_char:
+                dispatcher.close()
+                if rc_controller is not None:
+                    rc_controller.close()
+                    rc_controller = None
                 for index in range(len(self.swarm)):
                     self.swarm.execute_actions([f'{index}-land'])
                 self.swarm.end_connection = True
@@ -56,20 +87,24 @@ class ReactiveMode(AbstractFlightMode):
             elif _input in ['[', '\x1b']:
                 continue
             elif _input == 'p':
-                picture = self.swarm.take_picture()
-                self.all_images.append(picture)
-            elif command_from_key(_input) is not None:
-                for index in range(len(self.swarm)):
-                    self.swarm.execute_actions([f'{index}-{command_from_key(_input)}'])
+                self.keep_picture(self.swarm.take_picture())
+            # A terminal doesn't report key releases, a new key replaces the previous one
+            elif rc_controller is not None and rc_controller.press(_input, exclusive=True):
+                continue
+            elif dispatcher.push(_input):
+                continue
             else:
                 print('Nothing attach to this key ' + _input)
 
+        dispatcher.close()
+        if rc_controller is not None:
+            rc_controller.close()
         self.swarm.save_pictures(self.all_images)
 
 class OpenPipeMode(AbstractFlightMode):
     """Constant opened pipto communicate with the drone"""
     def __init__(self, swarm, **options):
-        super().__init__(swarm)
+        super().__init__(swarm, **options)
         self.start(**options)
 
     @back_to_base
@@ -89,10 +124,10 @@ class OpenPipeMode(AbstractFlightMode):
                 if user_input == 'exit':
                     break
                 elif user_input == 'p':
-                    picture = self.swarm.take_picture()
-                    self.all_images.append(picture)
+                    self.keep_picture(self.swarm.take_picture())
                 elif user_input: # user_input != ""
-                    self.swarm.execute_actions([user_input])
+                    with span('user command', 'flight mode', command=user_input):
+                        self.swarm.execute_actions([user_input])
 
             self.swarm.save_pictures(self.all_images)
         except EOFError:
@@ -101,34 +136,52 @@ class OpenPipeMode(AbstractFlightMode):
 class ActFromFileMode(AbstractFlightMode):
     """Read the whole content of a file an execute all actions contained in it"""
     def __init__(self, swarm, **options):
-        super().__init__(swarm)
+        super().__init__(swarm, **options)
         self.start(**options)
 
     @back_to_base
     def start(self, **options):
-        """Read file and execute actions"""
+        """
+        Read file and execute actions, the file can use the extended syntax (see mission_language)
+        With parallel=True the lines of different drones run at the same time (see mission_scheduler), a
+        safety_distance (cm) keeps moves predicted to pass too close one after the other
+        """
         filename = options.get('filename')
         project_path = os.path.dirname(os.path.realpath(__file__))
         dir_path = os.path.sep.join((project_path, 'missions_dir'))
         path = os.path.sep.join((dir_path, filename))
         try:
             with open(path, 'r') as file:
-                content = file.read()
-                actions = content.split('\n')
-                self.swarm.execute_actions(actions)
+                program = compile_mission(file.read())
+            with span('mission file', 'flight mode', filename=filename, actions=len(program)):
+                if not program.is_flat:
+                    # Blocks make the concurrency explicit
+                    program.run(self.swarm)
+                elif options.get('parallel', False):
+                    run_schedule(self.swarm, program.actions, safety_distance=options.get('safety_distance'),
+                                 start_positions=options.get('start_positions'))
+                else:
+                    self.swarm.execute_actions(program.actions)
         except FileNotFoundError:
             print(f'There is no file at {path}')
+        except MissionSyntaxError as exc:
+            print(f'Mission {filename} is not valid, {exc}')
 
 class ActFromActionListMode(AbstractFlightMode):
     """Excute a list of instructions"""
     def __init__(self, swarm, **options):
-        super().__init__(swarm)
+        super().__init__(swarm, **options)
         self.start(**options)
 
     @back_to_base
     def start(self, **options):
         actions = options.get('actions')
-        self.swarm.execute_actions(actions)
+        with span('action list', 'flight mode', actions=len(actions)):
+            if options.get('parallel', False):
+                run_schedule(self.swarm, actions, safety_distance=options.get('safety_distance'),
+                             start_positions=options.get('start_positions'))
+            else:
+                self.swarm.execute_actions(actions)
 
 class PictureMission(AbstractFlightMode):
     """🐧 Mode used for photogrametry purpose"""
@@ -136,8 +189,15 @@ class PictureMission(AbstractFlightMode):
         """
          :params: object_position is a tuple (x,y)
          :params: object_dim is a tuple of the size (length, width, heigth)
+         :params: burst_size is the number of frames compared at each waypoint
+         :params: points_per_ring, ring_step, start_height, radius_coef, speed, use_curves and ground_pictures
+                  tune the orbit (see orbit_planner.plan_orbit), ground pictures need a landing per ring
+         :params: start_positions (x, y) of each drone, camera_drone is the index of the drone flying the orbit
+                  (the drones of a Swarm share one video stream, the pictures can only come from one of them)
         """
-        super().__init__(swarm)
+        super().__init__(swarm, **options)
+        # Number of frames compared at each waypoint to keep the sharpest one
+        self.burst_size = options.get('burst_size', 5)
 
         if not self.swarm.video_stream:
             print('You forgot to activate video stream on the drone')
@@ -164,90 +224,54 @@ class PictureMission(AbstractFlightMode):
         if object_distance is None or object_dim is None:
             print('Please give object distance and dimensions')
             return
-        center, pos = self.get_in_front(object_distance, object_dim)
-        self.move_around(center, pos, object_dim)
-
-    def get_in_front(self, object_distance: tuple, object_dim: tuple):
-        """Move the drone just in front of the object"""
-        x, y = object_distance
-        length, width, _ = object_dim
-
-        radius = sqrt(length**2 + width**2)/2
-        center = (x - ceil(length/2), y + ceil(width/2))
-        print(f'center {center}')
-
-        x_pos = center[0] # - half drone width
-
-        # +/- marge
-        if center[1] >= 0:
-            y_pos = int(center[1] - radius - width)
-        else:
-            y_pos = int(center[1] + radius + width)
-        print(f'In front coords : {x_pos},{y_pos}')
-
-        return (center, (x_pos, y_pos))
-
-    def take_ground_angle_picture(self, hight: int):
-        """Set of instructions to land the drone, take a picture and takeoff again"""
-        self.swarm.execute_actions(['0-land'])
-        sleep(3)
-        self.all_images.append(self.swarm.take_picture())
-        self.swarm.execute_actions(['0-takeoff'])
-        sleep(3)
-        if hight > 100:
-            self.swarm.execute_actions([f'0-up {hight-100}'])
-        else:
-            self.swarm.execute_actions([f'0-down {100-hight}'])
-        sleep(3)
-
-    def move_around(self, center: tuple, actual_pos: tuple, object_dim: tuple):
-        """Navigate in circle around the object (+up/down)"""
-
-        x, y = actual_pos
-        heigth = object_dim[2]
-
-        actual_heigth = 10
-        circle_radius_coef = 1.2
-
-        number_of_points = 8
-        theta = 360/number_of_points
-
-        next_x = int((center[0] + (x - center[0])*cos(radians(theta)) - (y - center[1])*sin(radians(theta))))
-        next_y = int((center[1] + (y - center[1])*cos(radians(theta)) - (x - center[0])*sin(radians(theta))))
-
-        x_mvmt = (next_x - x) * circle_radius_coef
-        y_mvmt = (next_y - y) * circle_radius_coef
-
-        self.swarm.execute_actions(['0-takeoff'])
-        sleep(3)
-        self.swarm.execute_actions(['0-down 50'])
-        sleep(2)
-
-        # Get in front
-        self.swarm.execute_actions([f'0-forward {y}'])
-        sleep(3)
-        if x > 0:
-            self.swarm.execute_actions([f'0-right {x}'])
-        else:
-            self.swarm.execute_actions([f'0-left {abs(x)}'])
-        sleep(5)
-
-        while actual_heigth < heigth:
-            for _ in range(number_of_points):
-                # Only the first time
-                # ERROR
-                self.take_ground_angle_picture(actual_heigth)
-                self.all_images.append(self.swarm.take_picture())
-                self.swarm.execute_actions([f'0-right {x_mvmt}'])
-                sleep(3)
-                self.swarm.execute_actions([f'0-forward {y_mvmt}'])
-                sleep(3)
-                self.swarm.execute_actions([f'0-ccw {theta}'])
-                sleep(3)
-            actual_heigth += 20
-            self.swarm.execute_actions([f'0-up {20}'])
-            sleep(3)
-
-        self.swarm.execute_actions(['0-land'])
-        print(len(self.all_images))
-        self.swarm.save_pictures(self.all_images)
+        # Frames of every drone arrive mixed on the same video port : a picture can't be labelled with its drone
+        camera_drone = options.get('camera_drone', 0)
+        start_positions = options.get('start_positions')
+        if start_positions is None:
+            start_positions = [(drone * DRONE_SPACING, 0) for drone in range(len(self.swarm))]
+        if len(self.swarm) > 1:
+            print(f'Drones share one video stream, only drone {camera_drone} flies the orbit and takes the pictures')
+            for index in range(len(self.swarm)):
+                if index != camera_drone:
+                    self.swarm.send('streamoff', index)
+        with span('plan orbit', 'flight mode', drones=1):
+            plan = plan_orbit(object_distance, object_dim,
+                              points_per_ring=options.get('points_per_ring', 8),
+                              ring_step=options.get('ring_step', 20),
+                              start_height=options.get('start_height', 30),
+                              radius_coef=options.get('radius_coef', 1.2),
+                              speed=options.get('speed', 30),
+                              use_curves=options.get('use_curves', True),
+                              ground_pictures=options.get('ground_pictures', False),
+                              start_position=start_positions[camera_drone])
+        print(f'Planned orbit for drone {camera_drone} : {plan}')
+
+        # Pictures in the order of the orbit
+        self.all_images = self.move_around(plan, camera_drone)
+        print(f'Dataset coverage : {self.picture_index.coverage()}')
+        with span('save dataset', 'flight mode', pictures=len(self.all_images)):
+            for picture in self.all_images:
+                self.swarm.save_picture(picture, camera_drone)
+            self.swarm.picture_sink.flush()
+
+    def move_around(self, plan: OrbitPlan, index: int = 0):
+        """Fly every leg of the orbit and take the best picture at the end of each one, return the pictures kept"""
+        captures = []
+        sent_at = monotonic()
+        self.swarm.execute_actions([f'{index}-takeoff'])
+        self.swarm.wait_for_completion(index, sent_at, TAKEOFF_TIME)
+        for viewpoint, leg in enumerate(plan.legs):
+            if not self.swarm.is_connected:
+                break
+            with span('leg', 'flight mode', drone=index, viewpoint=viewpoint):
+                for command, duration in leg:
+                    sent_at = monotonic()
+                    self.swarm.execute_actions([f'{index}-{command}'])
+                    self.swarm.wait_for_completion(index, sent_at, duration)
+            with span('capture', 'flight mode', drone=index, viewpoint=viewpoint):
+                picture = self.swarm.take_best_picture(self.burst_size)
+                if self.picture_index.add(picture):
+                    captures.append(picture)
+
+        self.swarm.execute_actions([f'{index}-land'])
+        return captures
@@ -0,0 +1,156 @@
+"""
+Formation flight for a Swarm
+Current and target positions of every drone are numpy arrays (n, 3), all the 'go x y z speed' commands needed to
+reshape the formation are computed at once and sent to every drone in the same round
+
+World frame (cm / degrees), the same as orbit_planner :
+            y (initial heading of the drone)
+            ↑
+            |
+            D────→ x           z is the height above the ground
+
+    target = transform_formation(current, rotation=90, scale=1.5, translation=(0, 200, 0))
+    acks = execute_formation(my_swarm, plan_formation(current, target, speed=40))
+"""
+
+from time import monotonic
+import numpy as np
+
+from orbit_planner import GO_LIMIT, MIN_MOVE, COMMAND_OVERHEAD, TAKEOFF_HEIGHT, DRONE_SPACING
+
+__all__ = ['FormationPlan', 'line_formation', 'grid_formation', 'circle_formation', 'transform_formation',
+           'plan_formation', 'execute_formation']
+
+MIN_SPEED, MAX_SPEED = 10, 100
+
+
+class FormationPlan:
+    """Commands of every drone, grouped in rounds sent together (None when a drone has nothing to do)"""
+    def __init__(self, rounds: list, durations: list, steps, speeds, skipped):
+        """
+         :params: rounds[k][index] is the command of the drone in round k, durations[k] the estimated round time
+         :params: steps (n, 3) body frame displacement of each command, speeds (n, ) their speed
+         :params: skipped are the drones whose move is below the SDK minimum (20 cm on every axis)
+        """
+        self.rounds = rounds
+        self.durations = durations
+        self.steps = steps
+        self.speeds = speeds
+        self.skipped = skipped
+
+    def __len__(self):
+        return len(self.rounds)
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}({len(self.steps)} drones, {len(self)} rounds, '
+                f'{len(self.commands)} commands, ~{self.estimated_time:.0f}s)')
+
+    @property
+    def commands(self):
+        """Flat list of (drone index, command)"""
+        return [(index, command) for commands in self.rounds for index, command in enumerate(commands)
+                if command is not None]
+
+    @property
+    def estimated_time(self):
+        return float(sum(self.durations))
+
+
+def line_formation(n_drones: int, spacing: float = DRONE_SPACING, height: float = TAKEOFF_HEIGHT):
+    """Drones side by side along x, centered on the origin"""
+    positions = np.zeros((n_drones, 3))
+    positions[:, 0] = (np.arange(n_drones) - (n_drones - 1) / 2) * spacing
+    positions[:, 2] = height
+    return positions
+
+
+def grid_formation(n_drones: int, spacing: float = DRONE_SPACING, columns: int = None, height: float = TAKEOFF_HEIGHT):
+    """Rows of 'columns' drones (default a square grid), centered on the origin"""
+    columns = columns or int(np.ceil(np.sqrt(n_drones)))
+    rows, cols = np.divmod(np.arange(n_drones), columns)
+    positions = np.column_stack((cols * spacing, rows * spacing, np.full(n_drones, float(height))))
+    positions[:, :2] -= positions[:, :2].mean(axis=0)
+    return positions
+
+
+def circle_formation(n_drones: int, radius: float = 200, height: float = TAKEOFF_HEIGHT):
+    """Drones evenly spread on a circle around the origin"""
+    angles = np.linspace(0, 2 * np.pi, n_drones, endpoint=False)
+    return np.column_stack((radius * np.cos(angles), radius * np.sin(angles), np.full(n_drones, float(height))))
+
+
+def transform_formation(positions, rotation: float = 0.0, scale=1.0, translation=(0, 0, 0), center=None):
+    """
+    Rotate (degrees, counter clockwise around z) and scale a whole formation around its center, then translate it
+     :params: scale is a factor or a (x, y, z) tuple of factors
+     :params: center of the rotation and of the scaling (default the centroid of the formation)
+    """
+    positions = np.asarray(positions, dtype=float)
+    center = positions.mean(axis=0) if center is None else np.asarray(center, dtype=float)
+    theta = np.radians(rotation)
+    rotation_matrix = np.array([[np.cos(theta), -np.sin(theta), 0],
+                                [np.sin(theta), np.cos(theta), 0],
+                                [0, 0, 1]])
+    return ((positions - center) * np.asarray(scale, dtype=float)) @ rotation_matrix.T + center + np.asarray(translation)
+
+
+def plan_formation(current, target, headings=90, speed: int = 50, synchronize: bool = True):
+    """
+    Commands moving every drone from its current to its target position
+    Displacements are projected in the body frame of each drone (x forward, y left, z up) as 'go' expects and split
+    in several rounds when they exceed the SDK limit (500 cm)
+     :params: headings of the drones in degrees (a value for all or one per drone)
+     :params: synchronize scales the speeds so every drone ends its move at the same time as the farthest one
+    """
+    current = np.asarray(current, dtype=float)
+    target = np.asarray(target, dtype=float)
+    if current.shape != target.shape or current.ndim != 2 or current.shape[1] != 3:
+        raise ValueError(f'Positions must be (n, 3) arrays, got {current.shape} and {target.shape}')
+    headings = np.radians(np.broadcast_to(np.asarray(headings, dtype=float), (len(current), )))
+    displacements = target - current
+
+    # Projection of every displacement in the body frame of its drone
+    body = np.column_stack((displacements[:, 0] * np.cos(headings) + displacements[:, 1] * np.sin(headings),
+                            -displacements[:, 0] * np.sin(headings) + displacements[:, 1] * np.cos(headings),
+                            displacements[:, 2]))
+    parts = np.maximum(1, np.ceil(np.abs(body).max(axis=1) / GO_LIMIT)).astype(int)
+    steps = np.round(body / parts[:, None]).astype(int)
+    skipped = np.flatnonzero(np.abs(steps).max(axis=1) < MIN_MOVE)
+
+    lengths = np.linalg.norm(steps, axis=1)
+    speed = int(np.clip(speed, MIN_SPEED, MAX_SPEED))
+    if synchronize and lengths.max() > 0:
+        speeds = np.clip(np.round(speed * lengths / lengths.max()), MIN_SPEED, MAX_SPEED).astype(int)
+    else:
+        speeds = np.full(len(steps), speed)
+    step_durations = lengths / speeds + COMMAND_OVERHEAD
+    commands = [f'go {x} {y} {z} {drone_speed}' for (x, y, z), drone_speed in zip(steps, speeds)]
+    for index in skipped:
+        commands[index] = None
+
+    rounds = []
+    durations = []
+    for round_index in range(parts.max()):
+        moving = (parts > round_index) & np.array([command is not None for command in commands])
+        rounds.append([command if active else None for command, active in zip(commands, moving)])
+        durations.append(float(step_durations[moving].max()) if moving.any() else 0.0)
+    return FormationPlan(rounds, durations, steps, speeds, skipped)
+
+
+def execute_formation(swarm, plan: FormationPlan, timeout: float = None):
+    """
+    Send each round to every drone at once then wait for all the acks (the drone answers once its move is done)
+    Return the acks of each round, None for a drone which did not answer
+     :params: timeout of a round (default twice its estimated duration)
+    """
+    all_acks = []
+    for commands, duration in zip(plan.rounds, plan.durations):
+        if not swarm.is_connected:
+            break
+        sent_at = monotonic()
+        # Every drone gets its command before the connection check of the round
+        swarm.send_each(commands)
+        deadline = sent_at + (2 * duration if timeout is None else timeout)
+        all_acks.append([swarm.wait_ack(index, sent_at, max(0, deadline - monotonic())) if command is not None else None
+                         for index, command in enumerate(commands)])
+    return all_acks
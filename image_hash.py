@@ -0,0 +1,124 @@
+"""
+Perceptual hashes and an incremental index used to reject near-duplicate pictures at capture time
+Hashes are packed bit arrays so the Hamming distance to every stored picture is computed in one numpy step
+"""
+
+from threading import Lock
+import numpy as np
+
+from image_quality import to_gray
+
+__all__ = ['average_hash', 'dct_hash', 'hamming_distances', 'PerceptualIndex']
+
+# Number of bits set in every byte value
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def _block_mean(gray, size: int):
+    """
+    Downscale a gray image to size x size by averaging blocks (crops the remainder)
+    An image smaller than size is first upscaled by repeating its pixels
+    """
+    height, width = gray.shape
+    if not height or not width:
+        raise ValueError(f'Cannot hash an empty image of shape {gray.shape}')
+    if height < size or width < size:
+        gray = np.repeat(np.repeat(gray, -(-size // height), axis=0), -(-size // width), axis=1)
+        height, width = gray.shape
+    block_h, block_w = max(1, height // size), max(1, width // size)
+    gray = gray[:block_h * size, :block_w * size]
+    return gray.reshape(size, block_h, size, block_w).mean(axis=(1, 3))
+
+
+def _dct_matrix(size: int):
+    """Orthonormal DCT-II matrix"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def average_hash(frame, hash_size: int = 8):
+    """Bits telling if each block is brighter than the mean of the picture"""
+    small = _block_mean(to_gray(frame), hash_size)
+    return np.packbits(small > small.mean())
+
+
+def dct_hash(frame, hash_size: int = 8, highfreq_factor: int = 4):
+    """Bits telling if each low frequency DCT coefficient is above their median (pHash)"""
+    size = hash_size * highfreq_factor
+    small = _block_mean(to_gray(frame), size)
+    matrix = _dct_matrix(size)
+    low_freq = (matrix @ small @ matrix.T)[:hash_size, :hash_size]
+    # The DC coefficient only holds the mean brightness
+    return np.packbits(low_freq > np.median(low_freq.ravel()[1:]))
+
+
+def hamming_distances(hashes, picture_hash):
+    """Distance between one hash and every row of a (N, nbytes) hash array"""
+    return POPCOUNT[np.bitwise_xor(hashes, picture_hash)].sum(axis=1, dtype=np.int32)
+
+
+class PerceptualIndex:
+    """Keep the hashes of accepted pictures and reject the ones too close to an already accepted picture"""
+    HASHES = {'average': average_hash, 'dct': dct_hash}
+
+    def __init__(self, threshold: int = 6, method: str = 'dct', hash_size: int = 8, capacity: int = 256):
+        """
+         :params: threshold is the maximum Hamming distance considered as a duplicate (negative disables the filter)
+         :params: method is 'dct' (robust to exposure changes) or 'average' (faster)
+        """
+        if method not in self.HASHES:
+            raise ValueError(f'Unknown hash method {method}, choose one of {list(self.HASHES)}')
+        # Hashes are packed in bytes
+        if not isinstance(hash_size, int) or hash_size <= 0 or hash_size * hash_size % 8:
+            raise ValueError(f'hash_size must be a positive integer whose square is a multiple of 8, got {hash_size}')
+        self.threshold = threshold
+        self.hash_function = self.HASHES[method]
+        self.hash_size = hash_size
+        self.rejected = 0
+        # Distance of each accepted picture to its nearest previously accepted one
+        self.novelty = []
+
+        self._hashes = np.zeros((capacity, hash_size * hash_size // 8), dtype=np.uint8)
+        self._count = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return self._count
+
+    def nearest(self, picture_hash):
+        """Distance to the closest accepted picture (None if the index is empty)"""
+        if not self._count:
+            return None
+        return int(hamming_distances(self._hashes[:self._count], picture_hash).min())
+
+    def add(self, frame):
+        """Hash the frame and store it if it is not a near duplicate, return True when the frame is kept"""
+        if frame is None:
+            return False
+        picture_hash = self.hash_function(frame, self.hash_size)
+        with self._lock:
+            distance = self.nearest(picture_hash)
+            if distance is not None and distance <= self.threshold:
+                self.rejected += 1
+                return False
+            if self._count == len(self._hashes):
+                self._hashes = np.concatenate((self._hashes, np.zeros_like(self._hashes)))
+            self._hashes[self._count] = picture_hash
+            self._count += 1
+            if distance is not None:
+                self.novelty.append(distance)
+        return True
+
+    def coverage(self):
+        """Statistics about the pictures seen by the index"""
+        seen = self._count + self.rejected
+        return {
+            'accepted': self._count,
+            'rejected': self.rejected,
+            'rejection_rate': self.rejected / seen if seen else 0.0,
+            'mean_novelty': float(np.mean(self.novelty)) if self.novelty else 0.0,
+            'min_novelty': int(min(self.novelty)) if self.novelty else 0,
+        }
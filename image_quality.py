@@ -0,0 +1,52 @@
+"""
+Vectorised image quality metrics used to keep the best frame of a burst of captures
+All functions accept PIL images or numpy RGB/gray arrays
+"""
+
+import numpy as np
+
+__all__ = ['to_gray', 'laplacian_variance', 'clipped_ratio', 'frame_score', 'best_frame']
+
+# ITU-R BT.601 luma coefficients
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def to_gray(frame, step: int = 1):
+    """Return a float32 luminance array, optionally subsampled by step pixels to go faster"""
+    array = np.asarray(frame)
+    if step > 1:
+        array = array[::step, ::step]
+    if array.ndim == 3:
+        return array[..., :3].astype(np.float32) @ LUMA_WEIGHTS
+    return array.astype(np.float32)
+
+
+def laplacian_variance(gray):
+    """Variance of the 4-neighbours laplacian, high values mean sharp edges (low motion blur)"""
+    if gray.shape[0] < 3 or gray.shape[1] < 3:
+        return 0.0
+    laplacian = (gray[1:-1, :-2] + gray[1:-1, 2:] + gray[:-2, 1:-1] + gray[2:, 1:-1]
+                 - 4 * gray[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def clipped_ratio(gray, low: int = 5, high: int = 250):
+    """Ratio of under or over exposed pixels"""
+    if not gray.size:
+        return 1.0
+    return float(np.count_nonzero((gray <= low) | (gray >= high)) / gray.size)
+
+
+def frame_score(frame, step: int = 2):
+    """Sharpness weighted by the well exposed part of the frame"""
+    gray = to_gray(frame, step)
+    return laplacian_variance(gray) * (1 - clipped_ratio(gray))
+
+
+def best_frame(frames: list, step: int = 2):
+    """Return the frame with the highest score, None if no frame was given"""
+    frames = [frame for frame in frames if frame is not None]
+    if not frames:
+        return None
+    scores = [frame_score(frame, step) for frame in frames]
+    return frames[int(np.argmax(scores))]
@@ -0,0 +1,71 @@
+"""
+Keep-alive service of a drone controller (TelloEDU or Swarm)
+
+A Tello lands by itself after 15 s without any command. The service looks every second at the time of the last command
+sent to each drone and only sends 'command' to the drones which would otherwise stay idle past idle_timeout - margin.
+Drones busy with a mission are never pinged. rc sticks don't count : they are never acked, so a drone flown with the
+sticks is still pinged and keeps answering. Keep-alives of a tick are sent to every idle drone at once, they skip the
+connection check and are not recorded in all_instructions
+"""
+
+from time import monotonic
+from threading import Thread, Event
+
+from tracing import span
+
+__all__ = ['KeepAliveService']
+
+
+class KeepAliveService:
+    """Ping the idle drones of one controller from a single thread"""
+    def __init__(self, drone, idle_timeout: float = 15.0, margin: float = 5.0, tick: float = 1.0):
+        """
+         :params: idle_timeout (s) is the SDK delay after which a drone without command lands
+         :params: margin (s) before this delay when the keep-alive is sent
+         :params: tick (s) between two looks at the idle drones
+        """
+        self.drone = drone
+        self.idle_timeout = idle_timeout
+        self.margin = margin
+        self.tick = tick
+        self.sent = 0
+        self._stop = Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the service, calling it again while it runs does nothing"""
+        if not self.running:
+            self._stop.clear()
+            # Drones which never got a command are counted from now
+            now = monotonic()
+            for ip_address in self.drone.ip_addresses:
+                self.drone.last_sent.setdefault(ip_address, now)
+            self._thread = Thread(target=self._run, name='keep-alive', daemon=True)
+            self._thread.start()
+
+    def close(self, timeout: float = 1.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def idle_drones(self, now: float = None):
+        """Indices of the drones to ping now, a drone still waiting for an ack is busy with a command"""
+        now = monotonic() if now is None else now
+        limit = self.idle_timeout - self.margin
+        return [index for index, ip_address in enumerate(self.drone.ip_addresses)
+                if now - self.drone.last_sent.get(ip_address, 0.0) >= limit
+                and not self.drone.awaiting_ack(index)]
+
+    def _run(self):
+        while not self._stop.wait(self.tick) and self.drone.is_connected:
+            idle = self.idle_drones()
+            if idle:
+                with span('keep alive', 'command', drones=len(idle)):
+                    for index in idle:
+                        if self.drone.send_raw('command', index):
+                            self.sent += 1
@@ -0,0 +1,148 @@
+"""
+Key input layer of the manual flight modes (ReactiveMode and VideoUI)
+
+Key presses are only queued by the UI thread, a dispatcher thread sends them to the drones. While the drones are busy
+with a move the next presses wait in the queue, then the moves pressed more than max_age ago are dropped and the repeats
+of a same move are merged : five 'forward 30' become one 'forward 150'. Holding a key never builds a backlog of moves.
+Other commands (takeoff, flip, queries...) are always sent and a land goes before everything else in the queue
+"""
+
+from time import monotonic
+from threading import Thread, Event, Condition
+from collections import deque
+
+from toolbox import command_from_key
+from tracing import span
+
+__all__ = ['KeyDispatcher', 'coalesce_commands']
+
+# (min, max) value of the commands which can be merged, see the Tello SDK
+MOVE_LIMITS = {'forward': (20, 500), 'back': (20, 500), 'left': (20, 500), 'right': (20, 500), 'up': (20, 500),
+               'down': (20, 500), 'cw': (1, 360), 'ccw': (1, 360)}
+
+
+def coalesce_commands(commands: list, max_repeat: int = 5):
+    """
+    Merge the consecutive repeats of a same move into one command, at most max_repeat presses per command and within
+    the SDK limits. Extra repeats are dropped, other commands are kept as they are
+    """
+    merged = []
+    previous_verb, value, count = None, 0, 0
+    for command in commands:
+        words = command.split(' ')
+        verb = words[0]
+        if verb in MOVE_LIMITS and len(words) == 2 and words[1].isdigit():
+            if verb == previous_verb:
+                if count < max_repeat:
+                    value += int(words[1])
+                    count += 1
+                    merged[-1] = f'{verb} {min(value, MOVE_LIMITS[verb][1])}'
+                continue
+            previous_verb, value, count = verb, int(words[1]), 1
+        else:
+            previous_verb = None
+        merged.append(command)
+    return merged
+
+
+class KeyDispatcher:
+    """Queue of key presses sent to the drones from a dedicated thread"""
+    def __init__(self, swarm, indices: list = None, max_age: float = 0.5, max_repeat: int = 5,
+                 ack_timeout: float = 7.0):
+        """
+         :params: indices of the controlled drones (default every drone)
+         :params: max_age (s) of a press still waiting when the drones are ready again, older ones are dropped
+         :params: max_repeat is the number of presses of a same move merged in one command
+         :params: ack_timeout (s) to wait for the drones to answer a command before sending the next one
+        """
+        self.swarm = swarm
+        self.indices = list(range(len(swarm))) if indices is None else list(indices)
+        self.max_age = max_age
+        self.max_repeat = max_repeat
+        self.ack_timeout = ack_timeout
+        self.dropped = 0
+        self._queue = []
+        self._condition = Condition()
+        self._stop = Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name='key-dispatch', daemon=True)
+            self._thread.start()
+
+    def close(self, timeout: float = 1.0):
+        """Stop the dispatcher, the presses still queued are forgotten"""
+        self._stop.set()
+        with self._condition:
+            self._queue.clear()
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def push(self, *keys):
+        """
+        Queue the command bound to the first mapped key (a char and a Tk keycode can both be given)
+        Never blocks, return False if no key is bound to a command
+        """
+        for key in keys:
+            command = command_from_key(key)
+            if command is not None:
+                with self._condition:
+                    self._queue.append((command, monotonic()))
+                    self._condition.notify()
+                return True
+        return False
+
+    def _next_commands(self):
+        """Wait for presses, return the fresh ones merged"""
+        with self._condition:
+            while not self._queue and not self._stop.is_set():
+                self._condition.wait()
+            pressed, self._queue = self._queue, []
+        now = monotonic()
+        # Only the moves get stale
+        fresh = [command for command, pressed_at in pressed
+                 if command.split(' ')[0] not in MOVE_LIMITS or now - pressed_at <= self.max_age]
+        commands = coalesce_commands(fresh, self.max_repeat)
+        if 'land' in commands:
+            commands = ['land'] + [command for command in commands if command != 'land']
+        self.dropped += len(pressed) - len(fresh)
+        return commands, len(pressed)
+
+    def _take_land(self):
+        """True if a land was pressed since the queue was read, it is removed from the queue"""
+        with self._condition:
+            if not any(command == 'land' for command, _ in self._queue):
+                return False
+            self._queue = [(command, pressed_at) for command, pressed_at in self._queue if command != 'land']
+            return True
+
+    def _run(self):
+        while not self._stop.is_set() and self.swarm.is_connected:
+            commands, presses = self._next_commands()
+            commands = deque(commands)
+            while commands and not self._stop.is_set() and self.swarm.is_connected:
+                # A land pressed meanwhile goes before the rest of the batch
+                command = 'land' if self._take_land() else commands.popleft()
+                with span('key dispatch', 'flight mode', command=command, presses=presses):
+                    sent_at = monotonic()
+                    for index in self.indices:
+                        self.swarm.send(command, index)
+                    self._wait_acks(sent_at)
+
+    def _wait_acks(self, sent_at: float):
+        """The drones answer once their move is done, stop waiting when the dispatcher is closed"""
+        deadline = sent_at + self.ack_timeout
+        pending = list(self.indices)
+        while pending and not self._stop.is_set() and monotonic() < deadline:
+            pending = [index for index in pending if self.swarm.wait_ack(index, sent_at, 0.05) is None]
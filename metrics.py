@@ -0,0 +1,248 @@
+"""
+Lightweight instrumentation of the drones : counters and log-linear (HDR-style) histograms
+A snapshot is available with drone.metrics() and optionally as Prometheus text on http://127.0.0.1:<port>/metrics
+
+Commands are counted from any thread (missions, key dispatcher, rc stream, keep-alive, control server) and acks,
+states and frames from the receiving threads, every update and every snapshot goes through one short lock
+"""
+
+from math import frexp
+from collections import defaultdict, deque
+from threading import Thread, RLock
+from time import monotonic
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+__all__ = ['Histogram', 'DroneMetrics', 'MetricsServer']
+
+
+class Histogram:
+    """
+    Histogram with buckets growing by powers of two, each one split in SUB_BUCKETS linear buckets
+    The relative error of a percentile is below 1 / (2 * SUB_BUCKETS) whatever the magnitude of the values
+    """
+    SUB_BUCKETS = 16
+
+    def __init__(self, lowest: float = 1e-6, highest: float = 100.0):
+        self.lowest = lowest
+        self.counts = [0] * (self._index(highest) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def _index(self, value: float):
+        if value <= self.lowest:
+            return 0
+        mantissa, exponent = frexp(value / self.lowest)
+        return exponent * self.SUB_BUCKETS + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS)
+
+    def _upper_bound(self, index: int):
+        exponent, sub_bucket = divmod(index, self.SUB_BUCKETS)
+        return self.lowest * (0.5 + (sub_bucket + 1) / (2 * self.SUB_BUCKETS)) * 2 ** exponent
+
+    def record(self, value: float):
+        """Add a value (values out of range go to the first or the last bucket)"""
+        self.counts[min(self._index(value), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, percent: float):
+        """Approximated value under which percent % of the values are"""
+        if not self.count:
+            return 0.0
+        target = percent / 100 * self.count
+        cumulated = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulated += bucket_count
+            if bucket_count and cumulated >= target:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def summary(self, scale: float = 1000):
+        """Main statistics, in milliseconds by default"""
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count, 'mean': self.total / self.count * scale, 'min': self.min * scale,
+                'p50': self.percentile(50) * scale, 'p90': self.percentile(90) * scale,
+                'p99': self.percentile(99) * scale, 'max': self.max * scale}
+
+
+class DroneMetrics:
+    """All the counters and histograms of one drone controller (TelloEDU or Swarm)"""
+    def __init__(self, ack_timeout: float = 7.0, state_period: float = 0.1):
+        """
+         :params: ack_timeout is the delay after which a command without ack is counted as lost
+         :params: state_period is the expected period of the state packets, a longer interval is counted as a gap
+        """
+        self.ack_timeout = ack_timeout
+        self.state_period = state_period
+        self.started_at = monotonic()
+
+        self.counters = defaultdict(int)
+        # Commands waiting for their ack, per drone : (verb, sent time)
+        self._pending = defaultdict(deque)
+        self.rtt_by_verb = defaultdict(Histogram)
+        self.rtt_by_drone = defaultdict(Histogram)
+        self.state_intervals = Histogram()
+        self._last_state = {}
+        self.decode_time = Histogram()
+        # Taken by every update and every read
+        self._lock = RLock()
+
+    def command_sent(self, index: int, message: str):
+        with self._lock:
+            self.counters[('commands_sent', index)] += 1
+            # rc commands are never acked
+            if not message.startswith('rc '):
+                self._pending[index].append((message.split(' ')[0], monotonic()))
+
+    def awaiting_ack(self, index: int):
+        """True while a command of the drone is still waiting for its ack"""
+        with self._lock:
+            self._expire(index, monotonic())
+            return bool(self._pending[index])
+
+    def _expire(self, index: int, now: float):
+        """Count the commands which did not get their ack in time (called with the lock)"""
+        pending = self._pending[index]
+        while pending and now - pending[0][1] > self.ack_timeout:
+            pending.popleft()
+            self.counters[('ack_timeouts', index)] += 1
+
+    def ack_received(self, index: int):
+        """Acks carry no id, they are matched with the oldest pending command of the drone"""
+        now = monotonic()
+        with self._lock:
+            self.counters[('acks_received', index)] += 1
+            self._expire(index, now)
+            pending = self._pending[index]
+            if pending:
+                verb, sent_at = pending.popleft()
+                self.rtt_by_verb[verb].record(now - sent_at)
+                self.rtt_by_drone[index].record(now - sent_at)
+
+    def state_received(self, index: int, timestamp: float):
+        with self._lock:
+            self.counters[('state_packets', index)] += 1
+            last = self._last_state.get(index)
+            if last is not None:
+                interval = timestamp - last
+                self.state_intervals.record(interval)
+                if interval > 2 * self.state_period:
+                    self.counters[('state_gaps', index)] += 1
+            self._last_state[index] = timestamp
+
+    def video_packet(self):
+        with self._lock:
+            self.counters[('video_packets', 0)] += 1
+
+    def frames_decoded(self, duration: float, frames: int):
+        """One reassembled picture went through the decoder and gave 'frames' frames"""
+        with self._lock:
+            self.decode_time.record(duration)
+            if frames:
+                self.counters[('frames_decoded', 0)] += frames
+            else:
+                self.counters[('frames_dropped', 0)] += 1
+
+    def _totals(self):
+        """Counters summed over every drone and per drone"""
+        totals = defaultdict(int)
+        per_drone = defaultdict(dict)
+        with self._lock:
+            counters = list(self.counters.items())
+        for (name, index), value in counters:
+            totals[name] += value
+            per_drone[index][name] = value
+        return totals, per_drone
+
+    def snapshot(self):
+        """Cheap copy of every metric as plain dicts (durations in milliseconds)"""
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        now = monotonic()
+        for index in list(self._pending):
+            self._expire(index, now)
+        totals, per_drone = self._totals()
+        elapsed = max(now - self.started_at, 1e-9)
+        return {
+            'uptime_s': elapsed,
+            'counters': dict(totals),
+            'per_drone': {index: dict(values) for index, values in per_drone.items()},
+            'rates_per_s': {'state_packets': totals['state_packets'] / elapsed,
+                            'video_packets': totals['video_packets'] / elapsed,
+                            'frames_decoded': totals['frames_decoded'] / elapsed},
+            'command_rtt_ms_by_verb': {verb: histogram.summary() for verb, histogram in list(self.rtt_by_verb.items())},
+            'command_rtt_ms_by_drone': {index: histogram.summary() for index, histogram in list(self.rtt_by_drone.items())},
+            'state_interval_ms': self.state_intervals.summary(),
+            'decode_time_ms': self.decode_time.summary(),
+        }
+
+    def prometheus(self):
+        """Prometheus text exposition of the metrics"""
+        with self._lock:
+            return self._prometheus()
+
+    def _prometheus(self):
+        lines = []
+        _, per_drone = self._totals()
+        names = sorted({name for values in per_drone.values() for name in values})
+        for name in names:
+            lines.append(f'# TYPE tello_{name}_total counter')
+            for index, values in sorted(per_drone.items()):
+                if name in values:
+                    lines.append(f'tello_{name}_total{{drone="{index}"}} {values[name]}')
+
+        def summary(metric: str, labels: str, histogram: Histogram):
+            for quantile in (0.5, 0.9, 0.99):
+                lines.append(f'{metric}{{{labels}quantile="{quantile}"}} {histogram.percentile(quantile * 100):.6f}')
+            lines.append(f'{metric}_sum{{{labels.rstrip(",")}}} {histogram.total:.6f}')
+            lines.append(f'{metric}_count{{{labels.rstrip(",")}}} {histogram.count}')
+
+        lines.append('# TYPE tello_command_rtt_seconds summary')
+        for verb, histogram in list(self.rtt_by_verb.items()):
+            summary('tello_command_rtt_seconds', f'verb="{verb}",', histogram)
+        lines.append('# TYPE tello_drone_command_rtt_seconds summary')
+        for index, histogram in list(self.rtt_by_drone.items()):
+            summary('tello_drone_command_rtt_seconds', f'drone="{index}",', histogram)
+        lines.append('# TYPE tello_state_interval_seconds summary')
+        summary('tello_state_interval_seconds', '', self.state_intervals)
+        lines.append('# TYPE tello_decode_seconds summary')
+        summary('tello_decode_seconds', '', self.decode_time)
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """Serve the metrics as Prometheus text on localhost from a daemon thread"""
+    def __init__(self, metrics: DroneMetrics, port: int = 9100, host: str = '127.0.0.1'):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                """Keep the console clean"""
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+        self.thread.start()
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,284 @@
+"""
+Extended syntax of the mission files, a plain 'index-command' file is still a valid mission
+
+    # Comments start with #
+    set side 100                  variables, used as $side or ${side} (arithmetic is allowed : set half $side / 2)
+    def square {                  named subroutine
+        0-forward $side
+        0-cw 90
+    }
+    0-takeoff
+    repeat 4 as i {               'as i' is optional, i goes from 0 to 3
+        call square
+    }
+    parallel {                    every statement of the block runs at the same time
+        0-up 50
+        repeat 2 {
+            1-flip f
+        }
+    }
+    wait_ack 0 10                 wait for the answer to the last command of drone 0 (timeout in s, default 7)
+    wait_state 0 h >= 100 10      wait until the state field h of drone 0 is >= 100 (needs state_listener)
+    0-land
+
+Variables, repeats and subroutines are expanded when the mission is compiled, the commands run through
+AbstractDrone.execute_actions like an ActFromFileMode mission
+"""
+
+import re
+import ast
+import operator
+from time import monotonic, sleep
+from threading import Thread
+
+from tracing import span
+from telemetry import DroneState
+
+__all__ = ['MissionSyntaxError', 'MissionProgram', 'compile_mission']
+
+COMPARISONS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '==': operator.eq,
+               '!=': operator.ne}
+ARITHMETIC = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+              ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.USub: operator.neg, ast.UAdd: operator.pos}
+VARIABLE = re.compile(r'\$\{(\w+)\}|\$(\w+)')
+
+
+class MissionSyntaxError(Exception):
+    """Error in a mission file, with the number of the line"""
+    def __init__(self, line_number: int, msg: str):
+        super().__init__(f'line {line_number} : {msg}')
+        self.line_number = line_number
+        self.msg = msg
+
+
+def _evaluate(expression: str):
+    """
+    Value of a number or of an arithmetic expression, the text itself otherwise
+    Raise ValueError for an arithmetic expression which can't be computed (1/0, $a + text)
+    """
+    def value_of(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+        if isinstance(node, ast.BinOp) and type(node.op) in ARITHMETIC:
+            return ARITHMETIC[type(node.op)](value_of(node.left), value_of(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in ARITHMETIC:
+            return ARITHMETIC[type(node.op)](value_of(node.operand))
+        raise ValueError(expression)
+
+    try:
+        tree = ast.parse(expression, mode='eval').body
+    except SyntaxError:
+        return expression
+    try:
+        value = value_of(tree)
+    except (ValueError, ZeroDivisionError, OverflowError) as exc:
+        if isinstance(tree, (ast.BinOp, ast.UnaryOp)):
+            raise ValueError(f'cannot compute {expression}') from exc
+        return expression
+    # The SDK only takes integers
+    return int(round(value)) if isinstance(value, float) else value
+
+
+class MissionProgram:
+    """
+    Compiled mission, a list of steps :
+        ('action', 'index-command'), ('parallel', [steps, ...]), ('wait_ack', index, timeout),
+        ('wait_state', index, field, comparison, value, timeout)
+    """
+    def __init__(self, steps: list):
+        self.steps = steps
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self)} commands, {len(self.steps)} steps)'
+
+    @property
+    def is_flat(self):
+        """True when the mission is a plain list of commands"""
+        return all(step[0] == 'action' for step in self.steps)
+
+    @property
+    def actions(self):
+        """Every command of the mission, parallel branches one after the other"""
+        def flatten(steps):
+            for step in steps:
+                if step[0] == 'action':
+                    yield step[1]
+                elif step[0] == 'parallel':
+                    for branch in step[1]:
+                        yield from flatten(branch)
+        return list(flatten(self.steps))
+
+    def run(self, swarm, delay: float = 3):
+        """Fly the mission, each command keeps its drone busy for 'delay' seconds like in execute_actions"""
+        # Monotonic time of the last command sent to each drone, used by wait_ack
+        last_sent = {}
+        self._run_steps(swarm, self.steps, last_sent, delay, top_level=True)
+
+    def _run_steps(self, swarm, steps: list, last_sent: dict, delay: float, top_level: bool = False):
+        for position, step in enumerate(steps):
+            if not swarm.is_connected:
+                return
+            kind = step[0]
+            next_kind = steps[position + 1][0] if position + 1 < len(steps) else None
+            if kind == 'action':
+                index = self._index_of(step[1], len(swarm))
+                sent_at = monotonic()
+                swarm.execute_actions([step[1]])
+                last_sent[index] = sent_at
+                # An explicit condition replaces the timed wait, nothing to wait after the last command of the mission
+                if next_kind not in ('wait_ack', 'wait_state') and not (top_level and next_kind is None):
+                    swarm.wait_for_completion(index, sent_at, delay)
+            elif kind == 'parallel':
+                with span('parallel block', 'flight mode', branches=len(step[1])):
+                    threads = [Thread(target=self._run_steps, args=(swarm, branch, last_sent, delay),
+                                      name=f'mission-branch-{branch_index}')
+                               for branch_index, branch in enumerate(step[1])]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+            elif kind == 'wait_ack':
+                _, index, timeout = step
+                with span('wait_ack', 'flight mode', drone=index):
+                    if swarm.wait_ack(index, last_sent.get(index), timeout) is None:
+                        print(f'Drone {index} did not answer in {timeout} s')
+            elif kind == 'wait_state':
+                self._wait_state(swarm, *step[1:])
+
+    @staticmethod
+    def _index_of(action: str, n_drones: int):
+        """Drone index of a command line, 0 when there is none (see execute_actions)"""
+        try:
+            index = int(action.split('-')[0])
+        except ValueError:
+            return 0
+        return index if index < n_drones else 0
+
+    @staticmethod
+    def _wait_state(swarm, index: int, field: str, comparison: str, value: float, timeout: float):
+        """Poll the last state of the drone until the condition is true"""
+        deadline = monotonic() + timeout
+        with span('wait_state', 'flight mode', drone=index, condition=f'{field} {comparison} {value}'):
+            while monotonic() < deadline and swarm.is_connected:
+                state = swarm.state(index)
+                if state is not None and COMPARISONS[comparison](getattr(state, field), value):
+                    return True
+                sleep(0.05)
+        print(f'Drone {index} : {field} {comparison} {value} still false after {timeout} s')
+        return False
+
+
+def compile_mission(content: str):
+    """Parse a mission and expand its variables, repeats and subroutines, raise MissionSyntaxError"""
+    lines = [(number, line.split('#')[0].strip()) for number, line in enumerate(content.split('\n'), start=1)]
+    lines = [(number, line) for number, line in lines if line]
+    subroutines = {}
+    variables = {}
+
+    def block_end(start: int):
+        """Position of the '}' closing the block opened on lines[start]"""
+        depth = 0
+        for position in range(start, len(lines)):
+            if lines[position][1].endswith('{'):
+                depth += 1
+            elif lines[position][1] == '}':
+                depth -= 1
+                if depth == 0:
+                    return position
+        raise MissionSyntaxError(lines[start][0], 'missing }')
+
+    def substitute(number: int, text: str):
+        def value_of(match):
+            name = match.group(1) or match.group(2)
+            if name not in variables:
+                raise MissionSyntaxError(number, f'unknown variable {name}')
+            return str(variables[name])
+        return VARIABLE.sub(value_of, text)
+
+    def evaluate(number: int, text: str):
+        try:
+            return _evaluate(text)
+        except ValueError as exc:
+            raise MissionSyntaxError(number, str(exc)) from None
+
+    def compile_block(start: int, end: int, depth: int = 0):
+        """Steps of lines[start:end]"""
+        if depth > 50:
+            raise MissionSyntaxError(lines[start][0] if start < len(lines) else 0, 'subroutines call themselves')
+        steps = []
+        position = start
+        while position < end:
+            number, line = lines[position]
+            words = line.split()
+            keyword = words[0]
+            if keyword == 'set':
+                if len(words) < 3:
+                    raise MissionSyntaxError(number, 'expected : set name value')
+                variables[words[1]] = evaluate(number, substitute(number, ' '.join(words[2:])))
+            elif keyword == 'def':
+                if len(words) != 3 or words[2] != '{':
+                    raise MissionSyntaxError(number, 'expected : def name {')
+                closing = block_end(position)
+                subroutines[words[1]] = (position + 1, closing)
+                position = closing
+            elif keyword == 'call':
+                if len(words) != 2 or words[1] not in subroutines:
+                    raise MissionSyntaxError(number, f'unknown subroutine {" ".join(words[1:])}')
+                steps += compile_block(*subroutines[words[1]], depth + 1)
+            elif keyword == 'repeat':
+                match = re.fullmatch(r'repeat\s+(\S+)(?:\s+as\s+(\w+))?\s*\{', line)
+                count = evaluate(number, substitute(number, match.group(1))) if match else None
+                if not isinstance(count, int):
+                    raise MissionSyntaxError(number, 'expected : repeat N [as name] {')
+                closing = block_end(position)
+                for iteration in range(count):
+                    if match.group(2):
+                        variables[match.group(2)] = iteration
+                    steps += compile_block(position + 1, closing, depth + 1)
+                position = closing
+            elif keyword == 'parallel':
+                if line != 'parallel {' and words != ['parallel', '{']:
+                    raise MissionSyntaxError(number, 'expected : parallel {')
+                closing = block_end(position)
+                # Every statement of the block is a branch
+                branches = []
+                branch_start = position + 1
+                while branch_start < closing:
+                    branch_end = block_end(branch_start) + 1 if lines[branch_start][1].endswith('{') else branch_start + 1
+                    branch = compile_block(branch_start, branch_end, depth + 1)
+                    if branch:
+                        branches.append(branch)
+                    branch_start = branch_end
+                steps.append(('parallel', branches))
+                position = closing
+            elif keyword == 'wait_ack':
+                values = [evaluate(number, word) for word in substitute(number, ' '.join(words[1:])).split()]
+                if not 1 <= len(values) <= 2 or not all(isinstance(value, (int, float)) for value in values):
+                    raise MissionSyntaxError(number, 'expected : wait_ack index [timeout]')
+                steps.append(('wait_ack', int(values[0]), float(values[1]) if len(values) == 2 else 7.0))
+            elif keyword == 'wait_state':
+                match = re.fullmatch(r'wait_state\s+(\S+)\s+(\w+)\s*(<=|>=|==|!=|<|>)\s*(\S+)(?:\s+(\S+))?',
+                                     substitute(number, line))
+                if not match:
+                    raise MissionSyntaxError(number, 'expected : wait_state index field comparison value [timeout]')
+                index, field, comparison, value, timeout = match.groups()
+                if field not in DroneState.__slots__:
+                    raise MissionSyntaxError(number, f'unknown state field {field}')
+                index, value = evaluate(number, index), evaluate(number, value)
+                timeout = evaluate(number, timeout) if timeout else 30.0
+                if not isinstance(index, int):
+                    raise MissionSyntaxError(number, f'drone index must be an integer, got {index}')
+                if not isinstance(value, (int, float)) or not isinstance(timeout, (int, float)):
+                    raise MissionSyntaxError(number, 'value and timeout of wait_state must be numbers')
+                steps.append(('wait_state', index, field, comparison, value, float(timeout)))
+            elif keyword == '}':
+                raise MissionSyntaxError(number, 'unexpected }')
+            else:
+                steps.append(('action', substitute(number, line)))
+            position += 1
+        return steps
+
+    return MissionProgram(compile_block(0, len(lines)))
@@ -0,0 +1,189 @@
+"""
+Parallel execution of mission files
+Every line of a mission targets one drone ('index-command'), the lines of a same drone keep their order but the
+lines of different drones run at the same time. Optionally the positions of the drones are predicted from the
+commands and two moves passing closer than a safety distance are run one after the other
+
+World frame (cm / degrees), the same as orbit_planner : x to the right, y the initial heading, z up
+"""
+
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+
+from orbit_planner import TAKEOFF_HEIGHT, DRONE_SPACING
+from tracing import span
+
+__all__ = ['parse_actions', 'predict_moves', 'segment_distances', 'build_dependencies', 'run_schedule']
+
+# Squared length (cm²) below which a move is a point
+EPSILON = 1e-9
+BODY_MOVES = {'forward': (1, 0, 0), 'back': (-1, 0, 0), 'left': (0, 1, 0), 'right': (0, -1, 0),
+              'up': (0, 0, 1), 'down': (0, 0, -1)}
+
+
+def parse_actions(actions: list, n_drones: int):
+    """(drone index, command) of every non empty line, same syntax as AbstractDrone.execute_actions"""
+    parsed = []
+    for action in actions:
+        action = action.strip()
+        if not action:
+            continue
+        try:
+            index = int(action.split('-')[0])
+            command = action[len(str(index)) + 1:]
+        except ValueError:
+            # If no index is specified
+            index, command = 0, action
+        if index >= n_drones:
+            print(f'index : {index} is too big.')
+            continue
+        parsed.append((index, command))
+    return parsed
+
+
+def predict_moves(parsed: list, n_drones: int, start_positions=None, start_yaw: float = 90):
+    """
+    Start and end position of every command (arrays (m, 3)) from the command sequences of the drones
+    Drones start on the ground side by side along x (DRONE_SPACING) unless start_positions (n, 2 or 3) is given
+    """
+    if start_positions is None:
+        start_positions = np.column_stack((np.arange(n_drones) * DRONE_SPACING, np.zeros(n_drones)))
+    positions = np.zeros((n_drones, 3))
+    start_positions = np.asarray(start_positions, dtype=float)
+    positions[:, :start_positions.shape[1]] = start_positions
+    yaws = np.full(n_drones, float(start_yaw))
+
+    starts = np.zeros((len(parsed), 3))
+    ends = np.zeros((len(parsed), 3))
+    for action_index, (index, command) in enumerate(parsed):
+        words = command.split(' ')
+        verb = words[0]
+        starts[action_index] = positions[index]
+        heading = np.radians(yaws[index])
+        forward = np.array([np.cos(heading), np.sin(heading), 0.0])
+        left = np.array([-np.sin(heading), np.cos(heading), 0.0])
+        try:
+            values = [float(word) for word in words[1:]]
+            if verb == 'takeoff' and positions[index, 2] == 0:
+                positions[index, 2] = TAKEOFF_HEIGHT
+            elif verb in ('land', 'emergency'):
+                positions[index, 2] = 0
+            elif verb in BODY_MOVES:
+                x, y, z = (axis * values[0] for axis in BODY_MOVES[verb])
+                positions[index] += x * forward + y * left + [0, 0, z]
+            elif verb in ('cw', 'ccw'):
+                yaws[index] += values[0] if verb == 'ccw' else -values[0]
+            elif verb == 'go':
+                positions[index] += values[0] * forward + values[1] * left + [0, 0, values[2]]
+            elif verb == 'curve':
+                positions[index] += values[3] * forward + values[4] * left + [0, 0, values[5]]
+        except (IndexError, ValueError):
+            # Malformed command, the drone will answer an error and stay in place
+            pass
+        positions[index, 2] = max(0.0, positions[index, 2])
+        ends[action_index] = positions[index]
+    return starts, ends
+
+
+def segment_distances(starts_a, ends_a, starts_b, ends_b):
+    """Closest distance between the segments [starts_a[k], ends_a[k]] and [starts_b[k], ends_b[k]] (arrays (n, 3))"""
+    direction_a = ends_a - starts_a
+    direction_b = ends_b - starts_b
+    offset = starts_a - starts_b
+    a = np.einsum('ij,ij->i', direction_a, direction_a)
+    e = np.einsum('ij,ij->i', direction_b, direction_b)
+    b = np.einsum('ij,ij->i', direction_a, direction_b)
+    c = np.einsum('ij,ij->i', direction_a, offset)
+    f = np.einsum('ij,ij->i', direction_b, offset)
+    # A still drone is a segment of length 0
+    moving_a, moving_b = a > EPSILON, e > EPSILON
+    safe_a, safe_b = np.where(moving_a, a, 1.0), np.where(moving_b, e, 1.0)
+    denominator = a * e - b * b
+    # Closest points of the two lines, parallel segments start from s = 0
+    s = np.where(denominator > EPSILON, np.clip((b * f - c * e) / np.where(denominator > EPSILON, denominator, 1.0), 0, 1), 0.0)
+    t = (b * s + f) / safe_b
+    # Clamped on the segment b, then s is recomputed for this t
+    s = np.where(t < 0, np.clip(-c / safe_a, 0, 1), np.where(t > 1, np.clip((b - c) / safe_a, 0, 1), s))
+    t = np.clip(t, 0, 1)
+    s = np.where(moving_a, np.where(moving_b, s, np.clip(-c / safe_a, 0, 1)), 0.0)
+    t = np.where(moving_b, np.where(moving_a, t, np.clip(f / safe_b, 0, 1)), 0.0)
+    closest = offset + direction_a * s[:, None] - direction_b * t[:, None]
+    return np.linalg.norm(closest, axis=1)
+
+
+def build_dependencies(parsed: list, n_drones: int, safety_distance: float = None, start_positions=None,
+                       delay: float = 3):
+    """
+    Predecessors of every command : the previous command of the same drone and, with a safety distance, the earlier
+    commands of other drones whose predicted move passes closer than safety_distance (cm) during the same time
+    Every command is expected to keep its drone busy for 'delay' seconds, a move is only compared with the earlier
+    moves still running when it can start (plus a margin of one delay for the commands ending early)
+    """
+    drones = np.array([index for index, _ in parsed], dtype=int)
+    # Previous command of the same drone
+    dependencies = [set() for _ in parsed]
+    last_of_drone = {}
+    for action_index, index in enumerate(drones):
+        if index in last_of_drone:
+            dependencies[action_index].add(last_of_drone[index])
+        last_of_drone[index] = action_index
+
+    if safety_distance is not None and len(parsed) > 1:
+        starts, ends = predict_moves(parsed, n_drones, start_positions)
+        moving = np.any(starts != ends, axis=1)
+        # Predicted end time of every command once its predecessors are done
+        end_times = np.zeros(len(parsed))
+        for later in range(len(parsed)):
+            start_time = max((end_times[earlier] for earlier in dependencies[later]), default=0.0)
+            # Earlier commands of other drones still running when this one can start, one of the two moving
+            candidates = np.flatnonzero((end_times[:later] + delay > start_time) & (drones[:later] != drones[later])
+                                        & (moving[:later] | moving[later]))
+            if len(candidates):
+                gaps = segment_distances(np.broadcast_to(starts[later], (len(candidates), 3)),
+                                         np.broadcast_to(ends[later], (len(candidates), 3)),
+                                         starts[candidates], ends[candidates])
+                conflicts = candidates[gaps < safety_distance]
+                dependencies[later].update(int(earlier) for earlier in conflicts)
+                if len(conflicts):
+                    start_time = max(start_time, end_times[conflicts].max())
+            end_times[later] = start_time + delay
+    return dependencies
+
+
+def run_schedule(swarm, actions: list, delay: float = 3, safety_distance: float = None, start_positions=None):
+    """
+    Run the actions as soon as their predecessors are done, each command keeps its drone busy for 'delay' seconds
+    (or less with the completion detector, see AbstractDrone.wait_for_completion). Return the wall time
+    """
+    parsed = parse_actions(actions, len(swarm))
+    dependencies = build_dependencies(parsed, len(swarm), safety_distance, start_positions, delay)
+    remaining = [len(predecessors) for predecessors in dependencies]
+    successors = [[] for _ in parsed]
+    for action_index, predecessors in enumerate(dependencies):
+        for predecessor in predecessors:
+            successors[predecessor].append(action_index)
+    last_of_drone = {index: action_index for action_index, (index, _) in enumerate(parsed)}
+
+    def run(action_index: int):
+        index, command = parsed[action_index]
+        with span('scheduled command', 'flight mode', drone=index, command=command):
+            sent_at = monotonic()
+            swarm.send(command, index)
+            # Like execute_actions, don't wait after the last command of a drone
+            if last_of_drone[index] != action_index or successors[action_index]:
+                swarm.wait_for_completion(index, sent_at, delay)
+        return action_index
+
+    start = monotonic()
+    n_drones = max(1, len({index for index, _ in parsed}))
+    with ThreadPoolExecutor(max_workers=n_drones, thread_name_prefix='mission') as executor:
+        running = {executor.submit(run, action_index) for action_index, count in enumerate(remaining) if count == 0}
+        while running and swarm.is_connected:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                for successor in successors[future.result()]:
+                    remaining[successor] -= 1
+                    if remaining[successor] == 0:
+                        running.add(executor.submit(run, successor))
+    return monotonic() - start
@@ -0,0 +1,181 @@
+"""
+Orbit planner for photogrammetry missions
+All waypoints and camera headings of every ring are computed at once with numpy, then turned into
+a short sequence of SDK 'go'/'curve' commands followed by a yaw correction
+
+World frame (cm / degrees) :
+            y (initial heading of the drone)
+            ↑
+            |
+            D────→ x           z is the height above the ground
+"""
+
+import numpy as np
+
+__all__ = ['OrbitPlan', 'orbit_center', 'orbit_waypoints', 'plan_legs', 'plan_orbit']
+
+# SDK limits
+GO_LIMIT = 500
+MIN_MOVE = 20
+CURVE_MIN_RADIUS, CURVE_MAX_RADIUS = 50, 1000
+CURVE_MAX_SPEED = 60
+# Rough physical figures used to estimate the flight time
+TAKEOFF_HEIGHT = 80
+YAW_SPEED = 90
+COMMAND_OVERHEAD = 1.0
+TAKEOFF_TIME = 5.0
+LAND_TIME = 5.0
+CAPTURE_TIME = 1.0
+# Default distance between drones waiting side by side on the ground
+DRONE_SPACING = 100
+
+
+class OrbitPlan:
+    """Waypoints, camera headings and flight legs of an orbit, a picture is taken at the end of each leg"""
+    def __init__(self, waypoints, yaws, legs: list, speed: int):
+        self.waypoints = waypoints
+        self.yaws = yaws
+        self.legs = legs
+        self.speed = speed
+
+    def __len__(self):
+        return len(self.legs)
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}({len(self)} viewpoints, {len(self.commands)} commands, '
+                f'~{self.estimated_time:.0f}s)')
+
+    @property
+    def commands(self):
+        """Flat list of every command of the plan"""
+        return [command for leg in self.legs for command, _ in leg]
+
+    @property
+    def estimated_time(self):
+        """Estimated flight time in seconds, from takeoff to landing"""
+        moves = sum(duration for leg in self.legs for _, duration in leg)
+        return TAKEOFF_TIME + moves + CAPTURE_TIME * len(self.legs) + LAND_TIME
+
+
+def orbit_center(object_distance: tuple, object_dim: tuple):
+    """Center of the object from the coordinates of its nearest corner (see PictureMission.start)"""
+    x, y = object_distance
+    length, width, _ = object_dim
+    return np.array([x - length / 2, y + width / 2])
+
+
+def orbit_waypoints(center, object_dim: tuple, points_per_ring: int = 8, ring_step: int = 20,
+                    start_height: int = 30, radius_coef: float = 1.2, start_angle: float = -90):
+    """
+    Return the (N, 3) waypoints of every ring and the (N,) camera headings facing the center
+    Rings go from start_height up to the object height, starting in front of the object (start_angle)
+    """
+    length, width, height = object_dim
+    radius = radius_coef * (np.hypot(length, width) / 2 + width)
+
+    heights = np.arange(start_height, max(height, start_height) + 1, ring_step, dtype=float)
+    angles = np.radians(start_angle + np.arange(points_per_ring) * 360 / points_per_ring)
+
+    ring_heights, ring_angles = np.meshgrid(heights, angles, indexing='ij')
+    ring_heights, ring_angles = ring_heights.ravel(), ring_angles.ravel()
+
+    waypoints = np.column_stack((center[0] + radius * np.cos(ring_angles),
+                                 center[1] + radius * np.sin(ring_angles),
+                                 ring_heights))
+    # The camera looks at the center so its heading is opposite to the radius direction
+    yaws = np.degrees(ring_angles) + 180
+    return waypoints, yaws
+
+
+def _split_go(displacement, speed: int):
+    """'go' commands for one body frame displacement, split when it exceeds the SDK limit"""
+    parts = max(1, int(np.ceil(np.abs(displacement).max() / GO_LIMIT)))
+    step = np.round(displacement / parts).astype(int)
+    if np.abs(step).max() < MIN_MOVE:
+        return []
+    duration = float(np.linalg.norm(step) / speed + COMMAND_OVERHEAD)
+    return [(f'go {step[0]} {step[1]} {step[2]} {speed}', duration)] * parts
+
+
+def _rotation(delta: float):
+    """Shortest 'cw'/'ccw' command for a heading change in degrees, None when not needed"""
+    delta = (delta + 180) % 360 - 180
+    if abs(delta) < 1:
+        return None
+    duration = float(abs(delta) / YAW_SPEED + COMMAND_OVERHEAD)
+    return (f'ccw {round(delta)}', duration) if delta > 0 else (f'cw {round(-delta)}', duration)
+
+
+def plan_legs(waypoints, yaws, center, start_position=(0, 0, TAKEOFF_HEIGHT), start_yaw: float = 90,
+              speed: int = 30, use_curves: bool = True, ground_pictures: bool = False):
+    """
+    Build the commands flown before each capture
+    Moves are expressed in the body frame of the drone (x forward, y left, z up) as 'go' expects
+    Consecutive waypoints of a same ring are linked with an arc ('curve') when its radius allows it
+    """
+    speed = int(np.clip(speed, 10, 100))
+    positions = np.vstack((np.asarray(start_position, dtype=float), waypoints))
+    headings = np.radians(np.concatenate(([start_yaw], yaws)))
+    displacements = np.diff(positions, axis=0)
+
+    # Project every world displacement in the body frame of the drone heading before the move
+    forward = np.column_stack((np.cos(headings[:-1]), np.sin(headings[:-1])))
+    left = np.column_stack((-np.sin(headings[:-1]), np.cos(headings[:-1])))
+    body = np.column_stack(((displacements[:, :2] * forward).sum(axis=1),
+                            (displacements[:, :2] * left).sum(axis=1),
+                            displacements[:, 2]))
+
+    # Arc midpoints, also in the body frame
+    radii = np.linalg.norm(waypoints[:, :2] - center, axis=1)
+    angles = np.arctan2(waypoints[:, 1] - center[1], waypoints[:, 0] - center[0])
+    previous_angles = np.concatenate(([np.nan], angles[:-1]))
+    arc_angles = (angles - previous_angles + np.pi) % (2 * np.pi) - np.pi
+    mid_angles = previous_angles + arc_angles / 2
+    mid_world = np.column_stack((center[0] + radii * np.cos(mid_angles),
+                                 center[1] + radii * np.sin(mid_angles))) - positions[:-1, :2]
+    mid_body = np.column_stack(((mid_world * forward).sum(axis=1), (mid_world * left).sum(axis=1)))
+
+    same_ring = np.concatenate(([False], waypoints[1:, 2] == waypoints[:-1, 2]))
+    chords = np.abs(np.round(body)).max(axis=1)
+    curvable = (use_curves & same_ring & (radii >= CURVE_MIN_RADIUS) & (radii <= CURVE_MAX_RADIUS)
+                & (chords > MIN_MOVE) & (chords <= GO_LIMIT))
+    curve_speed = min(speed, CURVE_MAX_SPEED)
+    arc_lengths = radii * np.abs(arc_angles)
+
+    legs = []
+    for index in range(len(waypoints)):
+        leg = []
+        if ground_pictures and not same_ring[index]:
+            # Picture from the ground before starting a new ring
+            leg += [('land', LAND_TIME)]
+            legs.append(leg)
+            leg = [('takeoff', TAKEOFF_TIME)]
+            leg += _split_go(body[index] + [0, 0, positions[index, 2] - TAKEOFF_HEIGHT], speed)
+        elif curvable[index]:
+            x_1, y_1 = np.round(mid_body[index]).astype(int)
+            x_2, y_2, z_2 = np.round(body[index]).astype(int)
+            duration = float(arc_lengths[index] / curve_speed + COMMAND_OVERHEAD)
+            leg.append((f'curve {x_1} {y_1} {z_2 // 2} {x_2} {y_2} {z_2} {curve_speed}', duration))
+        else:
+            leg += _split_go(body[index], speed)
+
+        rotation = _rotation(np.degrees(headings[index + 1] - headings[index]))
+        if rotation is not None:
+            leg.append(rotation)
+        legs.append(leg)
+    return legs
+
+
+def plan_orbit(object_distance: tuple, object_dim: tuple, points_per_ring: int = 8, ring_step: int = 20,
+               start_height: int = 30, radius_coef: float = 1.2, speed: int = 30,
+               use_curves: bool = True, ground_pictures: bool = False, start_position: tuple = (0, 0)):
+    """
+    Plan a whole photogrammetry orbit around the object, see orbit_waypoints and plan_legs
+    start_position (x, y) is where the drone takes off
+    """
+    center = orbit_center(object_distance, object_dim)
+    waypoints, yaws = orbit_waypoints(center, object_dim, points_per_ring, ring_step, start_height, radius_coef)
+    x, y = start_position
+    legs = plan_legs(waypoints, yaws, center, start_position=(x, y, TAKEOFF_HEIGHT), speed=speed,
+                     use_curves=use_curves, ground_pictures=ground_pictures)
+    return OrbitPlan(waypoints, yaws, legs, speed)
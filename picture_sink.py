@@ -0,0 +1,115 @@
+"""
+Asynchronous picture writer used by the drones to save captures without blocking the control loop
+Every picture is encoded and written by a small thread pool, only new captures are queued
+"""
+
+import os
+from datetime import datetime
+from itertools import count
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, wait
+from PIL import Image
+
+__all__ = ['PictureSink']
+
+# Extension used for each format accepted by PIL
+EXTENSIONS = {'jpeg': 'jpg', 'png': 'png', 'webp': 'webp', 'bmp': 'bmp'}
+
+
+class PictureSink:
+    """Queue pictures to a thread pool which encodes and writes them to the pictures folder"""
+    def __init__(self, directory: str = None, picture_format: str = 'jpeg', quality: int = 90, workers: int = 2, prefix: str = 'tello'):
+        """
+         :params: directory is where pictures are written (default is the pictures folder of the project)
+         :params: picture_format is any PIL format in EXTENSIONS
+         :params: quality is only used by lossy formats (jpeg/webp)
+        """
+        if directory is None:
+            dir_path = os.path.dirname(os.path.realpath(__file__))
+            directory = os.path.sep.join((dir_path, 'pictures'))
+        picture_format = picture_format.lower()
+        if picture_format == 'jpg':
+            picture_format = 'jpeg'
+        if picture_format not in EXTENSIONS:
+            raise ValueError(f'Unsupported picture format {picture_format}, choose one of {list(EXTENSIONS)}')
+
+        self.directory = directory
+        self.picture_format = picture_format
+        self.quality = quality
+        self.prefix = prefix
+        self.closed = False
+        self.written = []
+
+        self._counter = count()
+        # Futures of the pictures not written yet, filled from any thread
+        self._pending = set()
+        self._pending_lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='picture-sink')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        """Number of pictures still waiting to be written"""
+        with self._pending_lock:
+            self._pending = {future for future in self._pending if not future.done()}
+            return len(self._pending)
+
+    def next_path(self, drone_id=0):
+        """Collision-free file name made of the drone id, a timestamp and a sequence number"""
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        name = f'{self.prefix}-{drone_id}-{timestamp}-{next(self._counter):05d}.{EXTENSIONS[self.picture_format]}'
+        return os.path.sep.join((self.directory, name))
+
+    def add(self, picture, drone_id=0):
+        """Queue a single picture, return the path it will be written to"""
+        if picture is None:
+            print('One of the saved picture was empty')
+            return None
+        if self.closed:
+            print('Picture sink is closed, picture dropped')
+            return None
+        path = self.next_path(drone_id)
+        future = self._executor.submit(self._write, picture, path)
+        with self._pending_lock:
+            self._pending.add(future)
+        return path
+
+    def _write(self, picture, path: str):
+        """Encode then move the picture to its final name so readers never see half written files"""
+        if not isinstance(picture, Image.Image):
+            picture = Image.fromarray(picture)
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+        options = {'quality': self.quality} if self.picture_format in ('jpeg', 'webp') else {}
+        tmp_path = path + '.part'
+        try:
+            picture.save(tmp_path, format=self.picture_format, **options)
+            os.replace(tmp_path, path)
+        except (OSError, ValueError) as exc:
+            print(f'Could not save picture {path} : {exc}')
+            return None
+        self.written.append(path)
+        return path
+
+    def flush(self, timeout: float = None):
+        """Wait until every queued picture has been written"""
+        with self._pending_lock:
+            pending = set(self._pending)
+        done, _ = wait(pending, timeout=timeout)
+        # Pictures added during the wait stay tracked
+        with self._pending_lock:
+            self._pending -= done
+        return len(done)
+
+    def close(self):
+        """Write remaining pictures and stop the workers"""
+        if not self.closed:
+            self.closed = True
+            self._executor.shutdown(wait=True)
+            with self._pending_lock:
+                self._pending.clear()
@@ -0,0 +1,151 @@
+"""
+Manual flight with the SDK 'rc a b c d' command streamed at a fixed rate
+a : left / right, b : forward / backward, c : up / down, d : yaw (each from -100 to 100)
+
+Keys (or joystick axes) only change the stick state, a timer thread sends it to the drones 20 times per second while
+a stick is pushed, then one last zero command. Nothing is streamed while the sticks are at rest, so the other commands
+and the keep-alive service are left alone. Sticks go back to zero when a key is released or when no input came during
+the dead-man timeout (terminals don't report key releases, the key repeat keeps the stick pushed : the timeout must be
+longer than the repeat delay of the terminal)
+"""
+
+from time import monotonic
+from threading import Thread, Event, Lock
+
+from toolbox import command_from_key
+
+__all__ = ['RcController', 'axes_from_key']
+
+# Stick (axis index, direction) of the move commands bound to the keys
+AXES = {'left': (0, -1), 'right': (0, 1), 'forward': (1, 1), 'back': (1, -1), 'up': (2, 1), 'down': (2, -1),
+        'ccw': (3, -1), 'cw': (3, 1)}
+
+
+def axes_from_key(key):
+    """(axis, direction) of a key bound to a move in command_from_key, None for the other keys"""
+    command = command_from_key(key)
+    if command is None:
+        return None
+    return AXES.get(command.split(' ')[0])
+
+
+class RcController:
+    """Stream the stick state of one or several drones from a dedicated timer thread"""
+    def __init__(self, swarm, rate: float = 20, speed: int = 50, dead_man: float = 0.5, indices: list = None):
+        """
+         :params: rate of the rc commands in Hz
+         :params: speed is the stick value (0 to 100) of a pushed key
+         :params: dead_man (s) brings the sticks back to zero when no input is received
+         :params: indices of the controlled drones (default every drone)
+        """
+        self.swarm = swarm
+        self.period = 1 / rate
+        self.speed = int(max(0, min(100, speed)))
+        self.dead_man = dead_man
+        self.indices = list(range(len(swarm))) if indices is None else list(indices)
+        self.sticks = [0, 0, 0, 0]
+        self.last_input = 0.0
+        self._pressed = {}
+        self._lock = Lock()
+        # Set by every input, wakes up the stream when the sticks leave the rest position
+        self._input = Event()
+        self._streaming = False
+        self._stop = Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name='rc-stream', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop streaming, the drones are left with their sticks at zero (hovering)"""
+        self._stop.set()
+        self._input.set()
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+        self.release_all()
+        if self._streaming:
+            self._send([0, 0, 0, 0])
+            self._streaming = False
+
+    def set_axes(self, left_right: int = 0, forward_backward: int = 0, up_down: int = 0, yaw: int = 0):
+        """Analog input (joystick), values from -100 to 100"""
+        with self._lock:
+            self._pressed.clear()
+            self.sticks = [int(max(-100, min(100, value))) for value in (left_right, forward_backward, up_down, yaw)]
+            self.last_input = monotonic()
+        self._input.set()
+
+    def press(self, key, exclusive: bool = False):
+        """
+        Push the stick bound to the key, return False if the key is not a move
+         :params: exclusive releases the other keys first (inputs without key release like a terminal)
+        """
+        axis = axes_from_key(key)
+        if axis is None:
+            return False
+        with self._lock:
+            if exclusive:
+                self._pressed.clear()
+            self._pressed[key] = axis
+            self._update_sticks()
+        self._input.set()
+        return True
+
+    def release(self, key):
+        with self._lock:
+            if self._pressed.pop(key, None) is not None:
+                self._update_sticks()
+
+    def release_all(self):
+        with self._lock:
+            self._pressed.clear()
+            self.sticks = [0, 0, 0, 0]
+
+    def _update_sticks(self):
+        sticks = [0, 0, 0, 0]
+        for axis, direction in self._pressed.values():
+            sticks[axis] += direction * self.speed
+        self.sticks = [max(-100, min(100, value)) for value in sticks]
+        self.last_input = monotonic()
+
+    def _send(self, sticks: list):
+        for index in self.indices:
+            self.swarm.send_rc(*sticks, index)
+
+    def _run(self):
+        """Timer thread, ticks are scheduled on absolute times so the rate doesn't drift"""
+        next_tick = monotonic()
+        while not self._stop.is_set() and self.swarm.is_connected:
+            self._input.clear()
+            with self._lock:
+                if any(self.sticks) and monotonic() - self.last_input > self.dead_man:
+                    # Dead-man : no news from the input for too long
+                    self._pressed.clear()
+                    self.sticks = [0, 0, 0, 0]
+                sticks = list(self.sticks)
+            if not any(sticks) and not self._streaming:
+                # Sticks at rest : sleep until the next input
+                self._input.wait()
+                next_tick = monotonic()
+                continue
+            self._send(sticks)
+            # The zero command ending a stream is only sent once
+            self._streaming = any(sticks)
+            # Skip the ticks missed when the sending was late instead of sending a burst
+            next_tick = max(next_tick + self.period, monotonic() - self.period)
+            self._stop.wait(max(0.0, next_tick - monotonic()))
@@ -0,0 +1,413 @@
+"""
+Swarm spread over several worker processes so decoding, state parsing and missions of a big fleet use every core
+
+Each shard is a process running a regular Swarm on a part of the drones. The parent talks to the shards through
+pipes (small pickled tuples) and every shard publishes the last state of its drones to the parent, which keeps
+the same telemetry attributes as a Swarm. Shard k asks its drones to send their state and video to
+state_port + k and video_port + k (SDK 'port' command) so the shards never share a local port. 'port' needs the
+Tello SDK 3.0 : drones which refuse it are listed in port_refused and logged, use a single shard with them
+
+Worker processes are started with the 'spawn' method, scripts using a ShardedSwarm need the usual
+if __name__ == '__main__': guard
+"""
+
+import os
+import logging
+import multiprocessing
+from time import monotonic
+from itertools import count
+from threading import Thread, Lock, Event
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from collections import defaultdict
+
+from telemetry import TelemetryBuffer
+from event_log import log_event
+from flight_modes import ActFromFileMode, ActFromActionListMode
+
+__all__ = ['ShardedSwarm']
+
+
+def _shard_worker(connection, tello_addresses: list, kwargs: dict, telemetry_period: float):
+    """Body of a shard process : serve the calls of the parent on its own Swarm"""
+    from swarm import Swarm
+
+    send_lock = Lock()
+
+    def reply(message):
+        with send_lock:
+            connection.send(message)
+
+    try:
+        swarm = Swarm(tello_addresses, **kwargs)
+    except Exception as exc:
+        reply(('ready', 0, False, repr(exc), []))
+        connection.close()
+        return
+    reply(('ready', len(swarm), swarm.is_connected, None, swarm.port_refused))
+
+    def publish_telemetry():
+        """Send the states received since the last period"""
+        last_sent = {}
+        while not swarm.shutdown_event.wait(telemetry_period):
+            states = [(index, state) for index, state in enumerate(swarm.last_parameters)
+                      if state is not None and last_sent.get(index) is not state]
+            if states:
+                last_sent.update(states)
+                try:
+                    reply(('telemetry', states))
+                except OSError:
+                    break
+
+    if swarm.state_listener:
+        Thread(target=publish_telemetry, name='shard-telemetry', daemon=True).start()
+
+    def run(call_id: int, method: str, args: tuple, call_kwargs: dict):
+        try:
+            result = getattr(swarm, method)(*args, **call_kwargs)
+        except Exception as exc:
+            result, error = None, exc
+        else:
+            error = None
+        try:
+            reply(('result', call_id, result, error))
+        except OSError:
+            pass
+        except Exception as exc:
+            # Result or exception which can't be pickled
+            reply(('result', call_id, None, RuntimeError(repr(exc))))
+
+    # Calls are served concurrently, a long mission doesn't block the other drones of the shard
+    with ThreadPoolExecutor(max_workers=max(4, len(tello_addresses)), thread_name_prefix='shard-call') as executor:
+        while True:
+            try:
+                request = connection.recv()
+            except (EOFError, OSError):
+                break
+            if request is None:
+                break
+            executor.submit(run, *request)
+        swarm.close()
+    connection.close()
+
+
+class ShardedSwarm:
+    """Swarm-like controller running its drones in one worker process per core"""
+    def __init__(self, tello_addresses: list, shards: int = None, telemetry_period: float = 0.1,
+                 start_timeout: float = 30, **kwargs: dict):
+        """
+         :params: shards is the number of worker processes (default one per core, at most one per drone)
+         :params: telemetry_period (s) is how often the shards publish the new states to the parent
+         :params: kwargs are given to the Swarm of every shard (state_listener, check_connection, ...), call_timeout (s)
+                  is added to the expected duration of a call before a shard which doesn't answer raises TimeoutError
+        """
+        if not tello_addresses:
+            raise ValueError('A ShardedSwarm needs the IP addresses of its drones')
+        shards = min(len(tello_addresses), shards or os.cpu_count() or 1)
+        self.tello_ip_addresses = list(tello_addresses)
+        self.back_to_base = kwargs.get('back_to_base', False)
+        self.state_listener = kwargs.get('state_listener', False)
+        self.shutdown_timeout = kwargs.get('shutdown_timeout', 2.0)
+        # Extra time given to a shard to answer a call, a hung shard process raises TimeoutError instead of blocking
+        self.call_timeout = kwargs.pop('call_timeout', 10.0)
+        self.all_instructions = []
+        self.last_parameters = [None for _ in self.tello_ip_addresses]
+        self.telemetry = [TelemetryBuffer(kwargs.get('telemetry_capacity', 36000)) for _ in self.tello_ip_addresses]
+        self.flight_mode = None
+        self._closed = False
+
+        # Contiguous blocks of drones : global index -> (shard, local index) and back
+        size, extra = divmod(len(self.tello_ip_addresses), shards)
+        self.shard_drones = []
+        start = 0
+        for shard in range(shards):
+            end = start + size + (shard < extra)
+            self.shard_drones.append(list(range(start, end)))
+            start = end
+        self.shard_of = [(shard, local) for shard, drones in enumerate(self.shard_drones) for local in range(len(drones))]
+
+        self._call_ids = count()
+        self._pending = {}
+        self._pending_lock = Lock()
+        self._send_locks = [Lock() for _ in range(shards)]
+        self._ready = [None] * shards
+        self._ready_events = [Event() for _ in range(shards)]
+
+        context = multiprocessing.get_context(kwargs.pop('start_method', 'spawn'))
+        base_state_port = kwargs.pop('state_port', 8890)
+        base_video_port = kwargs.pop('video_port', 11111)
+        self._connections = []
+        self._processes = []
+        self._readers = []
+        for shard, drones in enumerate(self.shard_drones):
+            parent_connection, child_connection = context.Pipe()
+            shard_kwargs = dict(kwargs, state_port=base_state_port + shard, video_port=base_video_port + shard)
+            process = context.Process(target=_shard_worker, name=f'swarm-shard-{shard}', daemon=True,
+                                      args=(child_connection, [self.tello_ip_addresses[index] for index in drones],
+                                            shard_kwargs, telemetry_period))
+            process.start()
+            child_connection.close()
+            reader = Thread(target=self._read, args=(shard, parent_connection), name=f'shard-reader-{shard}', daemon=True)
+            reader.start()
+            self._connections.append(parent_connection)
+            self._processes.append(process)
+            self._readers.append(reader)
+
+        for shard, event in enumerate(self._ready_events):
+            if not event.wait(start_timeout):
+                self.close()
+                raise TimeoutError(f'Shard {shard} did not start in {start_timeout} s')
+        errors = [ready[3] for ready in self._ready if ready[3] is not None]
+        if errors:
+            self.close()
+            raise ConnectionError(f'Some shards could not connect their drones : {errors}')
+        # Shards after the first one need the 'port' command of the SDK 3.0
+        self.port_refused = [self.shard_drones[shard][local] for shard, ready in enumerate(self._ready)
+                             for local in ready[4]]
+        if self.port_refused:
+            log_event('connection', logging.WARNING, 'Drones %s refused the port command (Tello SDK 3.0 needed), their '
+                      'state and video are not received : use shards=1 with these drones', self.port_refused)
+        print(self)
+
+    def __repr__(self):
+        result_string = f'\nI am a Swarm of {len(self)} Tello EDU drones in {len(self.shard_drones)} processes\n'
+        for shard, drones in enumerate(self.shard_drones):
+            result_string += f'\tshard {shard} : drones {drones[0]} to {drones[-1]}\n'
+        return result_string
+
+    def __len__(self):
+        return len(self.tello_ip_addresses)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def ip_addresses(self):
+        return self.tello_ip_addresses
+
+    @property
+    def is_connected(self):
+        return not self._closed
+
+    @property
+    def end_connection(self):
+        return self._closed
+
+    @end_connection.setter
+    def end_connection(self, value):
+        if value:
+            self.close()
+
+    def _read(self, shard: int, connection):
+        """Reader thread of one shard : results of the calls and telemetry"""
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                break
+            kind = message[0]
+            if kind == 'result':
+                _, call_id, result, error = message
+                with self._pending_lock:
+                    _, future = self._pending.pop(call_id, (None, None))
+                if future is None:
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+            elif kind == 'telemetry':
+                drones = self.shard_drones[shard]
+                for local, state in message[1]:
+                    self.last_parameters[drones[local]] = state
+                    self.telemetry[drones[local]].append(state)
+            elif kind == 'ready':
+                self._ready[shard] = message
+                self._ready_events[shard].set()
+
+        # The shard is gone, nobody will answer its calls
+        with self._pending_lock:
+            lost = [call_id for call_id, (call_shard, _) in self._pending.items() if call_shard == shard]
+            futures = [self._pending.pop(call_id)[1] for call_id in lost]
+        for future in futures:
+            future.set_exception(ConnectionError(f'Shard {shard} stopped'))
+        self._ready_events[shard].set()
+        if self._ready[shard] is None:
+            self._ready[shard] = ('ready', 0, False, 'process exited', [])
+
+    def _call(self, shard: int, method: str, *args, **kwargs):
+        """Call a method of the Swarm of a shard, return a Future"""
+        future = Future()
+        if self._closed:
+            future.set_exception(ConnectionError('The swarm is closed'))
+            return future
+        call_id = next(self._call_ids)
+        with self._pending_lock:
+            self._pending[call_id] = (shard, future)
+        try:
+            with self._send_locks[shard]:
+                self._connections[shard].send((call_id, method, args, kwargs))
+        except OSError as exc:
+            with self._pending_lock:
+                self._pending.pop(call_id, None)
+            future.set_exception(ConnectionError(f'Shard {shard} is not reachable : {exc}'))
+        return future
+
+    def _result(self, shard: int, future: Future, duration: float):
+        """Result of a call expected to last at most duration seconds (plus call_timeout)"""
+        try:
+            return future.result(duration + self.call_timeout)
+        except FutureTimeout:
+            raise TimeoutError(f'Shard {shard} did not answer in {duration + self.call_timeout:.1f} s') from None
+
+    def call_all(self, method: str, *args, **kwargs):
+        """Call a method on the Swarm of every shard in parallel, return the results in shard order"""
+        futures = [self._call(shard, method, *args, **kwargs) for shard in range(len(self.shard_drones))]
+        return [future.result() for future in futures]
+
+    def send(self, message: str, index: int):
+        """Send message to one drone"""
+        shard, local = self.shard_of[index]
+        self._result(shard, self._call(shard, 'send', message, local), 0)
+        self.all_instructions.append(f'{index}-{message}')
+
+    def send_each(self, commands: list):
+        """Send commands[index] to each drone (None skips a drone), shards in parallel (see Swarm.send_each)"""
+        shard_commands = [[None] * len(drones) for drones in self.shard_drones]
+        for index, message in enumerate(commands):
+            if message is not None:
+                shard, local = self.shard_of[index]
+                shard_commands[shard][local] = message
+        futures = [(shard, self._call(shard, 'send_each', local_commands))
+                   for shard, local_commands in enumerate(shard_commands) if any(local_commands)]
+        for shard, future in futures:
+            self._result(shard, future, 0)
+        self.all_instructions.extend(f'{index}-{message}' for index, message in enumerate(commands)
+                                     if message is not None)
+
+    def send_rc(self, left_right: int, forward_backward: int, up_down: int, yaw: int, index: int = 0):
+        """Streamed 'rc' command (see AbstractDrone.send_rc), the answer of the shard is not awaited"""
+        shard, local = self.shard_of[index]
+        self._call(shard, 'send_rc', left_right, forward_backward, up_down, yaw, local)
+        return True
+
+    def send_all(self, message: str, timeout: float = None):
+        """Send the same message to every drone, shards in parallel (see Swarm.send_all)"""
+        results = self.call_all('send_all', message, timeout)
+        self.all_instructions.extend(f'{index}-{message}' for index in range(len(self)))
+        if timeout is None:
+            return None
+        return [ack for shard_acks in results for ack in shard_acks]
+
+    def execute_actions(self, actions: list, parallel: bool = False):
+        """
+        Execute actions one after the other like Swarm.execute_actions
+         :params: parallel runs the actions of each shard at the same time as the other shards, the order is only
+                  kept between the drones of a same shard ('0-land' then '1-takeoff' may run together)
+        """
+        if not parallel:
+            self._execute_in_order(actions)
+            return
+        shard_actions = defaultdict(list)
+        for action in actions:
+            try:
+                index = int(action.split('-')[0])
+                command = action[len(str(index)) + 1:]
+            except ValueError:
+                # If no index is specified
+                index, command = 0, action
+            if index >= len(self):
+                print(f'index : {index} is too big.')
+                continue
+            shard, local = self.shard_of[index]
+            shard_actions[shard].append(f'{local}-{command}')
+            self.all_instructions.append(f'{index}-{command}')
+        futures = [self._call(shard, 'execute_actions', local_actions) for shard, local_actions in shard_actions.items()]
+        for future in futures:
+            future.result()
+
+    def _execute_in_order(self, actions: list):
+        """Same sequence as AbstractDrone.execute_actions, each command goes to the shard of its drone"""
+        for position, action in enumerate(actions):
+            if not self.is_connected:
+                break
+            try:
+                index = int(action.split('-')[0])
+                command = action[len(str(index)) + 1:]
+            except ValueError:
+                # If no index is specified
+                index, command = 0, action
+            if index >= len(self):
+                print(f'index : {index} is too big.')
+                continue
+            sent_at = monotonic()
+            self.send(command, index)
+            # Don't wait if there is no actions left
+            if position + 1 < len(actions):
+                self.wait_for_completion(index, sent_at, 3)
+
+    def wait_ack(self, index: int = 0, since: float = None, timeout: float = 7.0):
+        """See AbstractDrone.wait_ack (monotonic times are shared by the processes of the computer)"""
+        shard, local = self.shard_of[index]
+        return self._result(shard, self._call(shard, 'wait_ack', local, since, timeout), timeout)
+
+    def wait_for_completion(self, index: int, since: float, delay: float):
+        shard, local = self.shard_of[index]
+        return self._result(shard, self._call(shard, 'wait_for_completion', local, since, delay), delay)
+
+    def state(self, index: int = 0):
+        """Last DroneState published by the shard of the drone (None until the first one)"""
+        try:
+            return self.last_parameters[index]
+        except IndexError:
+            return None
+
+    def metrics(self):
+        """Counters summed over the shards, per drone counters with global indices and the snapshot of every shard"""
+        snapshots = self.call_all('metrics')
+        counters = defaultdict(int)
+        per_drone = {}
+        for shard, snapshot in enumerate(snapshots):
+            for name, value in snapshot['counters'].items():
+                counters[name] += value
+            for local, values in snapshot['per_drone'].items():
+                drones = self.shard_drones[shard]
+                per_drone[drones[local] if local < len(drones) else local] = values
+        return {'counters': dict(counters), 'per_drone': per_drone, 'shards': snapshots}
+
+    def init_flight_mode(self, flight_mode: str, **options: dict):
+        """Only the modes which just execute actions can be spread over processes"""
+        flight_mode = flight_mode.lower().strip()
+        if flight_mode == 'act from file':
+            if options.get('filename') is None:
+                raise TypeError("You forgot filename argument.")
+            self.flight_mode = ActFromFileMode(self, **options)
+        elif flight_mode == 'act from list':
+            if options.get('actions') is None:
+                raise TypeError("You forgot actions argument.")
+            self.flight_mode = ActFromActionListMode(self, **options)
+        else:
+            raise ValueError(f'{flight_mode} is not available with a ShardedSwarm, use a Swarm')
+
+    def close(self):
+        """Close the Swarm of every shard and wait for the processes"""
+        if self._closed:
+            return
+        self._closed = True
+        for shard, connection in enumerate(self._connections):
+            try:
+                with self._send_locks[shard]:
+                    connection.send(None)
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(self.shutdown_timeout + 1)
+            if process.is_alive():
+                process.terminate()
+                process.join(1)
+        for connection in self._connections:
+            connection.close()
+        for reader in self._readers:
+            reader.join(1)
@@ -0,0 +1,130 @@
+"""
+Drones always send their state to port 8890 and their video to port 11111 of the controller, so only one socket of
+the process can bind each of these ports. A SharedListener owns that socket and dispatches the packets by source
+address to the controllers (TelloEDU, Swarm) subscribed to these drones, several controllers can then run side by side
+
+Each controller reads its packets from a Subscription, which behaves like the UDP socket it replaces
+"""
+
+import queue
+import socket
+from threading import Thread, Lock
+
+__all__ = ['SharedListener', 'Subscription']
+
+
+class Subscription:
+    """Socket-like queue of the packets sent by some drones to a shared port"""
+    def __init__(self, listener, ip_addresses: list, max_packets: int = 1024):
+        self.listener = listener
+        self.ip_addresses = list(ip_addresses)
+        self.dropped = 0
+        self.closed = False
+        self._queue = queue.Queue(max_packets)
+        self._timeout = None
+
+    def put(self, data: bytes, address: tuple):
+        """Called by the listener thread, the packet is dropped if the controller does not keep up"""
+        try:
+            self._queue.put_nowait((data, address))
+        except queue.Full:
+            self.dropped += 1
+
+    def settimeout(self, timeout: float):
+        self._timeout = timeout
+
+    def recvfrom(self, _bufsize: int = 2048):
+        """Next (data, address) packet, raise socket.timeout or OSError once closed"""
+        try:
+            packet = self._queue.get(timeout=self._timeout)
+        except queue.Empty:
+            raise socket.timeout('timed out') from None
+        if packet is None:
+            # Let the other readers see the end too
+            self._queue.put(None)
+            raise OSError('Subscription closed')
+        return packet
+
+    def close(self):
+        """Unsubscribe and wake up the reader"""
+        if not self.closed:
+            self.closed = True
+            self.listener.unsubscribe(self)
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                self._queue.get_nowait()
+                self._queue.put_nowait(None)
+
+
+class SharedListener:
+    """One UDP socket bound on a local port, packets are dispatched by source IP to the subscriptions"""
+    _listeners = {}
+    _registry_lock = Lock()
+
+    def __init__(self, port: int, host: str = ''):
+        self.port = port
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.unknown_packets = 0
+        self._routes = {}
+        self._running = True
+        self._thread = Thread(target=self._run, name=f'listener-{port}', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def subscribe(cls, port: int, ip_addresses: list, max_packets: int = 1024):
+        """
+        Receive the packets sent by these drones to the local port, the listener is created on first use
+        Raise ValueError if one of the drones is already listened by another controller
+        """
+        with cls._registry_lock:
+            listener = cls._listeners.get(port)
+            if listener is None:
+                listener = cls._listeners[port] = cls(port)
+            taken = [ip for ip in ip_addresses if ip in listener._routes]
+            if taken:
+                raise ValueError(f'{taken} are already listened on port {port} by another controller')
+            subscription = Subscription(listener, ip_addresses, max_packets)
+            # The routes are replaced by a new dict so the listener thread never sees it changing
+            listener._routes = {**listener._routes, **{ip: subscription for ip in ip_addresses}}
+        return subscription
+
+    @classmethod
+    def unsubscribe(cls, subscription: Subscription):
+        """Remove the routes of the subscription, the listener is closed with its last subscription"""
+        with cls._registry_lock:
+            listener = subscription.listener
+            listener._routes = {ip: route for ip, route in listener._routes.items() if route is not subscription}
+            if not listener._routes and cls._listeners.get(listener.port) is listener:
+                del cls._listeners[listener.port]
+                listener._stop()
+
+    def _run(self):
+        while self._running:
+            try:
+                data, address = self.socket.recvfrom(2048)
+            except OSError:
+                break
+            if not self._running:
+                break
+            subscription = self._routes.get(address[0])
+            if subscription is None:
+                self.unknown_packets += 1
+            else:
+                subscription.put(data, address)
+
+    def _stop(self):
+        """Wake up the listener thread (socket shutdown on Linux, empty datagram elsewhere) and close the socket"""
+        self._running = False
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as waker:
+                waker.sendto(b'', ('127.0.0.1', self.port))
+        except OSError:
+            pass
+        self._thread.join(1)
+        self.socket.close()
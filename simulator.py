@@ -0,0 +1,386 @@
+"""
+Local Tello SDK simulator used to run the API, the flight modes and the benchmarks without real drones
+Every simulated drone listens on its own (ip, 8889) address, answers commands with acks, streams its state at 10 Hz
+to the controller (port 8890) and can replay a recorded H.264 file on the video port (11111)
+
+All simulated drones are served by a single thread (selectors + timers) so dozens of them fit in one process
+On Linux the whole 127.0.0.0/8 range is bound to the loopback, drones get 127.0.0.1, 127.0.0.2, ... by default
+
+    with TelloSimulator(count=4, latency=0.02, loss=0.01) as simulator:
+        my_swarm = Swarm(simulator.ips, check_connection=False)
+"""
+
+import heapq
+import random
+import socket
+import selectors
+import argparse
+import itertools
+from math import cos, sin, radians, sqrt
+from threading import Thread, Event
+from time import monotonic, sleep
+
+__all__ = ['SimulatedDrone', 'TelloSimulator', 'split_h264']
+
+TAKEOFF_HEIGHT = 80
+# Size of a full video packet sent by the Tello, a shorter packet ends a frame
+VIDEO_PACKET_SIZE = 1460
+QUERIES = ('battery?', 'speed?', 'time?', 'wifi?', 'sdk?', 'sn?', 'height?', 'temp?', 'attitude?', 'baro?', 'tof?',
+           'acceleration?')
+MOVES = {'up': (0, 0, 1), 'down': (0, 0, -1), 'left': (0, 1, 0), 'right': (0, -1, 0), 'forward': (1, 0, 0),
+         'back': (-1, 0, 0)}
+
+
+def split_h264(data: bytes):
+    """Split an Annex B H.264 stream on its start codes, return the NAL units (start code included)"""
+    positions = []
+    index = data.find(b'\x00\x00\x00\x01')
+    while index != -1:
+        positions.append(index)
+        index = data.find(b'\x00\x00\x00\x01', index + 4)
+    if not positions:
+        return [data] if data else []
+    positions.append(len(data))
+    return [data[start:end] for start, end in zip(positions, positions[1:])]
+
+
+class SimulatedDrone:
+    """Minimal physical model of a Tello answering SDK commands"""
+    def __init__(self, index: int, address: tuple, sdk_version: int = 30):
+        self.index = index
+        self.address = address
+        # 'port' only exists since the SDK 3.0
+        self.sdk_version = sdk_version
+        self.serial = f'0TQSIM{index:06d}'
+        self.client = None
+        self.sdk_mode = self.flying = self.streaming = False
+
+        self.position = [0.0, 0.0, 0.0]
+        # Degrees increasing clockwise like the yaw of the drone
+        self.yaw = 0.0
+        # Time of the last update, rc sticks move the drone for the real elapsed time
+        self.updated_at = None
+        self.speed = 100
+        self.velocity = (0.0, 0.0, 0.0)
+        self.battery = 100.0
+        self.flight_time = 0.0
+        # Current move : (start time, duration, start position, end position, start yaw, end yaw)
+        self.motion = None
+        self.rc_velocity = (0.0, 0.0, 0.0, 0.0)
+        self.video_frame = 0
+        # Set by the 'port' command, None uses the ports of the simulator
+        self.state_port = self.video_port = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.index}, {self.address[0]}, flying={self.flying})'
+
+    def _start_motion(self, now: float, forward: float, left: float, up: float, yaw: float = 0, speed: float = None):
+        """Start a straight move expressed in the body frame, a positive yaw turns clockwise"""
+        self.update(now)
+        heading = radians(self.yaw)
+        # x ahead and y on the left at yaw 0, the heading turns clockwise seen from above
+        delta = (forward * cos(heading) + left * sin(heading),
+                 -forward * sin(heading) + left * cos(heading),
+                 up)
+        end = [self.position[axis] + delta[axis] for axis in range(3)]
+        end[2] = max(0.0, end[2])
+        distance = sqrt(sum(value ** 2 for value in delta))
+        duration = max(distance / (speed or self.speed), abs(yaw) / 90, 0.1)
+        self.motion = (now, duration, list(self.position), end, self.yaw, self.yaw + yaw)
+
+    def update(self, now: float):
+        """Move the drone to its position at time now"""
+        if self.motion is not None:
+            start, duration, origin, end, start_yaw, end_yaw = self.motion
+            ratio = min(1.0, (now - start) / duration)
+            self.position = [origin[axis] + (end[axis] - origin[axis]) * ratio for axis in range(3)]
+            self.yaw = start_yaw + (end_yaw - start_yaw) * ratio
+            if ratio < 1:
+                self.velocity = tuple((end[axis] - origin[axis]) / duration for axis in range(3))
+            else:
+                self.velocity = (0.0, 0.0, 0.0)
+                self.motion = None
+                if self.position[2] <= 0:
+                    self.flying = False
+        elif self.flying and any(self.rc_velocity):
+            # rc values are a percentage of the max speed (~100 cm/s)
+            left_right, forward, up, yaw = self.rc_velocity
+            heading = radians(self.yaw)
+            self.velocity = (forward * cos(heading) - left_right * sin(heading),
+                             -forward * sin(heading) - left_right * cos(heading),
+                             float(up))
+            dt = 0.0 if self.updated_at is None else now - self.updated_at
+            self.position = [self.position[axis] + self.velocity[axis] * dt for axis in range(3)]
+            self.position[2] = max(0.0, self.position[2])
+            self.yaw += yaw * dt
+        else:
+            self.velocity = (0.0, 0.0, 0.0)
+        self.yaw = (self.yaw + 180) % 360 - 180
+        self.updated_at = now
+
+    def tick(self, now: float, period: float):
+        """Called at each state period"""
+        self.update(now)
+        if self.flying:
+            self.flight_time += period
+            self.battery = max(0.0, self.battery - period / 30)
+
+    def handle(self, command: str, now: float):
+        """Apply a command, return the response (None for commands without response like rc)"""
+        words = command.strip().split(' ')
+        verb, args = words[0], words[1:]
+        try:
+            values = [int(float(arg)) for arg in args if arg.lstrip('-').replace('.', '', 1).isdigit()]
+            if verb == 'command':
+                self.sdk_mode = True
+                return 'ok'
+            if not self.sdk_mode:
+                return None
+            if verb in QUERIES:
+                return self.query(verb)
+            if verb == 'rc':
+                self.rc_velocity = tuple(values[:4])
+                return None
+            if verb == 'port':
+                if self.sdk_version < 30:
+                    return 'error'
+                self.state_port, self.video_port = values[0], values[1]
+                return 'ok'
+            if verb in ('streamon', 'streamoff'):
+                self.streaming = verb == 'streamon'
+                return 'ok'
+            if verb in ('mon', 'moff', 'mdirection', 'wifi', 'ap'):
+                return 'ok'
+            if verb == 'speed':
+                self.speed = values[0]
+                return 'ok'
+            if verb == 'emergency':
+                self.motion = None
+                self.flying = False
+                self.position[2] = 0.0
+                return 'ok'
+            if verb == 'takeoff':
+                self.flying = True
+                self._start_motion(now, 0, 0, TAKEOFF_HEIGHT - self.position[2], speed=60)
+                return 'ok'
+            if not self.flying:
+                return 'error Not flying'
+            if verb == 'land':
+                self._start_motion(now, 0, 0, -self.position[2], speed=60)
+                return 'ok'
+            if verb in MOVES:
+                forward, left, up = (axis * values[0] for axis in MOVES[verb])
+                self._start_motion(now, forward, left, up)
+                return 'ok'
+            if verb in ('cw', 'ccw'):
+                self._start_motion(now, 0, 0, 0, values[0] if verb == 'cw' else -values[0])
+                return 'ok'
+            if verb == 'go':
+                self._start_motion(now, values[0], values[1], values[2], speed=values[3])
+                return 'ok'
+            if verb == 'curve':
+                self._start_motion(now, values[3], values[4], values[5], speed=values[6])
+                return 'ok'
+            if verb in ('flip', 'stop'):
+                return 'ok'
+        except (IndexError, ValueError, ZeroDivisionError):
+            return 'error'
+        return 'error'
+
+    def query(self, verb: str):
+        """Answer the read commands"""
+        height = int(self.position[2])
+        answers = {
+            'battery?': str(int(self.battery)),
+            'speed?': f'{self.speed:.1f}',
+            'time?': f'{int(self.flight_time)}s',
+            'wifi?': '90',
+            'sdk?': str(self.sdk_version),
+            'sn?': self.serial,
+            'height?': f'{height // 10}dm',
+            'temp?': '60~63C',
+            'attitude?': f'pitch:0;roll:0;yaw:{int(self.yaw)};',
+            'baro?': f'{100 + height / 100:.2f}',
+            'tof?': f'{max(100, height * 10)}mm',
+            'acceleration?': 'agx:0.00;agy:0.00;agz:-1000.00;',
+        }
+        return answers[verb]
+
+    def state_packet(self):
+        """State string sent at 10 Hz (speeds in dm/s like the drone)"""
+        vgx, vgy, vgz = (int(value / 10) for value in self.velocity)
+        height = int(self.position[2])
+        return (f'mid:-1;x:-100;y:-100;z:-100;mpry:0,0,0;pitch:0;roll:0;yaw:{int(self.yaw)};'
+                f'vgx:{vgx};vgy:{vgy};vgz:{vgz};templ:60;temph:63;tof:{max(10, height)};h:{height};'
+                f'bat:{int(self.battery)};baro:{100 + height / 100:.2f};time:{int(self.flight_time)};'
+                f'agx:0.00;agy:0.00;agz:-1000.00;\r\n').encode()
+
+
+class TelloSimulator:
+    """Serve many simulated drones from one thread"""
+    def __init__(self, count: int = 1, ips: list = None, command_port: int = 8889, state_port: int = 8890,
+                 video_port: int = 11111, latency: float = 0.01, jitter: float = 0.0, loss: float = 0.0,
+                 state_rate: float = 10, video_file: str = None, video_fps: float = 30, seed: int = None,
+                 sdk_version: int = 30):
+        """
+         :params: ips of the simulated drones (default 127.0.0.1 ... 127.0.0.count)
+         :params: sdk_version answered to 'sdk?', 20 refuses the 'port' command like a Tello EDU before the SDK 3.0
+         :params: state_port and video_port are the controller ports the state and the video are sent to
+         :params: latency (s) + uniform jitter (s) delay every ack, loss is the probability to drop an ack or a state packet
+         :params: video_file is a raw H.264 (Annex B) recording replayed in loop after 'streamon'
+        """
+        if ips is None:
+            ips = [f'127.0.0.{index + 1}' for index in range(count)]
+        self.drones = [SimulatedDrone(index, (ip, command_port), sdk_version) for index, ip in enumerate(ips)]
+        self.state_port = state_port
+        self.video_port = video_port
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.state_period = 1 / state_rate
+        self.video_period = 1 / video_fps
+        self.random = random.Random(seed)
+
+        self.video_frames = []
+        if video_file is not None:
+            with open(video_file, 'rb') as file:
+                self.video_frames = split_h264(file.read())
+
+        self.commands_received = self.acks_sent = self.acks_dropped = 0
+        self.state_packets_sent = self.video_packets_sent = 0
+
+        self._selector = selectors.DefaultSelector()
+        self._sockets = {}
+        self._timers = []
+        self._timer_ids = itertools.count()
+        self._stop = Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __len__(self):
+        return len(self.drones)
+
+    @property
+    def ips(self):
+        """IP addresses to give to TelloEDU / Swarm"""
+        return [drone.address[0] for drone in self.drones]
+
+    def start(self):
+        """Bind every drone socket and start serving"""
+        for drone in self.drones:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(drone.address)
+            sock.setblocking(False)
+            self._sockets[drone.index] = sock
+            self._selector.register(sock, selectors.EVENT_READ, drone)
+        now = monotonic()
+        self._schedule(now + self.state_period, self._state_tick)
+        if self.video_frames:
+            self._schedule(now + self.video_period, self._video_tick)
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='tello-simulator', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2):
+        """Stop serving and close every socket"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        for sock in self._sockets.values():
+            self._selector.unregister(sock)
+            sock.close()
+        self._sockets.clear()
+        self._timers.clear()
+
+    def _schedule(self, when: float, callback, *args):
+        heapq.heappush(self._timers, (when, next(self._timer_ids), callback, args))
+
+    def _send(self, drone: SimulatedDrone, data: bytes, port: int):
+        """Send from the drone socket to the controller which sent the last command"""
+        if drone.client is None or drone.index not in self._sockets:
+            return False
+        try:
+            self._sockets[drone.index].sendto(data, (drone.client[0], port))
+        except OSError:
+            return False
+        return True
+
+    def _ack(self, drone: SimulatedDrone, response: str):
+        if self._send(drone, response.encode(), drone.client[1]):
+            self.acks_sent += 1
+
+    def _receive(self, drone: SimulatedDrone, sock):
+        try:
+            data, client = sock.recvfrom(2048)
+        except (BlockingIOError, OSError):
+            return
+        now = monotonic()
+        self.commands_received += 1
+        drone.client = client
+        response = drone.handle(data.decode('utf-8', 'ignore'), now)
+        if response is None:
+            return
+        if self.random.random() < self.loss:
+            self.acks_dropped += 1
+            return
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        self._schedule(now + delay, self._ack, drone, response)
+
+    def _state_tick(self):
+        """Send the state of every drone in SDK mode, then reschedule"""
+        now = monotonic()
+        for drone in self.drones:
+            drone.tick(now, self.state_period)
+            if drone.sdk_mode and self.random.random() >= self.loss:
+                if self._send(drone, drone.state_packet(), drone.state_port or self.state_port):
+                    self.state_packets_sent += 1
+        self._schedule(now + self.state_period, self._state_tick)
+
+    def _video_tick(self):
+        """Send the next frame of the recording to every streaming drone, cut in 1460 bytes packets"""
+        for drone in self.drones:
+            if not drone.streaming:
+                continue
+            frame = self.video_frames[drone.video_frame % len(self.video_frames)]
+            drone.video_frame += 1
+            for start in range(0, len(frame), VIDEO_PACKET_SIZE):
+                if self._send(drone, frame[start:start + VIDEO_PACKET_SIZE], drone.video_port or self.video_port):
+                    self.video_packets_sent += 1
+        self._schedule(monotonic() + self.video_period, self._video_tick)
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, _, callback, args = heapq.heappop(self._timers)
+                callback(*args)
+            timeout = min(0.1, max(0.0, self._timers[0][0] - monotonic())) if self._timers else 0.1
+            for key, _ in self._selector.select(timeout):
+                self._receive(key.data, key.fileobj)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate Tello EDU drones on the loopback')
+    parser.add_argument('-n', '--count', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--video', default=None, help='raw H.264 file replayed after streamon')
+    arguments = parser.parse_args()
+
+    with TelloSimulator(arguments.count, latency=arguments.latency, jitter=arguments.jitter, loss=arguments.loss,
+                        video_file=arguments.video) as simulator:
+        print(f'Simulated drones : {simulator.ips}')
+        try:
+            while True:
+                sleep(1)
+        except KeyboardInterrupt:
+            print('Simulator stopped')
@@ -6,10 +6,14 @@ can do, the TelloEDU could be removed but just the name of 'swarm' for only one
 
 import sys
 import socket
-from time import sleep
+import logging
+from time import perf_counter, monotonic
 from PIL import Image
 
 from abstract_drone import AbstractDrone, AV_AVAILABLE, LIB_AVAILABLE
+from telemetry import parse_state, TelemetryBuffer
+from event_log import log_event
+from tracing import span
 
 class Swarm(AbstractDrone):
     """Class created to interact with the drone"""
@@ -29,7 +33,8 @@ class Swarm(AbstractDrone):
         # Easier to store adresses to iterate over
         self.tello_ip_addresses = tello_addresses
         #Store the last state for each drone
-        self.last_parameters = [[] for _ in range(len(self))]
+        self.last_parameters = [None for _ in range(len(self))]
+        self.telemetry = [TelemetryBuffer(self.telemetry_capacity) for _ in range(len(self))]
 
         self._end_connection = self.test_drone_connection()
         if self.is_connected:
@@ -50,64 +55,142 @@ class Swarm(AbstractDrone):
     def __len__(self):
         return len(self.tello_ip_addresses)
 
+    @property
+    def ip_addresses(self):
+        return list(self.tello_ip_addresses)
+
     def init_commands(self):
         """Init drones' SDK """
+        port_sent = {}
         for index in range(len(self)):
             #Init connexion (SDK Mode)
             self.send('command', index)
+            #Drones send their state and video to 8890 / 11111 unless told otherwise
+            if self.state_port != 8890 or self.video_port != 11111:
+                port_sent[index] = monotonic()
+                self.send(f'port {self.state_port} {self.video_port}', index)
             #Enable video streaming
             if self.video_stream:
                 self.send('streamon', index)
+        if port_sent:
+            self.check_port(port_sent)
 
     def test_drone_connection(self):
         """
         Test if the drones are still connected
         """
+        if not self.check_connection:
+            return not self.tello_ip_addresses
         for index, drone_ip in enumerate(self.tello_ip_addresses):
             if not self.still_connected(drone_ip):
                 print(f'{drone_ip} is not reachable')
                 del self.tello_ip_addresses[index]
                 del self.last_parameters[index]
+                del self.telemetry[index]
         return not self.tello_ip_addresses
 
     def send(self, message, index: int):
         """Send message to drone using UDP Socket"""
         try:
-            self.command_socket.sendto(message.encode(), (self.tello_ip_addresses[index], 8889))
-        except (OSError, IndexError):
-            self._end_connection = True
+            self._transmit(message, index)
+        finally:
+            with span('connection check', 'command', drone=index):
+                self.end_connection = self.test_drone_connection()
+
+    def send_each(self, commands: list):
+        """
+        Send commands[index] to each drone (None skips a drone) without waiting between them
+        The connection of the swarm is checked once for the whole round instead of after every command
+        """
+        try:
+            for index, message in enumerate(commands):
+                if message is not None and not self._transmit(message, index):
+                    break
+        finally:
+            with span('connection check', 'command', drones=len(commands)):
+                self.end_connection = self.test_drone_connection()
+
+    def _transmit(self, message, index: int):
+        """Send one datagram with its bookkeeping, return False if the socket is closed"""
+        try:
+            address = (self.tello_ip_addresses[index], 8889)
+            with span('send', 'command', drone=index, command=message):
+                # Registered first, the ack can't arrive before its command is known
+                self.command_sent(index, message)
+                self.command_socket.sendto(message.encode(), address)
+        except IndexError:
+            print(f'{index}-There is no drone with this index')
+        except OSError:
             print(f'{index}-Socket has already been closed')
+            self.end_connection = True
+            return False
         else:
-            print(f'Drone {index} - Sending message: {message}')
+            log_event('send', logging.INFO, 'Drone %s - Sending message: %s', index, message)
             self.all_instructions.append(str(index) + '-' + message)
-        finally:
-            self.end_connection = self.test_drone_connection()
+        return True
+
+    def send_all(self, message: str, timeout: float = None):
+        """
+        Send the same message to every drone without waiting between them
+        With a timeout, wait for the acks and return them (None for a drone which did not answer)
+        """
+        sent_at = monotonic()
+        self.send_each([message] * len(self))
+        if timeout is None:
+            return None
+        deadline = sent_at + timeout
+        return [self.wait_ack(index, sent_at, max(0, deadline - monotonic())) for index in range(len(self))]
 
     def receive_ack(self):
         """Use UDP socket to receive ack from each command we sended"""
         while self.is_connected:
             try:
                 response, ip_address = self.command_socket.recvfrom(2048)
-                print(f'{self.tello_ip_addresses.index(ip_address[0])}-Received message : {response.decode("utf-8", "ignore")}')
             except (socket.timeout, ConnectionResetError, OSError):
-                self._end_connection = True
-                self.test_drone_connection()
-                print('Drone is not reachable anymore')
+                if not self.shutdown_event.is_set():
+                    print('Drone is not reachable anymore')
+                    self.end_connection = True
+                break
+            # Woken up by end_connection
+            if self.shutdown_event.is_set():
+                break
+            try:
+                drone_index = self.tello_ip_addresses.index(ip_address[0])
+            except ValueError:
+                # Packet from an unknown address
+                continue
+            response = response.decode("utf-8", "ignore")
+            self.record_ack(drone_index, response)
+            log_event('ack', logging.INFO, '%s-Received message : %s', drone_index, response)
         # print('ack thread done')
 
     def receive_state(self, parameters: list):
-        """Use UDP socket to receive all infos from the state channel"""
-        sleep(2)
+        """Use UDP socket to receive all infos from the state channel, every packet is parsed"""
         while self.is_connected:
             try:
                 last_state, ip_address = self.state_socket.recvfrom(2048)
+            except OSError as exc:
+                if not self.shutdown_event.is_set():
+                    log_event('state', logging.ERROR, 'Error receiving: %s - Drone is not reachable anymore', exc)
+                break
+            if self.shutdown_event.is_set():
+                break
+            try:
                 drone_index = self.tello_ip_addresses.index(ip_address[0])
-                parameters[drone_index] = last_state.decode().split(';')[:-1]
-                print(f'{drone_index}-parameters : {parameters[drone_index]}')
-                sleep(3)
-            except Exception as exc:
-                print(f'Error receiving: {exc}')
-                print('Drone is not reachable anymore')
+                state = parse_state(last_state)
+                # Swapping the reference is atomic so readers don't need any lock
+                parameters[drone_index] = state
+            except ValueError as exc:
+                # Unknown sender or malformed packet
+                log_event('state', logging.WARNING, 'Ignored state packet: %s', exc)
+                continue
+            except IndexError:
+                # The drone has just been removed from the swarm
+                continue
+            self._metrics.state_received(drone_index, state.timestamp)
+            self.telemetry[drone_index].append(state)
+            if self.telemetry_exporter is not None:
+                self.telemetry_exporter.push(drone_index, state)
 
     def receive_frame(self):
         """
@@ -118,30 +201,41 @@ class Swarm(AbstractDrone):
         """
         print('If you are not directly connected to drone Wifi, Video Stream is impossible')
         all_data = b''
-        sleep(4)
+        # Let the drone start the stream, unless the connection is closed meanwhile
+        if self.shutdown_event.wait(4):
+            return
         while self.is_connected:
             try:
                 rcv_bytes, _ = self.videostream_socket.recvfrom(2048)
-
-                all_data += rcv_bytes
-                self.video_frames.add_data(rcv_bytes)
-
-                # If it's the ending frame of a picture
-                if len(rcv_bytes) != 1460:
+            except socket.timeout:
+                continue
+            except OSError as exc:
+                if not self.shutdown_event.is_set():
+                    log_event('video', logging.ERROR, 'Video stream stopped: %s', exc)
+                break
+            if self.shutdown_event.is_set():
+                break
+
+            all_data += rcv_bytes
+            self._metrics.video_packet()
+            self.video_frames.add_data(rcv_bytes)
+
+            # If it's the ending frame of a picture
+            if len(rcv_bytes) != 1460:
+                decode_start = perf_counter()
+                frames = []
+                with span('decode', 'video', size=len(all_data)):
                     if LIB_AVAILABLE:
                         ## IMAGE PROCESSING | Input = h264
-                        for frame in self.process_frame(all_data):
-                            picture = Image.fromarray(frame)
-                            self.last_frame = picture
-                    if AV_AVAILABLE:
+                        frames = self.process_frame(all_data)
+                    elif AV_AVAILABLE:
                         ## IMAGE PROCESSING | Input = h264
-                        for frame in self.process_frame():
-                            picture = Image.fromarray(frame)
-                            self.last_frame = picture
-
-                    all_data = b''
-            except IndexError as exc:
-                print(exc)
+                        frames = self.process_frame()
+                self._metrics.frames_decoded(perf_counter() - decode_start, len(frames))
+                with span('to image', 'video', frames=len(frames)):
+                    for frame in frames:
+                        self.update_last_frame(Image.fromarray(frame))
+                all_data = b''
         print('frame thread done')
 
 if __name__ == '__main__':
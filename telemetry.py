@@ -0,0 +1,198 @@
+"""
+Parsing of the state channel of the Tello
+Every packet ('mid:-1;x:0;y:0;z:0;mpry:0,0,0;pitch:0;...;agz:-999.00;') becomes a DroneState record with typed fields
+The history of each drone is kept in a bounded columnar ring buffer (TelemetryBuffer)
+"""
+
+from time import monotonic, sleep
+import numpy as np
+
+__all__ = ['DroneState', 'parse_state', 'TelemetryBuffer', 'CompletionDetector', 'STATE_FIELDS']
+
+# Mission pad fields first, then the attitude / speed / sensors fields in the order sent by the drone
+STATE_FIELDS = ('mid', 'x', 'y', 'z', 'mpry', 'pitch', 'roll', 'yaw', 'vgx', 'vgy', 'vgz', 'templ', 'temph',
+                'tof', 'h', 'bat', 'baro', 'time', 'agx', 'agy', 'agz')
+FLOAT_FIELDS = ('baro', 'agx', 'agy', 'agz')
+
+
+def _mpry(value: str):
+    """Mission pad pitch, roll and yaw"""
+    pitch, roll, yaw = value.split(',')
+    return (int(pitch), int(roll), int(yaw))
+
+
+CONVERTERS = {field: int for field in STATE_FIELDS}
+CONVERTERS.update({field: float for field in FLOAT_FIELDS})
+CONVERTERS['mpry'] = _mpry
+
+
+class DroneState:
+    """One state packet of the drone, fields are named after the SDK keys (cm, cm/s, degrees, 0.001g, °C, %)"""
+    __slots__ = STATE_FIELDS + ('timestamp', )
+
+    def __init__(self, timestamp: float = 0.0):
+        for field in STATE_FIELDS:
+            setattr(self, field, 0)
+        for field in FLOAT_FIELDS:
+            setattr(self, field, 0.0)
+        self.mpry = (0, 0, 0)
+        # Local reception time (time.monotonic)
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(h={self.h}, yaw={self.yaw}, bat={self.bat}, tof={self.tof}, mid={self.mid})'
+
+    @property
+    def mission_pad_detected(self):
+        """The drone sends negative ids when no mission pad is seen (or detection is off)"""
+        return self.mid > 0
+
+    def as_dict(self):
+        """All fields of the record"""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+def parse_state(data: bytes, timestamp: float = None):
+    """Build a DroneState from a raw packet, raise ValueError if a known field is malformed"""
+    state = DroneState(monotonic() if timestamp is None else timestamp)
+    for item in data.decode('ascii', 'ignore').strip().split(';'):
+        key, _, value = item.partition(':')
+        converter = CONVERTERS.get(key)
+        if converter is not None:
+            setattr(state, key, converter(value))
+    return state
+
+
+class TelemetryBuffer:
+    """
+    Preallocated numpy columns holding the last states of one drone
+    Appending is O(1), the oldest states are overwritten once the capacity is reached
+    Queries return dicts of numpy arrays (one per column) in chronological order
+    """
+    COLUMNS = ('timestamp', ) + tuple(field for field in STATE_FIELDS if field != 'mpry')
+
+    def __init__(self, capacity: int = 36000):
+        """
+         :params: capacity is the number of states kept (36000 is one hour at 10 Hz, ~6 MB)
+        """
+        self.capacity = capacity
+        self._data = np.zeros((len(self.COLUMNS), capacity), dtype=np.float64)
+        # Total number of states appended since the creation of the buffer
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, state: DroneState):
+        """Store a state in the next slot"""
+        self._data[:, self._count % self.capacity] = [getattr(state, column) for column in self.COLUMNS]
+        self._count += 1
+
+    def _ordered(self, last: int = None):
+        """Copy of the last states, oldest first, as a (columns, n) array"""
+        count = self._count
+        size = min(count, self.capacity) if last is None else min(count, self.capacity, last)
+        slots = np.arange(count - size, count) % self.capacity
+        return self._data[:, slots]
+
+    def _since(self, seconds: float = None, now: float = None):
+        """States received during the last seconds (all the states if seconds is None)"""
+        data = self._ordered()
+        if seconds is None or not data.shape[1]:
+            return data
+        now = data[0, -1] if now is None else now
+        return data[:, np.searchsorted(data[0], now - seconds):]
+
+    def _as_dict(self, data):
+        return dict(zip(self.COLUMNS, data))
+
+    def last(self, count: int):
+        """The last count states"""
+        return self._as_dict(self._ordered(count))
+
+    def window(self, seconds: float = None, now: float = None):
+        """States received during the last seconds, up to now (monotonic time) or the last state"""
+        return self._as_dict(self._since(seconds, now))
+
+    def downsample(self, period: float = 1.0, seconds: float = None):
+        """Mean of every column over consecutive periods of time (1 Hz by default)"""
+        data = self._since(seconds)
+        if not data.shape[1]:
+            return self._as_dict(data)
+        bins = ((data[0] - data[0, 0]) // period).astype(np.int64)
+        _, starts, counts = np.unique(bins, return_index=True, return_counts=True)
+        return self._as_dict(np.add.reduceat(data, starts, axis=1) / counts)
+
+    def stats(self, seconds: float = None):
+        """Min, max and mean of every column over the window"""
+        data = self._since(seconds)
+        if not data.shape[1]:
+            return {}
+        return {'min': self._as_dict(data.min(axis=1)),
+                'max': self._as_dict(data.max(axis=1)),
+                'mean': self._as_dict(data.mean(axis=1))}
+
+
+class CompletionDetector:
+    """
+    Tell when a drone has physically stopped after a command by watching its telemetry
+    A move is complete when speeds are near zero and yaw / height are steady during settle_time seconds, once the drone
+    has been seen moving (or min_fraction of the expected duration has passed, for commands which don't move it)
+    """
+    def __init__(self, speed_tolerance: int = 1, yaw_tolerance: int = 1, height_tolerance: int = 5,
+                 settle_time: float = 0.5, min_wait: float = 0.5, min_samples: int = 3, poll: float = 0.05,
+                 timeout_factor: float = 2.0, min_fraction: float = 0.5):
+        """
+         :params: speed_tolerance (vgx/vgy/vgz units), yaw_tolerance (degrees) and height_tolerance (cm) define 'stopped'
+         :params: min_wait ignores the states received just after the command, before the drone starts moving
+         :params: timeout_factor scales the expected duration of the command to get the timeout fallback
+         :params: min_fraction of the expected duration after which a drone never seen moving can be settled
+                  (a move starting late, like a takeoff spin-up, is not mistaken for a completed one)
+        """
+        self.speed_tolerance = speed_tolerance
+        self.yaw_tolerance = yaw_tolerance
+        self.height_tolerance = height_tolerance
+        self.settle_time = settle_time
+        self.min_wait = min_wait
+        self.min_samples = min_samples
+        self.poll = poll
+        self.timeout_factor = timeout_factor
+        self.min_fraction = min_fraction
+
+    def is_settled(self, window: dict):
+        """True if the drone did not move during the whole window"""
+        if len(window['timestamp']) < self.min_samples:
+            return False
+        return self._is_still(window)
+
+    def _is_still(self, window: dict):
+        speeds = np.abs(np.stack((window['vgx'], window['vgy'], window['vgz'])))
+        yaw_drift = (window['yaw'] - window['yaw'][0] + 180) % 360 - 180
+        return bool(speeds.max() <= self.speed_tolerance
+                    and np.abs(yaw_drift).max() <= self.yaw_tolerance
+                    and np.ptp(window['h']) <= self.height_tolerance)
+
+    def wait(self, buffer: TelemetryBuffer, since: float, expected: float, stop=None):
+        """
+        Block until the drone is settled, return False if the timeout (expected duration * timeout_factor) expired
+         :params: since is the monotonic time at which the command was sent
+         :params: stop is an optional threading.Event interrupting the wait
+        """
+        deadline = since + max(expected * self.timeout_factor, self.min_wait + self.settle_time)
+        moved = False
+        while monotonic() < deadline:
+            now = monotonic()
+            window = buffer.window(self.settle_time, now=now)
+            recent = window['timestamp'] >= since
+            # Windows overlap from one poll to the next, any motion after the command is seen
+            if not moved and recent.sum() >= 2:
+                moved = not self._is_still({field: values[recent] for field, values in window.items()})
+            started = moved or now >= since + self.min_fraction * expected
+            if (started and len(window['timestamp']) and window['timestamp'][0] >= since + self.min_wait
+                    and self.is_settled(window)):
+                return True
+            if stop is None:
+                sleep(self.poll)
+            elif stop.wait(self.poll):
+                return False
+        return False
@@ -0,0 +1,170 @@
+"""
+Background export of the state records to columnar files for offline analysis
+The receive loops only push records in a queue, a writer thread batches them and writes row groups
+Parquet is used when pyarrow is installed, else NPZ or CSV
+"""
+
+import os
+import queue
+from datetime import datetime
+from itertools import count
+from threading import Thread
+from time import monotonic, time
+import numpy as np
+
+from telemetry import TelemetryBuffer
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except (ModuleNotFoundError, ImportError):
+    PYARROW_AVAILABLE = False
+else:
+    PYARROW_AVAILABLE = True
+
+__all__ = ['TelemetryExporter', 'PYARROW_AVAILABLE']
+
+# timestamp is the monotonic time of the reception, wall_time the same instant as a Unix time
+COLUMNS = ('drone', 'wall_time') + TelemetryBuffer.COLUMNS
+FORMATS = ('parquet', 'npz', 'csv')
+# Full precision for the times (a monotonic clock soon has more than 6 digits before the point)
+CSV_FORMATS = ['%d', '%.6f', '%.6f'] + ['%.6g'] * (len(COLUMNS) - 3)
+
+
+class TelemetryExporter:
+    """Write the states of every drone to rotating columnar files from a background thread"""
+    def __init__(self, directory: str = None, file_format: str = None, batch_size: int = 500,
+                 flush_interval: float = 5.0, max_file_size: int = 64 * 1024**2, max_file_age: float = 3600):
+        """
+         :params: file_format is 'parquet', 'npz' or 'csv' (default parquet if pyarrow is available, else npz)
+         :params: batch_size is the number of rows of a row group, flush_interval forces a write after some seconds
+         :params: max_file_size (bytes) and max_file_age (seconds) trigger the rotation of the output file
+        """
+        if directory is None:
+            dir_path = os.path.dirname(os.path.realpath(__file__))
+            directory = os.path.sep.join((dir_path, 'telemetry'))
+        if file_format is None:
+            file_format = 'parquet' if PYARROW_AVAILABLE else 'npz'
+        if file_format not in FORMATS:
+            raise ValueError(f'Unknown telemetry format {file_format}, choose one of {FORMATS}')
+        if file_format == 'parquet' and not PYARROW_AVAILABLE:
+            print('pyarrow is not installed, telemetry is exported as npz')
+            file_format = 'npz'
+
+        self.directory = directory
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_file_size = max_file_size
+        self.max_file_age = max_file_age
+        self.closed = False
+        self.files = []
+        # Offset between the monotonic timestamps of the states and the wall clock
+        self.wall_offset = time() - monotonic()
+
+        self._queue = queue.SimpleQueue()
+        self._file_counter = count()
+        self._path = self._writer = None
+        self._opened_at = 0.0
+        self._written_bytes = 0
+        # Row groups waiting for the rotation of an npz file
+        self._npz_batches = []
+
+        self._thread = Thread(target=self._run, name='telemetry-export', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def push(self, drone_index: int, state):
+        """Queue one state record, cheap enough to be called from the receive loops"""
+        if not self.closed:
+            self._queue.put((drone_index, state))
+
+    def close(self, timeout: float = 10):
+        """Write the pending records and close the current file"""
+        if not self.closed:
+            self.closed = True
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        """Writer thread, batch records until batch_size rows or flush_interval seconds"""
+        rows = []
+        last_flush = monotonic()
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                running = False
+            elif item:
+                drone_index, state = item
+                rows.append([drone_index, state.timestamp + self.wall_offset]
+                            + [getattr(state, column) for column in TelemetryBuffer.COLUMNS])
+
+            if rows and (not running or len(rows) >= self.batch_size or monotonic() - last_flush >= self.flush_interval):
+                self._write_batch(np.array(rows, dtype=np.float64))
+                rows = []
+                last_flush = monotonic()
+        self._close_file()
+
+    def _new_path(self):
+        """Collision-free name of the next output file"""
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        name = f'telemetry-{timestamp}-{next(self._file_counter):03d}.{self.file_format}'
+        return os.path.sep.join((self.directory, name))
+
+    def _open_file(self):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        self._path = self._new_path()
+        self._opened_at = monotonic()
+        self._written_bytes = 0
+        if self.file_format == 'csv':
+            self._writer = open(self._path, 'w')
+            self._writer.write(','.join(COLUMNS) + '\n')
+
+    def _close_file(self):
+        if self._path is None:
+            return
+        if self.file_format == 'npz' and self._npz_batches:
+            data = np.concatenate(self._npz_batches)
+            np.savez_compressed(self._path, **dict(zip(COLUMNS, data.T)))
+            self._npz_batches = []
+        elif self._writer is not None:
+            self._writer.close()
+        self.files.append(self._path)
+        self._path = self._writer = None
+
+    def _write_batch(self, batch):
+        """Write one row group, rotating the file when it is too big or too old"""
+        if self._path is not None and (self._written_bytes >= self.max_file_size
+                                       or monotonic() - self._opened_at >= self.max_file_age):
+            self._close_file()
+        if self._path is None:
+            self._open_file()
+
+        try:
+            if self.file_format == 'parquet':
+                table = pa.table({column: batch[:, index] for index, column in enumerate(COLUMNS)})
+                if self._writer is None:
+                    self._writer = pq.ParquetWriter(self._path, table.schema)
+                self._writer.write_table(table)
+            elif self.file_format == 'csv':
+                np.savetxt(self._writer, batch, delimiter=',', fmt=CSV_FORMATS)
+                self._writer.flush()
+            else:
+                self._npz_batches.append(batch)
+        except OSError as exc:
+            print(f'Could not export telemetry to {self._path} : {exc}')
+            return
+        if self.file_format == 'npz':
+            self._written_bytes += batch.nbytes
+        else:
+            self._written_bytes = os.path.getsize(self._path)
@@ -6,10 +6,14 @@ The _end_connection flag is raised when the ack is bad or when the drone is unre
 
 import sys
 import socket
-from time import sleep
+import logging
+from time import perf_counter, monotonic
 from PIL import Image
 
 from abstract_drone import AbstractDrone, AV_AVAILABLE, LIB_AVAILABLE
+from telemetry import parse_state, TelemetryBuffer
+from event_log import log_event
+from tracing import span
 
 class TelloEDU(AbstractDrone):
     """Class created to interact with the drone"""
@@ -28,6 +32,9 @@ class TelloEDU(AbstractDrone):
             # print('The connected Tello is the Tello with IP : ' + tello_address)
 
         self.tello_address = (tello_address, 8889)
+        #Store the last state of the drone
+        self.last_parameters = [None]
+        self.telemetry = [TelemetryBuffer(self.telemetry_capacity)]
         self._end_connection = self.test_drone_connection()
         if self.is_connected:
             print(self)
@@ -40,18 +47,31 @@ class TelloEDU(AbstractDrone):
     def __len__(self):
         return int(self.is_connected)
 
+    @property
+    def ip_addresses(self):
+        return [self.tello_address[0]]
+
     def init_commands(self):
         """Init drone SDK"""
         self.send('command')
+        #The drone sends its state and video to 8890 / 11111 unless told otherwise
+        port_sent = {}
+        if self.state_port != 8890 or self.video_port != 11111:
+            port_sent[0] = monotonic()
+            self.send(f'port {self.state_port} {self.video_port}')
         #Enable video streaming
         if self.video_stream:
             self.send('streamon')
+        if port_sent:
+            self.check_port(port_sent)
 
     def test_drone_connection(self):
         """
         Test if the drone is still connected
         Return True if the connection should end
         """
+        if not self.check_connection:
+            return False
         connected = self.still_connected(self.tello_address[0])
         if not connected:
             print('Drone is not reachable')
@@ -60,39 +80,60 @@ class TelloEDU(AbstractDrone):
     def send(self, message, index: int = 0):
         """Send message to drone using UDP Socket"""
         try:
-            self.command_socket.sendto(message.encode(), self.tello_address)
+            with span('send', 'command', drone=index, command=message):
+                # Registered first, the ack can't arrive before its command is known
+                self.command_sent(index, message)
+                self.command_socket.sendto(message.encode(), self.tello_address)
         except (OSError, IndexError):
-            self._end_connection = True
             print(f'{index}-Socket has already been closed')
+            self.end_connection = True
         else:
-            print(f'Drone {index} - Sending message: {message}')
+            log_event('send', logging.INFO, 'Drone %s - Sending message: %s', index, message)
             self.all_instructions.append(str(index) + '-' + message)
         finally:
-            self.end_connection = self.test_drone_connection()
+            with span('connection check', 'command', drone=index):
+                self.end_connection = self.test_drone_connection()
 
     def receive_ack(self):
         """Use UDP socket to receive ack from each command we sended"""
         while self.is_connected:
             try:
                 response, _ = self.command_socket.recvfrom(2048)
-                print(f'Received message : {response.decode("utf-8", "ignore")}')
             except (socket.timeout, ConnectionResetError, OSError):
-                self._end_connection = True
-                print('Drone is not reachable anymore')
+                if not self.shutdown_event.is_set():
+                    print('Drone is not reachable anymore')
+                    self.end_connection = True
+                break
+            # Woken up by end_connection
+            if self.shutdown_event.is_set():
+                break
+            response = response.decode("utf-8", "ignore")
+            self.record_ack(0, response)
+            log_event('ack', logging.INFO, 'Received message : %s', response)
         # print('ack thread done')
 
     def receive_state(self, parameters):
-        """Use UDP socket to receive all infos from the state channel"""
-        sleep(2)
+        """Use UDP socket to receive all infos from the state channel, every packet is parsed"""
         while self.is_connected:
             try:
                 last_state, _ = self.state_socket.recvfrom(2048)
-                parameters = last_state.decode().split(';')[:-1]
-                print(f'0-parameters : {parameters}')
-                sleep(3)
-            except Exception as exc:
-                print(f'Error receiving: {exc}')
-                print('Drone is not reachable anymore')
+            except OSError as exc:
+                if not self.shutdown_event.is_set():
+                    log_event('state', logging.ERROR, 'Error receiving: %s - Drone is not reachable anymore', exc)
+                break
+            if self.shutdown_event.is_set():
+                break
+            try:
+                state = parse_state(last_state)
+            except ValueError as exc:
+                log_event('state', logging.WARNING, 'Ignored state packet: %s', exc)
+                continue
+            # Swapping the reference is atomic so readers don't need any lock
+            parameters[0] = state
+            self._metrics.state_received(0, state.timestamp)
+            self.telemetry[0].append(state)
+            if self.telemetry_exporter is not None:
+                self.telemetry_exporter.push(0, state)
 
     def receive_frame(self):
         """
@@ -101,32 +142,41 @@ class TelloEDU(AbstractDrone):
         """
         print('If you are not directly connected to drone Wifi, Video Stream is impossible')
         all_data = b''
-        sleep(4)
+        # Let the drone start the stream, unless the connection is closed meanwhile
+        if self.shutdown_event.wait(4):
+            return
         while self.is_connected:
             try:
                 rcv_bytes, _ = self.videostream_socket.recvfrom(2048)
-
-                all_data += rcv_bytes
-                self.video_frames.add_data(rcv_bytes)
-
-                # If it's the ending frame of a picture
-                if len(rcv_bytes) != 1460:
+            except socket.timeout:
+                continue
+            except OSError as exc:
+                if not self.shutdown_event.is_set():
+                    log_event('video', logging.ERROR, 'Video stream stopped: %s', exc)
+                break
+            if self.shutdown_event.is_set():
+                break
+
+            all_data += rcv_bytes
+            self._metrics.video_packet()
+            self.video_frames.add_data(rcv_bytes)
+
+            # If it's the ending frame of a picture
+            if len(rcv_bytes) != 1460:
+                decode_start = perf_counter()
+                frames = []
+                with span('decode', 'video', size=len(all_data)):
                     if LIB_AVAILABLE:
                         ## IMAGE PROCESSING | Input = h264
-                        for frame in self.process_frame(all_data):
-                            picture = Image.fromarray(frame)
-                            self.last_frame = picture
-                    if AV_AVAILABLE:
+                        frames = self.process_frame(all_data)
+                    elif AV_AVAILABLE:
                         ## IMAGE PROCESSING | Input = h264
-                        for frame in self.process_frame():
-                            picture = Image.fromarray(frame)
-                            self.last_frame = picture
-                    all_data = b''
-
-            except KeyboardInterrupt as exc:
-                print(exc)
-            except OSError:
-                pass
+                        frames = self.process_frame()
+                self._metrics.frames_decoded(perf_counter() - decode_start, len(frames))
+                with span('to image', 'video', frames=len(frames)):
+                    for frame in frames:
+                        self.update_last_frame(Image.fromarray(frame))
+                all_data = b''
         print('frame thread done')
 
 if __name__ == '__main__':
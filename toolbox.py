@@ -5,6 +5,12 @@ Usefull tool box to store some functions call by TelloEDu and Swarm functions
 
 __all__ = ['reverse_actions', 'back_to_base', 'command_from_key']
 
+# Keys bound to drone commands, built once : Tk keycodes of the arrows and chars (terminal arrows send H A M C P B K D)
+KEYMAP = {111: 'forward 30', 113: 'left 30', 114: 'right 30', 116: 'back 30',
+          'a': 'sn?', ' ': 'takeoff', '+': 'land', '8': 'up 30', '2': 'down 30', '6': 'cw 30', '4': 'ccw 30',
+          'b': 'battery?', 'f': 'flip f', 'H': 'forward 30', 'A': 'forward 30', 'M': 'right 30', 'C': 'right 30',
+          'P': 'back 30', 'B': 'back 30', 'K': 'left 30', 'D': 'left 30'}
+
 def reverse_actions(actions: list):
     """
     Reverse the action list to an other action list with opposite cammands
@@ -21,20 +27,18 @@ def reverse_actions(actions: list):
     complex_actions = ['go', 'curve', 'jump']
 
     for action in actions[::-1]:
-        try:
-            drone_id = action.split('-')[0] + '-'
-            command = action.split('-')[1].split(' ')[0]
-        except IndexError:
+        # Values can be negative ('0-go -20 30 0 10'), only the first dash separates the drone index
+        head, _, body = action.partition('-')
+        if head.isdigit():
+            drone_id = head + '-'
+        else:
             # TelloEDU not using drone index
             drone_id = ''
-            command = action
-        values = []
+            body = action
+        command, *values = body.split(' ')
         if command in ign_statements:
             print('out : ' +command)
             continue
-        #If this is a command with parameters
-        if len(action.split(' ')) > 1:
-            values = action.split('-')[1].split(' ')[1:]
         #If there is a simple contrary already in the dict
         if command in contrary_dict.keys():
             if values:
@@ -49,8 +53,7 @@ def reverse_actions(actions: list):
                     values[index] = str(-1 * int(value))
                 action = drone_id + 'go ' + ' '.join(values)
             if command == 'curve':
-                #Not implemented yet
-                action = 'Undefined curve'
+                action = drone_id + reverse_curve(values)
         else:
             #It should be a flip
             if command == 'flip':
@@ -61,6 +64,18 @@ def reverse_actions(actions: list):
         reversed_list.append(action)
     return reversed_list
 
+def reverse_curve(values: list):
+    """
+    Fly the same arc backward : from the end, through the same middle point, to the start
+    A middle point closer than 20 cm on every axis is refused by the SDK, the way back is then a straight line
+    """
+    x1, y1, z1, x2, y2, z2 = (int(value) for value in values[:6])
+    speed = values[6:7] or ['10']
+    middle = (x1 - x2, y1 - y2, z1 - z2)
+    if all(-20 <= value <= 20 for value in middle):
+        return f'go {-x2} {-y2} {-z2} {speed[0]}'
+    return f'curve {" ".join(str(value) for value in middle)} {-x2} {-y2} {-z2} {speed[0]}'
+
 def back_to_base(func):
     """ Decorator for all drone manipulation modes """
     def wrapper(self, *args, **kwargs):
@@ -76,14 +91,6 @@ def back_to_base(func):
     return wrapper
 
 def command_from_key(key):
-    """Return the command correspondign to the key typed (like a giant dictionnary)"""
-    dict_int_commands = {111: 'forward 30', 113: 'left 30', 114: 'right 30', 116: 'back 30'}
-    dict_str_commands = {'a': 'sn?', ' ': 'takeoff', '+' : 'land', '8': 'up 30', '2': 'down 30', '6': 'cw 30',
-          '4': 'ccw 30', 'b': 'battery?', 'f': 'flip f', 'H': 'forward 30', 'A': 'forward 30', 'M': 'right 30',
-          'C': 'right 30', 'P': 'back 30', 'B': 'back 30', 'K': 'left 30', 'D': 'left 30'}
-
-    res_action = dict_int_commands.get(key)
-    if res_action is None:
-        return dict_str_commands.get(key)
-    return res_action
+    """Return the command corresponding to the key typed (char or Tk keycode), None if the key is not bound"""
+    return KEYMAP.get(key)
 
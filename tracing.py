@@ -0,0 +1,131 @@
+"""
+Opt-in tracing of the stages of a flight (send, connection check, ack wait, sleeps, decoding, UI rendering)
+Spans are kept in a bounded in-memory buffer and dumped as Chrome trace JSON, open it in chrome://tracing
+or https://ui.perfetto.dev to see the timeline of every thread
+
+    TRACER.enable()
+    with span('send', 'command', drone=0):
+        ...
+    TRACER.dump('flight.trace.json')
+
+While tracing is disabled span() returns a shared no-op context manager
+"""
+
+import os
+import json
+import threading
+from time import perf_counter_ns
+from collections import deque
+
+__all__ = ['Tracer', 'TRACER', 'span', 'instant']
+
+
+class _NullSpan:
+    """Context manager doing nothing, used while tracing is disabled"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer, name: str, category: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = perf_counter_ns()
+        thread_id = threading.get_ident()
+        if thread_id not in self.tracer.thread_names:
+            self.tracer.thread_names[thread_id] = threading.current_thread().name
+        # deque.append is atomic, no lock is needed between the threads
+        self.tracer.events.append(('X', self.name, self.category, self.start, end - self.start, thread_id, self.args))
+        return False
+
+
+class Tracer:
+    """Bounded buffer of begin/end spans of every thread"""
+    def __init__(self, max_events: int = 1000000):
+        self.enabled = False
+        self.events = deque(maxlen=max_events)
+        self.thread_names = {}
+        self._origin = perf_counter_ns()
+
+    def enable(self, max_events: int = None):
+        """Start recording (max_events resizes the buffer, the oldest events are dropped first)"""
+        if max_events is not None and max_events != self.events.maxlen:
+            self.events = deque(self.events, maxlen=max_events)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self.events.clear()
+        self._origin = perf_counter_ns()
+
+    def span(self, name: str, category: str = 'drone', **args):
+        """Context manager recording the duration of its block"""
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def instant(self, name: str, category: str = 'drone', **args):
+        """Record a single point in time"""
+        if self.enabled:
+            thread_id = threading.get_ident()
+            self.thread_names.setdefault(thread_id, threading.current_thread().name)
+            self.events.append(('i', name, category, perf_counter_ns(), 0, thread_id, args))
+
+    def to_chrome(self):
+        """Events in the Chrome trace event format (timestamps in microseconds)"""
+        pid = os.getpid()
+        trace_events = []
+        thread_ids = set()
+        for phase, name, category, start, duration, thread_id, args in list(self.events):
+            event = {'name': name, 'cat': category, 'ph': phase, 'ts': (start - self._origin) / 1000,
+                     'pid': pid, 'tid': thread_id}
+            if phase == 'X':
+                event['dur'] = duration / 1000
+            else:
+                event['s'] = 't'
+            if args:
+                event['args'] = {key: value if isinstance(value, (int, float, bool)) else str(value)
+                                 for key, value in args.items()}
+            trace_events.append(event)
+            thread_ids.add(thread_id)
+
+        # Name the timelines after the threads
+        for thread_id in thread_ids:
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                                 'args': {'name': self.thread_names.get(thread_id, str(thread_id))}})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path: str):
+        """Write the trace JSON file, return its path"""
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as trace_file:
+            json.dump(self.to_chrome(), trace_file)
+        return path
+
+
+TRACER = Tracer()
+span = TRACER.span
+instant = TRACER.instant
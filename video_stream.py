@@ -1,3 +1,8 @@
+import logging
+
+from event_log import log_event
+
+
 class VideoStream(object):
     def __init__(self):
         self.queue = []
@@ -10,13 +15,13 @@ class VideoStream(object):
     def read(self, size):
         # Default argument only called once
         data = bytes()
-        print(len(self.queue))
+        log_event('video', logging.DEBUG, 'Video queue : %s packets', len(self.queue))
         try:
             while self.queue and len(data) + len(self.queue[0]) < size:
                 data = data + self.queue[0]
                 del self.queue[0]
         except Exception as exc:
-            print(exc)
+            log_event('video', logging.WARNING, 'Video queue read failed: %s', exc)
         return data
 
     def seek(self, offset, whence):
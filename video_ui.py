@@ -4,26 +4,48 @@
 import os
 import tkinter as tk
 from tkinter import PhotoImage, TclError
-from time import sleep
-from threading import Thread
+from time import monotonic
+from collections import deque
 from PIL import ImageTk
 
-from toolbox import command_from_key
+from image_hash import PerceptualIndex
+from rc_control import RcController
+from key_input import KeyDispatcher
+from tracing import span
 from tello_edu import TelloEDU
 
 
 class VideoUI:
     """Embeded Tkinter ineterface and drone control"""
-    def __init__(self, drone):
+    def __init__(self, drone, max_fps: int = 30, display_size: tuple = None, show_overlay: bool = True,
+                 rc_control: bool = False):
+        """
+         :params: max_fps caps how often the video panel is refreshed
+         :params: display_size is an optional (width, height) box the frames are downscaled to
+         :params: show_overlay displays the rendering fps and frame latency under the video
+         :params: rc_control streams the moves as rc sticks while their key is held (see rc_control.py)
+        """
         self.drone = drone
         self.pictures = []
-        self.video_thread = self.ka_thread = None
+        self.picture_index = PerceptualIndex()
+        self.rc_controller = RcController(drone, indices=[0]) if rc_control else None
+        # Commands are sent from the dispatcher thread, the Tk thread only queues the presses
+        self.key_dispatcher = KeyDispatcher(drone, indices=[0])
+
+        # Rendering is scheduled on the Tk thread with root.after()
+        self.frame_interval = max(1, int(1000 / max_fps))
+        self.display_size = display_size
+        self.show_overlay = show_overlay
+        self._rendered_seq = 0
+        self._render_times = deque(maxlen=30)
 
         # UI
         self.window_is_open = False
         self.root = tk.Tk()
         self.root.wm_title("VideoUI")
         self.root.bind("<Key>", self.keys)
+        if self.rc_controller is not None:
+            self.root.bind("<KeyRelease>", self.key_released)
         self.root.bind("<Control-Key>", self.quit)
         self.root.protocol("WM_DELETE_WINDOW", self.quit)
         self.panel = None
@@ -36,12 +58,13 @@ class VideoUI:
         else:
             path = os.path.sep.join((picture_path, 'loading.png'))
             self.frame = PhotoImage(file=path)
-            # Timeout to kill concurent threads
-            self.drone.command_socket.settimeout(11)
 
         self.tkframe = None
         self.panel = tk.Label(self.root, image=self.frame)
         self.panel.pack()
+        self.overlay = tk.Label(self.root, text='')
+        if self.show_overlay:
+            self.overlay.pack()
 
     def __del__(self):
         """Deleting the drone drone reference"""
@@ -50,8 +73,7 @@ class VideoUI:
     @property
     def threads_alive(self):
         """Return the number of threads still alived"""
-        existing_threads = [thread for thread in (self.video_thread, self.ka_thread) if thread is not None]
-        return len([thread for thread in existing_threads if thread.isAlive()])
+        return int(self.drone.keep_alive.running)
 
     def show_bindings(self):
         """Display keybindings on the UI"""
@@ -86,76 +108,90 @@ class VideoUI:
         key = event.char
         keycode = event.keycode
 
+        with span('key', 'ui', key=key):
+            if self.rc_controller is not None and (self.rc_controller.press(key) or self.rc_controller.press(keycode)):
+                return
+            self._dispatch_key(key, keycode)
+
+    def key_released(self, event):
+        """Sticks go back to zero when their key is released"""
+        self.rc_controller.release(event.char)
+        self.rc_controller.release(event.keycode)
+
+    def _dispatch_key(self, key: str, keycode: int):
+        """Send the command bound to the key or take a picture"""
         if key == 'p':
-            self.pictures.append(self.drone.take_picture())
-            self.drone.save_pictures(self.pictures) # Rewriting each time
-        elif command_from_key(key) is not None:
-            command = command_from_key(key)
-            self.drone.execute_actions([f'0-{command}'])
-        elif command_from_key(keycode) is not None:
-            command = command_from_key(keycode)
-            self.drone.execute_actions([f'0-{command}'])
-        else:
+            picture = self.drone.take_picture()
+            if self.picture_index.add(picture):
+                self.pictures.append(picture)
+                # Only the new capture is queued, encoding happens off the Tk thread
+                self.drone.save_picture(picture)
+            else:
+                print('Picture looks like one already taken, dropped')
+        elif not self.key_dispatcher.push(key, keycode):
             print(f'{key} is not bind to an action')
 
-    def _keep_alive(self):
-        """Simple thread to be sure the drone will not try to land after a short time without command received"""
-        while self.drone.is_connected and self.window_is_open:
-            self.drone.execute_actions(['0-command'])
-            sleep(10)
-        print('keep alive done')
-        self.drone.end_connection = True
-
-        path = os.path.sep.join((self.dir_path, 'offline.png'))
-        tk.Label(self.root, image=path).pack()
-
-
-    def _video_stream(self):
-        """Image recepting thread"""
-        while self.drone.is_connected and self.window_is_open:
-            self.tkframe = self.frame
-            if self.drone.take_picture() is not None:
-                self.frame = self.drone.take_picture()
-                try:
-                    # This may lead to blocking call ...
-                    self.tkframe = ImageTk.PhotoImage(self.frame)
-                except RuntimeError:
-                    print('Last frame was incomplete')
-            ### Problem : blocking function call
-
-            #This should be an asynchronous call (indications about future image)
-            self.panel.configure(image=self.tkframe)
-            #This is the real affectation
-            self.panel.image = self.tkframe
-        self.drone.end_connection = True
-        print('video down')
 
-        # Test if panel is None after destruct
+    def _render(self):
+        """Refresh the video panel from the Tk thread, only converting frames that were not displayed yet"""
+        if not (self.drone.is_connected and self.window_is_open):
+            self.drone.end_connection = True
+            print('video down')
+            return
+
+        frame_seq = self.drone.frame_seq
+        if frame_seq != self._rendered_seq:
+            with span('render', 'ui', frame=frame_seq):
+                frame = self.drone.take_picture()
+                if frame is not None:
+                    if self.display_size is not None:
+                        frame = frame.copy()
+                        frame.thumbnail(self.display_size)
+                    try:
+                        self.tkframe = ImageTk.PhotoImage(frame)
+                    except RuntimeError:
+                        print('Last frame was incomplete')
+                    else:
+                        self.panel.configure(image=self.tkframe)
+                        # Keep a reference else the image is garbage collected
+                        self.panel.image = self.tkframe
+                        self._render_times.append(monotonic())
+            self._rendered_seq = frame_seq
+
+        if self.show_overlay:
+            self._update_overlay()
+        self.root.after(self.frame_interval, self._render)
+
+    def _update_overlay(self):
+        """Display rendering fps and the age of the last displayed frame"""
+        elapsed = self._render_times[-1] - self._render_times[0] if self._render_times else 0
+        fps = (len(self._render_times) - 1) / elapsed if elapsed > 0 else 0.0
+        latency = (monotonic() - self.drone.last_frame_time) * 1000 if self.drone.last_frame_time else 0.0
+        self.overlay.configure(text=f'{fps:.1f} fps | frame age {latency:.0f} ms')
 
     def open(self):
         """Main method used to open the UI"""
         if self.drone.is_connected:
             self.window_is_open = True
-            # Threads
-            self.ka_thread = Thread(target=self._keep_alive)
-            self.ka_thread.start()
+            # The drone will not land by itself while the window is open (see keep_alive.py)
+            self.drone.keep_alive.start()
+            self.key_dispatcher.start()
+            if self.rc_controller is not None:
+                self.rc_controller.start()
 
-            self.video_thread = Thread(target=self._video_stream)
-            self.video_thread.start()
+            self.root.after(0, self._render)
 
             self.show_bindings()
 
         self.root.mainloop()
-        self.drone.end_connection = True
+        self.window_is_open = False
+        self.key_dispatcher.close()
+        if self.rc_controller is not None:
+            # Last rc command is a zero one so the drone hovers
+            self.rc_controller.close()
+        # Wakes up and joins the receiving threads of the drone
+        self.drone.close()
         print('windows done')
-
-        # Manually kill the thread (tkinter issue)
-
-        while self.drone.threads_alive or self.threads_alive:
-            sleep(1)
-            print(self.drone.threads_alive)
-            print(self.threads_alive)
-        print('not drone here')
         del self.drone
 
 if __name__ == "__main__":